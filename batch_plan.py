@@ -0,0 +1,217 @@
+"""
+Offline batch generation: reads fully specified trip requests from a JSONL
+file, validates them, generates the answers in a pool of worker processes
+and appends one result per line to an output JSONL file.
+
+Each input line holds an "id", the "service" number and the fields of that
+service, e.g.
+    {"id": "hotel-17", "service": "3", "city": "Rome", "people": 2, "budget": 900, "days": 4}
+
+Both files are streamed, so the input can be arbitrarily large. Rerunning
+with the same output file skips the ids that already have an "ok" or
+"invalid" result, so an interrupted run resumes where it stopped and
+failed rows are retried. Every field of the service is required, and rows
+repeating an id already read are rejected.
+
+Example:
+    python batch_plan.py partner_hotels.jsonl guides.jsonl --workers 16
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ProcessPoolExecutor, wait
+from trip_plan import SERVICE_FLOWS
+from validate_user_input import SERVICE_SCHEMAS, SERVICE_VALIDATORS
+
+# Statuses that count as done when resuming
+FINISHED_STATUSES = ("ok", "invalid")
+
+
+def finished_ids(output_path):
+    """Returns the ids that already have a final result in the output file."""
+    finished = set()
+    if not os.path.exists(output_path):
+        return finished
+    with open(output_path, encoding="utf-8") as output:
+        for line in output:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue  # Partial last line of an interrupted run
+            if result.get("status") in FINISHED_STATUSES:
+                finished.add(str(result.get("id")))
+    return finished
+
+
+def read_requests(input_path):
+    """
+    Yields (id, request) pairs from the input file. Lines that are not JSON
+    objects are yielded with request None. Lines without an id are named
+    after their line number.
+    """
+    with open(input_path, encoding="utf-8") as requests:
+        for number, line in enumerate(requests, 1):
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError:
+                request = None
+            if not isinstance(request, dict):
+                yield f"line-{number}", None
+                continue
+            yield str(request.get("id", f"line-{number}")), request
+
+
+def check_request(request):
+    """
+    Returns the list of validation errors of a request, empty if it is valid.
+    Unlike a conversation, a batch row cannot be asked for what it left out,
+    so every field of the service must be given.
+    """
+    if request is None:
+        return ["Malformed JSON."]
+    service = str(request.get("service", ""))
+    validator = SERVICE_VALIDATORS.get(service)
+    if validator is None:
+        return ["Unknown service."]
+    result = validator(request)
+    if not result["success"]:
+        return result["errors"]
+    details = flow_details(service, request, SERVICE_FLOWS[service].fields)
+    missing = [field for field, value in details.items() if value is None or not str(value).strip()]
+    return [f"Missing fields: {', '.join(missing)}."] if missing else []
+
+
+def flow_details(service, request, fields):
+    """
+    Returns the details of a request keyed by the conversation's field
+    names, reading each field from the first of the keys the service schema
+    accepts for it, e.g. "days" from "days_spent".
+    """
+    details = {}
+    for field in fields:
+        sources = next((schema_field.sources for schema_field in SERVICE_SCHEMAS[service]
+                        if field in schema_field.sources), (field,))
+        details[field] = next((request[source] for source in sources if request.get(source) is not None), None)
+    return details
+
+
+def preload_modules():
+    """
+    Imports the app and the OpenAI SDK in the parent, so that forked workers
+    share them instead of each spending most of a second importing them.
+    No clients are created here; each worker creates its own on first use.
+    """
+    if multiprocessing.get_start_method() == "fork":
+        import openai  # noqa: F401
+        import trip_plan  # noqa: F401
+
+
+def generate_answer(request_id, service, details):
+    """Generates one answer in a worker process and returns its result record."""
+    from trip_plan import TripPlanner, OPENAI_ERROR_PREFIX, get_usage_ledger
+
+    started_at = time.perf_counter()
+    planner = TripPlanner.from_details(service, flow_details(service, details, SERVICE_FLOWS[service].fields))
+    answer = planner.fetch_data_from_openai(planner.format_user_input())
+    # Worker processes exit without running atexit handlers, so nothing may stay buffered
+    try:
+        get_usage_ledger().flush()
+    except Exception as e:
+        # The answer is paid for; failing the row would pay for it again on the next run
+        print(f"Could not write the usage ledger: {e}", file=sys.stderr)
+    result = {"id": request_id, "service": service, "elapsed": round(time.perf_counter() - started_at, 3)}
+    if answer.startswith(OPENAI_ERROR_PREFIX):
+        result.update(status="error", error=answer[len(OPENAI_ERROR_PREFIX):])
+    else:
+        result.update(status="ok", answer=answer)
+    return result
+
+
+def run_batch(input_path, output_path, workers=8, max_pending=None, progress_every=100):
+    """
+    Processes every unfinished request of input_path and appends the results
+    to output_path. At most max_pending requests (twice the workers by
+    default) are read ahead of the results, which bounds memory use.
+
+    Rows repeating an id already read are counted as duplicates and not
+    processed, as their results could not be told apart.
+
+    Returns:
+    dict: Counts of skipped, ok, invalid, error and duplicate rows.
+    """
+    max_pending = max_pending or workers * 2
+    skip = finished_ids(output_path)
+    seen = set()
+    counts = {"skipped": 0, "ok": 0, "invalid": 0, "error": 0, "duplicate": 0}
+    started_at = time.perf_counter()
+    preload_modules()
+
+    with open(output_path, "a", encoding="utf-8") as output, \
+            ProcessPoolExecutor(max_workers=workers) as pool:
+
+        def write(result):
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output.flush()
+            counts[result["status"]] += 1
+            written = counts["ok"] + counts["invalid"] + counts["error"]
+            if progress_every and written % progress_every == 0:
+                rate = written / (time.perf_counter() - started_at)
+                print(f"{written} done ({rate:.1f}/s), {counts['error']} errors", file=sys.stderr)
+
+        def collect(pending, return_when):
+            done, pending = wait(pending, return_when=return_when)
+            for future in done:
+                request_id, service = pending_requests.pop(future)
+                try:
+                    write(future.result())
+                except Exception as e:
+                    write({"id": request_id, "service": service, "status": "error", "error": str(e)})
+            return pending
+
+        pending = set()
+        pending_requests = {}
+        for request_id, request in read_requests(input_path):
+            if request_id in seen:
+                counts["duplicate"] += 1
+                print(f"Skipping duplicate id {request_id}", file=sys.stderr)
+                continue
+            seen.add(request_id)
+            if request_id in skip:
+                counts["skipped"] += 1
+                continue
+            errors = check_request(request)
+            if errors:
+                service = request.get("service") if request else None
+                write({"id": request_id, "service": service, "status": "invalid", "errors": errors})
+                continue
+            service = str(request["service"])
+            future = pool.submit(generate_answer, request_id, service, request)
+            pending.add(future)
+            pending_requests[future] = (request_id, service)
+            if len(pending) >= max_pending:
+                pending = collect(pending, FIRST_COMPLETED)
+        collect(pending, ALL_COMPLETED)
+
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate trip answers for a JSONL file of requests.")
+    parser.add_argument("input", help="JSONL file of trip requests")
+    parser.add_argument("output", help="JSONL file the results are appended to")
+    parser.add_argument("--workers", type=int, default=8, help="worker processes")
+    parser.add_argument("--max-pending", type=int, help="requests read ahead of the results")
+    parser.add_argument("--progress-every", type=int, default=100, help="rows between progress lines")
+    args = parser.parse_args(argv)
+
+    counts = run_batch(args.input, args.output, args.workers, args.max_pending, args.progress_every)
+    print(json.dumps(counts))
+
+
+if __name__ == "__main__":
+    main()
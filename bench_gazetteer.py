@@ -0,0 +1,90 @@
+"""
+Benchmark of the destination gazetteer: load time, memory held by the
+index, and the cost of exact, alias, misspelled, unknown and repeated
+lookups.
+
+--synthetic adds generated destinations to the bundled ones, to see how
+the index behaves with a gazetteer the size of a world cities list.
+
+Example:
+    python bench_gazetteer.py
+    python bench_gazetteer.py --synthetic 25000
+"""
+import argparse
+import gc
+import os
+import random
+import string
+import tempfile
+import time
+import tracemalloc
+from gazetteer import Gazetteer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+QUERIES = {
+    "exact": ["Lisbon", "Barcelona", "Tokyo", "Cape Town", "Rio de Janeiro"],
+    "alias": ["NYC", "new york", "Lisboa", "saigon", "bombay"],
+    "misspelled": ["Barcelonna", "Copenhagn", "Amsterdan", "Florance", "Buenos Aries"],
+    "unknown": ["Atlantis", "Xyzzy", "Middle Earth", "Springfield", "Narnia"],
+}
+
+
+def write_synthetic(path, count, seed=1):
+    """Copies the gazetteer at path to a temporary file with count generated destinations appended."""
+    rng = random.Random(seed)
+    with open(path, encoding="utf-8") as gazetteer_file:
+        content = gazetteer_file.read().rstrip("\n") + "\n"
+    for index in range(count):
+        name = "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(5, 12))).title()
+        content += f"xx-{index},{name},XX,,,0.0,0.0,\n"
+    synthetic_file = tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False, encoding="utf-8")
+    with synthetic_file:
+        synthetic_file.write(content)
+    return synthetic_file.name
+
+
+def time_lookups(gazetteer, queries, repeat, memoized):
+    """Returns the mean microseconds per lookup."""
+    started_at = time.perf_counter()
+    for _ in range(repeat):
+        for query in queries:
+            if not memoized:
+                gazetteer._memo.clear()
+            gazetteer.lookup(query)
+    return (time.perf_counter() - started_at) / (repeat * len(queries)) * 1e6
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the destination gazetteer.")
+    parser.add_argument("--gazetteer", default=os.path.join(HERE, "destinations.csv"))
+    parser.add_argument("--synthetic", type=int, default=0, help="generated destinations to add")
+    parser.add_argument("--repeat", type=int, default=2000, help="lookups of each query")
+    args = parser.parse_args(argv)
+
+    path = write_synthetic(args.gazetteer, args.synthetic) if args.synthetic else args.gazetteer
+    tracemalloc.start()
+    gazetteer = Gazetteer.from_csv(path)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del gazetteer
+
+    started_at = time.perf_counter()
+    gazetteer = Gazetteer.from_csv(path)
+    load_time = time.perf_counter() - started_at
+    if args.synthetic:
+        os.unlink(path)
+    # Keep the collection triggered by loading out of the lookup timings
+    gc.collect()
+    stats = gazetteer.stats()
+    print(f"{stats['destinations']} destinations, {stats['names']} names, "
+          f"{stats['delete_variants']} delete variants")
+    print(f"load {load_time * 1000:.1f} ms, index memory {memory / 1024 / 1024:.2f} MiB")
+    print(f"{'lookup':<12} {'us/lookup':>10} {'memoized':>10}")
+    for kind, queries in QUERIES.items():
+        print(f"{kind:<12} {time_lookups(gazetteer, queries, args.repeat, False):>10.2f} "
+              f"{time_lookups(gazetteer, queries, args.repeat, True):>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Cold-start benchmark: how long importing the app modules, and creating the
+API clients for the first time, takes in a fresh interpreter.
+
+Example:
+    python bench_import.py --runs 10
+    python bench_import.py --module trip_plan --top 15
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Statements timed in a fresh interpreter, after the interpreter itself has started
+TARGETS = {
+    "trip_plan": "import trip_plan",
+    "service_handler": "import service_handler",
+    "flask-app": ("import importlib.util; "
+                  "spec = importlib.util.spec_from_file_location('flask_app', 'flask-app.py'); "
+                  "spec.loader.exec_module(importlib.util.module_from_spec(spec))"),
+    "openai client": "import clients; clients.get_openai_client()",
+    "twilio client": "import clients; clients.get_twilio_client()",
+    "gazetteer": "import trip_plan; trip_plan.get_gazetteer()",
+}
+
+TIMER = (
+    "import time; started_at = time.perf_counter(); {statement}; "
+    "print(time.perf_counter() - started_at)"
+)
+
+
+def time_statement(statement, env):
+    """Runs statement in a new interpreter and returns the seconds it took."""
+    output = subprocess.run(
+        [sys.executable, "-c", TIMER.format(statement=statement)],
+        cwd=HERE, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def slowest_imports(statement, env, top):
+    """Returns the top (cumulative microseconds, module) pairs from -X importtime."""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=HERE, env=env, capture_output=True, text=True, check=True
+    ).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line[len("import time:"):].split("|")
+        rows.append((int(cumulative), module.rstrip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure import and first-client construction time.")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per target")
+    parser.add_argument("--module", choices=sorted(TARGETS), help="only measure this target")
+    parser.add_argument("--top", type=int, default=0, help="also list the N slowest imports")
+    args = parser.parse_args(argv)
+
+    # Dummy credentials so the clients can be constructed without a .env file
+    env = dict(os.environ)
+    env.setdefault("OPENAI_API_KEY", "bench")
+    env.setdefault("ACCOUNT_SID", "AC" + "0" * 32)
+    env.setdefault("API_KEY_SID", "SK" + "0" * 32)
+    env.setdefault("API_KEY_SECRET", "bench")
+    env.setdefault("RESPONSE_CACHE_PATH", os.devnull)
+
+    targets = [args.module] if args.module else list(TARGETS)
+    print(f"{'target':<18}{'median ms':>12}{'min ms':>10}{'max ms':>10}")
+    for target in targets:
+        samples = [time_statement(TARGETS[target], env) * 1000 for _ in range(args.runs)]
+        print(f"{target:<18}{statistics.median(samples):>12.1f}{min(samples):>10.1f}{max(samples):>10.1f}")
+        if args.top:
+            for cumulative, module in slowest_imports(TARGETS[target], env, args.top):
+                print(f"{'':<4}{cumulative / 1000:>8.1f} ms  {module.strip()}")
+
+
+if __name__ == "__main__":
+    main()
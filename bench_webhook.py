@@ -0,0 +1,295 @@
+"""
+Load test and latency benchmark for the WhatsApp webhook.
+
+Starts local stand-ins for OpenAI and Twilio (see stub_services.py), serves
+flask-app.py on a local port and replays synthetic multi-turn WhatsApp
+conversations against /whatsapp-inbound at a target request rate.
+Reports p50/p95/p99 latency, throughput and errors per stage.
+
+Example:
+    python bench_webhook.py --rps 20 --duration 30 --openai-latency 1.5 --failure-rate 0.02
+    python bench_webhook.py --rps 20 --async-replies --reply-workers 8
+"""
+import argparse
+import importlib.util
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.serving import WSGIRequestHandler, make_server
+from stub_services import StageRecorder, StubOpenAI, StubRoutingHttpClient, StubTwilio
+
+CITIES = ["Lisbon", "Rome", "Paris", "Tokyo", "New York", "Barcelona", "Berlin", "Prague",
+          "Istanbul", "Bangkok", "London", "Amsterdam", "Vienna", "Mexico City", "Seoul", "Sydney"]
+CUISINES = ["sushi", "italian", "vegan", "seafood", "ramen", "tapas", "thai", "burgers"]
+PREFERENCES = ["monuments", "parks", "viewpoints"]
+BUDGETS = ["20", "40", "60", "100", "250", "800"]
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "flask-app.py")
+
+
+def synthetic_conversation(rng, cities):
+    """Returns the messages a user sends to get one answer, first to last."""
+    service = rng.choice(["1", "2", "3"])
+    city = rng.choice(cities)
+    budget = rng.choice(BUDGETS)
+    if service == "1":
+        return ["help", "1", city, rng.choice(CUISINES), budget]
+    if service == "2":
+        return ["help", "2", city, rng.choice(PREFERENCES), budget]
+    return ["help", "3", city, str(rng.randint(1, 6)), budget, str(rng.randint(1, 7))]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def load_app(openai_url, twilio_url, work_dir, args):
+    """Imports flask-app.py configured to talk to the stubs."""
+    os.environ.update({
+        "OPENAI_API_KEY": "stub",
+        "OPENAI_BASE_URL": openai_url,
+        "ACCOUNT_SID": "AC" + "0" * 32,
+        "API_KEY_SID": "SK" + "0" * 32,
+        "API_KEY_SECRET": "stub",
+        "PROXY_PHONE": "whatsapp:+10000000000",
+        "RESPONSE_CACHE_PATH": os.path.join(work_dir, "response_cache.sqlite3"),
+        "SESSION_STORE_PATH": os.path.join(work_dir, "sessions.sqlite3"),
+        "IDEMPOTENCY_STORE_PATH": os.path.join(work_dir, "idempotency.sqlite3"),
+        "CONVERSATION_INDEX_PATH": os.path.join(work_dir, "conversations.sqlite3"),
+        "VENUE_INDEX_PATH": os.path.join(work_dir, "venues.sqlite3"),
+        "PENDING_JOBS_PATH": os.path.join(work_dir, "pending_jobs.sqlite3"),
+        "USAGE_LEDGER_PATH": os.path.join(work_dir, "usage.sqlite3"),
+        "STRUCTURED_RESULTS": "1" if args.structured_results else "",
+        "ASYNC_REPLIES": "1" if args.async_replies else "",
+        "STREAM_REPLIES": "1" if args.stream_replies else "",
+        "REPLY_WORKERS": str(args.reply_workers),
+        "REPLY_QUEUE_SIZE": str(args.reply_queue_size),
+    })
+    spec = importlib.util.spec_from_file_location("flask_app", APP_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.get_twilio_client().http_client = StubRoutingHttpClient(twilio_url)
+    return module
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class Conversation:
+    def __init__(self, phone, turns):
+        self.phone = phone
+        self.turns = turns
+        self.index = 0
+
+
+class LoadGenerator:
+    """
+    Sends one conversation turn every 1/rps seconds (open loop). A user only
+    sends their next turn after the previous one has been answered, so many
+    conversations are in progress at once.
+    """
+
+    def __init__(self, url, twilio, args):
+        self.url = url
+        self.twilio = twilio
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.cities = CITIES[:args.cities]
+        self.recorder = StageRecorder()
+        self.ready = deque()
+        self.lock = threading.Lock()
+        self.conversations_started = 0
+        self.conversations_finished = 0
+        self.turns_finished = 0
+
+    def run(self):
+        pool = ThreadPoolExecutor(max_workers=self.args.concurrency)
+        started_at = time.perf_counter()
+        deadline = started_at + self.args.duration
+        next_tick = started_at
+        while next_tick < deadline:
+            with self.lock:
+                conversation = self.ready.popleft() if self.ready else None
+                if conversation is None:
+                    self.conversations_started += 1
+                    conversation = Conversation(
+                        f"whatsapp:+1555{self.conversations_started:07d}",
+                        synthetic_conversation(self.rng, self.cities)
+                    )
+            pool.submit(self.send_turn, conversation, next_tick)
+            next_tick += 1.0 / self.args.rps
+            time.sleep(max(0.0, next_tick - time.perf_counter()))
+        pool.shutdown(wait=True)
+        return time.perf_counter() - started_at
+
+    def send_turn(self, conversation, scheduled_at):
+        final = conversation.index == len(conversation.turns) - 1
+        stage = "webhook_generate" if final else "webhook_prompt"
+        data = urllib.parse.urlencode({
+            "Body": conversation.turns[conversation.index],
+            "From": conversation.phone,
+            "MessageSid": f"SM{conversation.phone[-7:]}{conversation.index:03d}",
+        }).encode()
+        sent_at = time.perf_counter()
+        error = None
+        body = ""
+        # Like Twilio, give up on a slow webhook after retry_after seconds and
+        # deliver the same message again
+        deliveries = 1 + self.args.retries if self.args.retry_after else 1
+        for delivery in range(deliveries):
+            last = delivery == deliveries - 1
+            timeout = self.args.timeout if last else self.args.retry_after
+            try:
+                with urllib.request.urlopen(self.url, data, timeout=timeout) as response:
+                    body = response.read().decode()
+                error = None
+                break
+            except urllib.error.HTTPError as e:
+                error = f"http_{e.code}"
+            except Exception as e:
+                error = type(e).__name__
+            if not last:
+                self.recorder.record("webhook_retry", time.perf_counter() - sent_at, error)
+                if error.startswith("http_"):
+                    time.sleep(min(self.args.retry_after, 1.0))
+        if error is None and "try again in a minute" in body:
+            error = "busy"
+        elif error is None and "Error" in body:
+            error = "generation_error"
+        # Latency is measured from the scheduled send time so that queueing in
+        # the load generator itself is not hidden
+        self.recorder.record(stage, time.perf_counter() - scheduled_at, error)
+
+        if error is None and self.args.async_replies:
+            arrived_at = self.twilio.wait_for_message(conversation.phone, sent_at, self.args.timeout)
+            reply_stage = "reply_generate" if final else "reply_prompt"
+            if arrived_at is None:
+                self.recorder.record(reply_stage, self.args.timeout, "not_delivered")
+            else:
+                self.recorder.record(reply_stage, arrived_at - sent_at)
+
+        with self.lock:
+            self.turns_finished += 1
+            conversation.index += 1
+            if error is not None or final:
+                # A failed turn ends the conversation, like a user giving up
+                self.conversations_finished += 1
+            else:
+                self.ready.append(conversation)
+
+
+def summarize(recorders, elapsed):
+    """Builds the per-stage report from several recorders."""
+    stages = {}
+    for recorder in recorders:
+        for stage, samples in recorder.samples.items():
+            errors = recorder.errors.get(stage, {})
+            stages[stage] = {
+                "count": len(samples),
+                "throughput": len(samples) / elapsed if elapsed else 0.0,
+                "p50": percentile(samples, 0.50),
+                "p95": percentile(samples, 0.95),
+                "p99": percentile(samples, 0.99),
+                "max": max(samples) if samples else 0.0,
+                "errors": sum(errors.values()),
+                "errors_by_type": errors,
+            }
+    return stages
+
+
+def print_report(report):
+    print(f"Duration {report['elapsed']:.1f}s, {report['turns']} turns "
+          f"({report['turns'] / report['elapsed']:.1f}/s), "
+          f"{report['conversations']} conversations finished")
+    print(f"{'stage':<20}{'count':>8}{'rps':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'errors':>8}")
+    for stage, row in sorted(report["stages"].items()):
+        print(f"{stage:<20}{row['count']:>8}{row['throughput']:>8.1f}"
+              f"{row['p50'] * 1000:>10.1f}{row['p95'] * 1000:>10.1f}"
+              f"{row['p99'] * 1000:>10.1f}{row['max'] * 1000:>10.1f}{row['errors']:>8}")
+        for error, count in sorted(row["errors_by_type"].items()):
+            print(f"{'':<20}  {error}: {count}")
+    print(f"{'service/source':<20}{'answers':>8}{'calls':>8}{'tokens':>10}{'searches':>10}{'cost $':>10}")
+    for row in report["usage"]:
+        print(f"{row['key'] + '/' + row['source']:<20}{row['requests']:>8}{row['calls']:>8}"
+              f"{row['input_tokens'] + row['output_tokens']:>10}{row['web_searches']:>10}{row['cost']:>10.4f}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load test /whatsapp-inbound against local OpenAI and Twilio stubs.")
+    parser.add_argument("--rps", type=float, default=10, help="target webhook requests per second")
+    parser.add_argument("--duration", type=float, default=20, help="seconds to generate load for")
+    parser.add_argument("--concurrency", type=int, default=200, help="max in-flight webhook requests")
+    parser.add_argument("--timeout", type=float, default=30, help="seconds before a turn counts as failed")
+    parser.add_argument("--cities", type=int, default=8, help="number of distinct cities (controls cache hit rate)")
+    parser.add_argument("--openai-latency", type=float, default=1.0, help="median stub OpenAI latency in seconds")
+    parser.add_argument("--openai-sigma", type=float, default=0.4, help="log-normal spread of the OpenAI latency")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of OpenAI calls that fail")
+    parser.add_argument("--twilio-latency", type=float, default=0.05, help="stub Twilio latency in seconds")
+    parser.add_argument("--async-replies", action="store_true", help="run the webhook with ASYNC_REPLIES")
+    parser.add_argument("--stream-replies", action="store_true", help="also set STREAM_REPLIES")
+    parser.add_argument("--structured-results", action="store_true",
+                        help="run the webhook with STRUCTURED_RESULTS (venue index)")
+    parser.add_argument("--reply-workers", type=int, default=4)
+    parser.add_argument("--reply-queue-size", type=int, default=32)
+    parser.add_argument("--retry-after", type=float, default=0,
+                        help="resend a turn with the same MessageSid after this many seconds, like Twilio")
+    parser.add_argument("--retries", type=int, default=1, help="resends per turn with --retry-after")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="also write the report to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    openai_stub = StubOpenAI(args.openai_latency, args.openai_sigma, args.failure_rate)
+    twilio_stub = StubTwilio(args.twilio_latency)
+    openai_url = openai_stub.start()
+    twilio_url = twilio_stub.start()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        app_module = load_app(openai_url, twilio_url, work_dir, args)
+        server = make_server("127.0.0.1", 0, app_module.create_app(), threaded=True,
+                             request_handler=QuietRequestHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_port}/whatsapp-inbound"
+
+        generator = LoadGenerator(url, twilio_stub, args)
+        elapsed = generator.run()
+
+        server.shutdown()
+        app_module.drain()
+        usage = app_module.get_usage_ledger().rollups()
+
+    openai_stub.stop()
+    twilio_stub.stop()
+
+    report = {
+        "elapsed": elapsed,
+        "turns": generator.turns_finished,
+        "conversations": generator.conversations_finished,
+        "stages": summarize([generator.recorder, openai_stub.recorder, twilio_stub.recorder], elapsed),
+        "usage": usage,
+        "options": vars(args),
+    }
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    main()
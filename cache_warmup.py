@@ -0,0 +1,163 @@
+"""
+Cache warm-up: precomputes answers for popular requests so that the first
+user asking about a top destination gets a cache hit instead of waiting
+for a web search.
+
+The spec is a JSON file listing, per service, the values to combine for
+each field, most popular first:
+
+    {
+      "1": {"location": ["Lisbon", "Porto"], "cuisine": ["seafood", "sushi"], "budget": [25, 50]},
+      "3": {"city": ["Rome"], "people": [2], "budget": [1000], "days": [3]}
+    }
+
+Every combination whose cache entry is missing, or expires within
+--refresh-ahead seconds, is generated again (refresh-ahead), at most
+--rate calls per second and within the --max-calls and --max-tokens
+spend budget. Budgets are best given as the budget bucket edges of
+response_cache.BUDGET_BUCKETS, since cache keys use the bucket.
+
+How much live traffic the warmed entries serve is reported by the app
+as warm_coverage in /openai-stats and as the warm_hit results of
+travelguru_response_cache_total.
+
+Example:
+    python cache_warmup.py top_destinations.json --rate 2 --max-calls 500
+    python cache_warmup.py top_destinations.json --every 3600
+"""
+import argparse
+import itertools
+import json
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from response_cache import WARMUP_SOURCE, make_cache_key
+from trip_plan import OPENAI_ERROR_PREFIX, SERVICE_FLOWS, TripPlanner, get_response_cache, get_usage_ledger
+from usage_ledger import UsageMeter
+
+
+def load_spec(path):
+    """Reads a warm-up spec and checks that it only names known services and fields."""
+    with open(path, encoding="utf-8") as spec_file:
+        spec = json.load(spec_file)
+    for service, values in spec.items():
+        if service not in SERVICE_FLOWS:
+            raise ValueError(f"Unknown service {service!r} in {path}")
+        unknown = set(values) - set(SERVICE_FLOWS[service].fields)
+        if unknown:
+            raise ValueError(f"Unknown fields {sorted(unknown)} for service {service} in {path}")
+    return spec
+
+
+def expand_spec(spec):
+    """
+    Yields (service, details) for every combination of the spec, in the
+    order the values are listed, so the most popular combinations come first.
+    """
+    for service, values in spec.items():
+        fields = SERVICE_FLOWS[service].fields
+        for combination in itertools.product(*(values.get(field) or [""] for field in fields)):
+            yield service, {field: str(value) for field, value in zip(fields, combination)}
+
+
+def run_warmup(spec, rate=1.0, max_calls=None, max_tokens=None, refresh_ahead=3600, workers=4):
+    """
+    Generates the missing and soon-to-expire entries of the spec.
+
+    Parameters:
+    spec (dict): Values per service and field, see load_spec().
+    rate (float): Maximum OpenAI calls started per second.
+    max_calls (int): Stop starting calls after this many; None for no limit.
+    max_tokens (int): Stop starting calls once the tokens used by this run,
+        plus those expected for the calls in flight, reach this many; None
+        for no limit.
+    refresh_ahead (float): Regenerate entries that expire within this many seconds.
+    workers (int): Calls in flight at the same time.
+
+    Returns:
+    dict: Counts of the combinations, and coverage, the fraction of them
+    that are fresh in the cache after the run.
+    """
+    report = {"combinations": 0, "invalid": 0, "fresh": 0, "generated": 0, "failed": 0, "over_budget": 0}
+    cache = get_response_cache()
+    prices = get_usage_ledger().prices
+    interval = 1.0 / rate if rate > 0 else 0.0
+    next_start = time.monotonic()
+    # Tokens of the calls of this run that finished, and how many finished
+    spent = {"tokens": 0, "calls": 0}
+    lock = threading.Lock()
+
+    def warm(planner):
+        meter = UsageMeter(prices)
+        response = planner.refresh_cached_answer(WARMUP_SOURCE, meter)
+        with lock:
+            report["failed" if response.startswith(OPENAI_ERROR_PREFIX) else "generated"] += 1
+            spent["tokens"] += meter.input_tokens + meter.output_tokens
+            spent["calls"] += 1
+
+    def over_token_budget(in_flight):
+        with lock:
+            tokens, finished = spent["tokens"], spent["calls"]
+        expected = in_flight * tokens / finished if finished else 0
+        return tokens + expected >= max_tokens
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="warmup") as pool:
+        pending = set()
+        calls = 0
+        for service, details in expand_spec(spec):
+            report["combinations"] += 1
+            planner = TripPlanner.from_details(service, details)
+            if not SERVICE_FLOWS[service].validator(planner.user_details)["success"]:
+                report["invalid"] += 1
+                continue
+            # The key the app looks up, e.g. with "nyc" given as "New York"
+            expires_in = cache.expires_in(make_cache_key(service, planner.user_details))
+            if expires_in is not None and expires_in > refresh_ahead:
+                report["fresh"] += 1
+                continue
+            if max_tokens is not None and pending and not spent["calls"]:
+                # Nothing is known yet of what a call costs: learn it from the first one
+                wait(pending)
+                pending = set()
+            if ((max_calls is not None and calls >= max_calls) or
+                    (max_tokens is not None and over_token_budget(len(pending)))):
+                report["over_budget"] += 1
+                continue
+
+            delay = next_start - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            next_start = max(next_start, time.monotonic()) + interval
+            if len(pending) >= workers:
+                _, pending = wait(pending, return_when=FIRST_COMPLETED)
+            pending.add(pool.submit(warm, planner))
+            calls += 1
+
+    valid = report["combinations"] - report["invalid"]
+    report["coverage"] = (report["fresh"] + report["generated"]) / valid if valid else 1.0
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Precompute cached answers for popular requests.")
+    parser.add_argument("spec", help="JSON file of values per service and field")
+    parser.add_argument("--rate", type=float, default=1.0, help="OpenAI calls started per second")
+    parser.add_argument("--max-calls", type=int, help="OpenAI calls per run")
+    parser.add_argument("--max-tokens", type=int, help="OpenAI tokens per run")
+    parser.add_argument("--refresh-ahead", type=float, default=3600,
+                        help="regenerate entries expiring within this many seconds")
+    parser.add_argument("--workers", type=int, default=4, help="calls in flight at the same time")
+    parser.add_argument("--every", type=float, help="repeat the run every this many seconds")
+    args = parser.parse_args(argv)
+
+    spec = load_spec(args.spec)
+    while True:
+        report = run_warmup(spec, args.rate, args.max_calls, args.max_tokens, args.refresh_ahead, args.workers)
+        print(json.dumps(report))
+        if not args.every:
+            break
+        time.sleep(args.every)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+Shared API clients, created on first use.
+
+Importing this module does not read .env or import the OpenAI and Twilio
+SDKs; that happens the first time a client is needed. Every later call
+returns the same client.
+
+Clients belong to one process: a forked worker (e.g. of a preforking
+server that imported the app first) drops the parent's clients and
+creates its own, see reset_clients(). The async OpenAI client and its
+limiter also belong to one event loop, so each running loop gets its own.
+"""
+import os
+import threading
+import weakref
+
+_lock = threading.RLock()
+_env_loaded = False
+_openai_client = None
+# Event loop -> AsyncOpenAI client and semaphore of that loop; an entry goes with its loop
+_async_openai_clients = weakref.WeakKeyDictionary()
+_openai_limiters = weakref.WeakKeyDictionary()
+_twilio_client = None
+_openai_guard = None
+
+
+def load_env():
+    """Loads the .env file into the environment, once per process."""
+    global _env_loaded
+    if _env_loaded:
+        return
+    with _lock:
+        if not _env_loaded:
+            from dotenv import load_dotenv
+            load_dotenv()
+            _env_loaded = True
+
+
+def openai_max_in_flight():
+    """Cap on concurrent async OpenAI calls per process (OPENAI_MAX_IN_FLIGHT)."""
+    load_env()
+    return int(os.getenv("OPENAI_MAX_IN_FLIGHT", "16"))
+
+
+def openai_timeout():
+    """Per-call OpenAI timeout in seconds (OPENAI_TIMEOUT)."""
+    load_env()
+    return float(os.getenv("OPENAI_TIMEOUT", "60"))
+
+
+def get_openai_client():
+    """Returns the shared OpenAI client."""
+    global _openai_client
+    if _openai_client is None:
+        load_env()
+        with _lock:
+            if _openai_client is None:
+                from openai import OpenAI
+                # Retries are left to the guard, see get_openai_guard()
+                _openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+    return _openai_client
+
+
+def get_async_openai_client():
+    """
+    Returns the AsyncOpenAI client of the running event loop, whose
+    connections are kept alive between calls made on that loop.
+    """
+    import asyncio
+    loop = asyncio.get_running_loop()
+    client = _async_openai_clients.get(loop)
+    if client is None:
+        load_env()
+        with _lock:
+            client = _async_openai_clients.get(loop)
+            if client is None:
+                import httpx
+                from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+                max_in_flight = openai_max_in_flight()
+                client = _async_openai_clients[loop] = AsyncOpenAI(
+                    api_key=os.getenv("OPENAI_API_KEY"),
+                    timeout=openai_timeout(),
+                    max_retries=0,
+                    http_client=DefaultAsyncHttpxClient(
+                        limits=httpx.Limits(
+                            max_connections=max_in_flight,
+                            max_keepalive_connections=max_in_flight,
+                            keepalive_expiry=30
+                        )
+                    )
+                )
+    return client
+
+
+def get_openai_limiter():
+    """Returns the semaphore limiting in-flight async OpenAI calls on the running event loop."""
+    import asyncio
+    loop = asyncio.get_running_loop()
+    limiter = _openai_limiters.get(loop)
+    if limiter is None:
+        with _lock:
+            limiter = _openai_limiters.get(loop)
+            if limiter is None:
+                limiter = _openai_limiters[loop] = asyncio.Semaphore(openai_max_in_flight())
+    return limiter
+
+
+def get_openai_guard():
+    """
+    Returns the CallGuard (deadline, retries, circuit breaker and hedging)
+    shared by every OpenAI call, configured from the OPENAI_* settings
+    described in resilience.py.
+    """
+    global _openai_guard
+    if _openai_guard is None:
+        load_env()
+        with _lock:
+            if _openai_guard is None:
+                from resilience import CallGuard, breaker_from_env, retry_policy_from_env
+                _openai_guard = CallGuard("openai", retry_policy_from_env("OPENAI"),
+                                          breaker_from_env("openai", "OPENAI"))
+    return _openai_guard
+
+
+def get_twilio_client():
+    """
+    Returns the shared Twilio client. Its HTTP session keeps up to
+    TWILIO_POOL_SIZE connections alive, enough for every outbound worker.
+    """
+    global _twilio_client
+    if _twilio_client is None:
+        load_env()
+        with _lock:
+            if _twilio_client is None:
+                from requests.adapters import HTTPAdapter
+                from twilio.http.http_client import TwilioHttpClient
+                from twilio.rest import Client
+                http_client = TwilioHttpClient(timeout=float(os.getenv("TWILIO_TIMEOUT", "15")))
+                http_client.session.mount(
+                    "https://", HTTPAdapter(pool_maxsize=int(os.getenv("TWILIO_POOL_SIZE", "32")))
+                )
+                _twilio_client = Client(
+                    os.getenv("API_KEY_SID"),
+                    os.getenv("API_KEY_SECRET"),
+                    account_sid=os.getenv("ACCOUNT_SID"),
+                    http_client=http_client
+                )
+    return _twilio_client
+
+
+def reset_clients():
+    """
+    Forgets every shared client, so the next call creates a new one. Runs
+    in each forked child: connection pools, the asyncio semaphores and the
+    breaker state of the parent must not be shared with it.
+    """
+    global _lock, _openai_client, _async_openai_clients, _openai_limiters, _twilio_client, _openai_guard
+    _lock = threading.RLock()
+    _openai_client = _twilio_client = _openai_guard = None
+    _async_openai_clients = weakref.WeakKeyDictionary()
+    _openai_limiters = weakref.WeakKeyDictionary()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset_clients)
@@ -0,0 +1,85 @@
+import sqlite3
+import threading
+from collections import namedtuple
+
+# What is known about the Twilio Conversation of a phone number
+ConversationEntry = namedtuple("ConversationEntry", ["conversation_sid", "participant_sid", "proxy_address"])
+
+
+class ConversationIndex:
+    """
+    Maps (Conversations service SID, phone number) to the conversation and
+    participant binding created for that number, so that a known user costs
+    no Twilio round trips.
+
+    Entries live in a SQLite database in WAL mode shared by every worker
+    process, with a per-process dictionary in front of it. They are never
+    expired: a conversation stays valid until Twilio says otherwise, at
+    which point the caller invalidates the entry.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+        self._memory = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS conversations ("
+                "service_sid TEXT, phone TEXT, conversation_sid TEXT, participant_sid TEXT, "
+                "proxy_address TEXT, PRIMARY KEY (service_sid, phone)) WITHOUT ROWID"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def get(self, service_sid, phone):
+        """Returns the ConversationEntry of the phone number, or None."""
+        key = (service_sid, phone)
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                row = self._connect().execute(
+                    "SELECT conversation_sid, participant_sid, proxy_address FROM conversations "
+                    "WHERE service_sid = ? AND phone = ?", key
+                ).fetchone()
+                if row is not None:
+                    entry = self._memory[key] = ConversationEntry(*row)
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return entry
+
+    def put(self, service_sid, phone, entry):
+        """Stores the conversation created for the phone number."""
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO conversations "
+                "(service_sid, phone, conversation_sid, participant_sid, proxy_address) VALUES (?, ?, ?, ?, ?)",
+                (service_sid, phone) + tuple(entry),
+            )
+            conn.commit()
+            self._memory[(service_sid, phone)] = entry
+
+    def invalidate(self, service_sid, phone):
+        """Forgets the conversation of the phone number, e.g. after Twilio answered 404."""
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM conversations WHERE service_sid = ? AND phone = ?", (service_sid, phone))
+            conn.commit()
+            self._memory.pop((service_sid, phone), None)
+            self.invalidations += 1
+
+    def stats(self):
+        """Returns the hit, miss and invalidation counters of this process."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "invalidations": self.invalidations}
@@ -0,0 +1,195 @@
+"""
+Admission control and fair queuing for answer generation: at most
+max_concurrent OpenAI requests run at once, waiting users are served
+round-robin so that one chatty user (or a bot) cannot take every slot,
+each user may start at most user_rate generations per second, and work is
+refused up front when the expected wait exceeds the latency SLO.
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from metrics import QUEUE_WAIT_SECONDS, SCHEDULER_REJECTIONS
+from outbound_sender import TokenBucket
+
+
+class SchedulerBusy(Exception):
+    """
+    Raised instead of running a generation. reason is "rate_limited",
+    "overloaded" (the expected wait exceeds the SLO) or "timeout" (the
+    wait actually did).
+    """
+
+    def __init__(self, reason):
+        super().__init__(f"generation refused: {reason}")
+        self.reason = reason
+
+
+class _Waiter:
+    __slots__ = ("event", "granted", "weight")
+
+    def __init__(self, weight):
+        self.event = threading.Event()
+        self.granted = False
+        self.weight = weight
+
+
+class FairScheduler:
+    """
+    Hands out generation slots, one per OpenAI request. Usage:
+
+        with scheduler.slot(phone_number):
+            answer = get_response_with_websearch(...)
+
+    An answer made of several concurrent requests takes one slot per
+    request with slot(user, weight=n), and hands each back with the
+    release function the with-block gets as soon as its request is done.
+    Slots left at the end of the with-block are released then.
+
+    Waiting callers are queued per user, and freed slots go to the next
+    user in round-robin order, so a user with ten queued requests gets one
+    turn per round like everybody else.
+
+    The expected wait is the number of slots asked for ahead divided by
+    max_concurrent, times the moving average of the time a slot is held.
+    A refused caller keeps its rate token unless the refusal is "timeout".
+    """
+
+    # Weight of the latest observation in the moving average of slot hold times
+    SMOOTHING = 0.2
+    # Idle per-user rate limiters kept before full ones are dropped
+    MAX_TRACKED_USERS = 10000
+
+    def __init__(self, max_concurrent=8, user_rate=0.2, user_burst=3, max_wait=20.0, name="llm"):
+        self.max_concurrent = max_concurrent
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.max_wait = max_wait
+        self.name = name
+        self._lock = threading.Lock()
+        self._waiting = OrderedDict()  # user -> deque of _Waiter, in round-robin order
+        self._buckets = {}
+        self.running = 0
+        self.queued = 0
+        self.queued_weight = 0
+        self.admitted = 0
+        self.rejected = {"rate_limited": 0, "overloaded": 0, "timeout": 0}
+        self.avg_hold_time = 0.0
+
+    @contextmanager
+    def slot(self, user, weight=1):
+        """
+        Runs the with-block holding weight generation slots (at most
+        max_concurrent), or raises SchedulerBusy. The with-block gets a
+        function that releases one of the slots early.
+        """
+        weight = max(1, min(weight, self.max_concurrent))
+        enqueued_at = time.perf_counter()
+        self._acquire(user, weight)
+        started_at = time.perf_counter()
+        QUEUE_WAIT_SECONDS.labels(self.name).observe(started_at - enqueued_at)
+        held = [weight]
+        held_lock = threading.Lock()
+
+        def release(count=1):
+            with held_lock:
+                count = min(count, held[0])
+                held[0] -= count
+            if count:
+                self._release(count, time.perf_counter() - started_at)
+
+        try:
+            yield release
+        finally:
+            release(weight)
+
+    def _acquire(self, user, weight):
+        with self._lock:
+            free = self.running + weight <= self.max_concurrent and not self._waiting
+            # Shed load before the rate token is taken, so that the user can retry later
+            if not free and self.expected_wait(weight) > self.max_wait:
+                self._reject("overloaded")
+            if self.user_rate > 0 and not self._bucket(user).acquire(timeout=0):
+                self._reject("rate_limited")
+            if free:
+                self.running += weight
+                self.admitted += 1
+                return
+            waiter = _Waiter(weight)
+            self._waiting.setdefault(user, deque()).append(waiter)
+            self.queued += 1
+            self.queued_weight += weight
+
+        waiter.event.wait(self.max_wait)
+        with self._lock:
+            if waiter.granted:
+                return
+            # Timed out; leave the queue unless the slot arrived meanwhile
+            waiters = self._waiting[user]
+            waiters.remove(waiter)
+            if not waiters:
+                del self._waiting[user]
+            self.queued -= 1
+            self.queued_weight -= weight
+            self._reject("timeout")
+
+    def _release(self, count, hold_time):
+        with self._lock:
+            self.running -= count
+            if self.avg_hold_time:
+                self.avg_hold_time += self.SMOOTHING * (hold_time - self.avg_hold_time)
+            else:
+                self.avg_hold_time = hold_time
+            while self._waiting:
+                user, waiters = next(iter(self._waiting.items()))
+                waiter = waiters[0]
+                if self.running + waiter.weight > self.max_concurrent:
+                    break
+                waiters.popleft()
+                if waiters:
+                    self._waiting.move_to_end(user)
+                else:
+                    del self._waiting[user]
+                self.queued -= 1
+                self.queued_weight -= waiter.weight
+                self.running += waiter.weight
+                self.admitted += 1
+                waiter.granted = True
+                waiter.event.set()
+
+    def _bucket(self, user):
+        bucket = self._buckets.get(user)
+        if bucket is None:
+            if len(self._buckets) >= self.MAX_TRACKED_USERS:
+                now = time.monotonic()
+                for idle_user, idle_bucket in list(self._buckets.items()):
+                    idle_bucket._refill(now)
+                    if idle_bucket._tokens >= idle_bucket.capacity:
+                        del self._buckets[idle_user]
+            bucket = self._buckets[user] = TokenBucket(self.user_rate, self.user_burst)
+        return bucket
+
+    def _reject(self, reason):
+        self.rejected[reason] += 1
+        SCHEDULER_REJECTIONS.labels(reason).inc()
+        raise SchedulerBusy(reason)
+
+    def expected_wait(self, weight=1):
+        """Seconds a caller arriving now is expected to wait for weight slots."""
+        if self.running + weight <= self.max_concurrent and not self.queued:
+            return 0.0
+        return (self.queued_weight + weight) / self.max_concurrent * self.avg_hold_time
+
+    def stats(self):
+        """Returns slot usage, rejections by reason and the expected wait."""
+        with self._lock:
+            return {
+                "max_concurrent": self.max_concurrent,
+                "running": self.running,
+                "queued": self.queued,
+                "waiting_users": len(self._waiting),
+                "admitted": self.admitted,
+                "rejected": dict(self.rejected),
+                "avg_hold_time": self.avg_hold_time,
+                "expected_wait": self.expected_wait(),
+            }
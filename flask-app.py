@@ -1,23 +1,124 @@
+import _thread
+import argparse
+import atexit
+import logging
 import os
-from flask import Flask, request
+import signal
+import threading
+import time
+from types import SimpleNamespace
+from flask import Blueprint, Flask, Response, request
 from twilio.twiml.messaging_response import MessagingResponse
-from twilio.rest import Client
-from dotenv import load_dotenv
-load_dotenv()
+from clients import load_env, get_openai_client, get_openai_guard, get_twilio_client
+from conversation_index import ConversationEntry, ConversationIndex
+from fair_scheduler import FairScheduler, SchedulerBusy
+from idempotency_store import IdempotencyStore
+from job_queue import JobQueue
+from message_chunker import split_message
+from outbound_sender import OutboundSender
+from pending_jobs import PendingJobStore
+from resilience import CallGuard, RetryPolicy, breaker_from_env, retry_policy_from_env
+from metrics import REGISTRY, time_stage
+from session_store import SessionConflict, SessionStore, StripedLock
+from single_flight import SingleFlight
+from trip_plan import TripPlanner, openai_flight, get_gazetteer, get_response_cache, get_usage_ledger, get_venue_index
+load_env()
 
+logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
+# The routes; create_app() builds the application around them
+webhooks = Blueprint("webhooks", __name__)
 
 
-ACCOUNT_SID = os.getenv("ACCOUNT_SID")
-API_KEY_SID = os.getenv("API_KEY_SID")
-API_KEY_SECRET = os.getenv("API_KEY_SECRET")
 CHAT_SERVICE_SID = os.getenv("CHAT_SERVICE_SID")
 USER_PHONE = os.getenv("USER_PHONE")
 PROXY_PHONE = os.getenv("PROXY_PHONE")
 
-# Create a single Twilio Client instance
-client = Client(API_KEY_SID, API_KEY_SECRET, account_sid=ACCOUNT_SID)
+# When enabled, the webhook acknowledges right away and the reply is
+# generated on a background worker and sent with the Messaging API.
+ASYNC_REPLIES = os.getenv("ASYNC_REPLIES", "").lower() in ("1", "true", "yes")
+# With async replies, also send the answer in parts while it is being generated
+STREAM_REPLIES = os.getenv("STREAM_REPLIES", "").lower() in ("1", "true", "yes")
+BUSY_MESSAGE = "We're handling a lot of requests right now. Please try again in a minute."
+WELCOME_MESSAGE = "Hi! Tell me what you need, e.g. 'sushi in Lisbon under 40 euros', or send 'help' to see the options."
+RATE_LIMITED_MESSAGE = "You're asking faster than we can plan. Please wait a moment and send your last answer again."
+
+# The Twilio client is created on first use and shared (see clients.py)
+
+# Messaging API calls: up to 4 attempts of 15 seconds within 30 seconds, no hedging
+TWILIO_RETRY_POLICY = RetryPolicy(attempts=4, base_delay=0.5, max_delay=8.0, deadline=30.0,
+                                  attempt_timeout=15.0, hedge_after=0.0)
+
+# Bounded worker pool for replies generated out of band
+reply_queue = JobQueue(
+    max_workers=int(os.getenv("REPLY_WORKERS", "4")),
+    max_queued=int(os.getenv("REPLY_QUEUE_SIZE", "32")),
+    name="reply"
+)
+
+# Twilio gives up on a webhook that is not answered within 15 seconds
+TWILIO_WEBHOOK_TIMEOUT = 15.0
+# Longest wait for a generation slot. A reply given in the webhook response
+# must also be generated within the webhook timeout, so without async
+# replies the wait defaults to 5 seconds and never exceeds half of it.
+LLM_QUEUE_SLO = float(os.getenv("LLM_QUEUE_SLO", "20" if ASYNC_REPLIES else "5"))
+if not ASYNC_REPLIES:
+    LLM_QUEUE_SLO = min(LLM_QUEUE_SLO, TWILIO_WEBHOOK_TIMEOUT / 2)
+
+# Answer generations: at most LLM_MAX_CONCURRENT OpenAI requests at once,
+# shared fairly between users, at most LLM_USER_RATE answers per second per
+# user (bursts of LLM_USER_BURST), and refused when the expected wait
+# exceeds LLM_QUEUE_SLO seconds
+llm_scheduler = FairScheduler(
+    max_concurrent=int(os.getenv("LLM_MAX_CONCURRENT", "8")),
+    user_rate=float(os.getenv("LLM_USER_RATE", "0.1")),
+    user_burst=int(os.getenv("LLM_USER_BURST", "3")),
+    max_wait=LLM_QUEUE_SLO
+)
+
+# Time from picking up a job to sending the user the first message
+first_message_stats = {"replies": 0, "total_time": 0.0, "max_time": 0.0}
+first_message_lock = threading.Lock()
+
+# Conversation state per phone number, shared by every worker process
+session_store = SessionStore(
+    os.getenv("SESSION_STORE_PATH", "sessions.sqlite3"),
+    ttl=int(os.getenv("SESSION_TTL", "1800")),
+    max_sessions=int(os.getenv("SESSION_MAX", "500000"))
+)
+# A conversation turn loads, advances and saves the session; two messages
+# from one phone handled by reply threads of this process take turns, and
+# the session's version catches turns run by other processes
+conversation_locks = StripedLock(int(os.getenv("CONVERSATION_LOCK_STRIPES", "256")))
+# Times a turn is run again when another worker saved the same session meanwhile
+SESSION_SAVE_ATTEMPTS = 3
+
+# Inbound messages by MessageSid, so that Twilio's webhook retries do not
+# run a conversation turn (and an LLM call) twice
+idempotency_store = IdempotencyStore(
+    os.getenv("IDEMPOTENCY_STORE_PATH", "idempotency.sqlite3"),
+    ttl=int(os.getenv("IDEMPOTENCY_TTL", "86400")),
+    pending_timeout=int(os.getenv("IDEMPOTENCY_PENDING_TIMEOUT", "300"))
+)
+# How long a retry waits for the first delivery of the same message to finish
+IDEMPOTENCY_WAIT = float(os.getenv("IDEMPOTENCY_WAIT", "10"))
+
+# Conversation and participant SIDs per phone number, so that returning
+# users skip the Twilio provisioning round trips
+conversation_index = ConversationIndex(os.getenv("CONVERSATION_INDEX_PATH", "conversations.sqlite3"))
+provisioning_flight = SingleFlight()
+
+# Set as soon as the worker is asked to stop (SIGTERM), while it still
+# serves: webhooks are turned away and readiness fails
+draining = threading.Event()
+# How long a stopping worker lets queued replies and messages finish; keep
+# it below the server's graceful timeout (graceful_timeout in gunicorn.conf.py)
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "20"))
+# Replies and messages a stopping worker could not finish, for the next worker to send
+pending_jobs = PendingJobStore(os.getenv("PENDING_JOBS_PATH", "pending_jobs.sqlite3"))
+# How often a running worker claims jobs saved since it started; in a
+# rolling restart the new workers start before the old ones have drained
+PENDING_JOBS_POLL = float(os.getenv("PENDING_JOBS_POLL", "5"))
 
 # ------------------------------------------------
 # 2) Conversation creation function
@@ -26,88 +127,620 @@ def create_conversation_add_participant(service_sid, user_phone, proxy_phone):
     """
     Creates a Twilio Conversation and adds the user as a participant.
     Returns the conversation SID.
+
+    Users seen before are answered from the conversation index without
+    calling Twilio. Concurrent calls for the same user share one provisioning.
     """
-    conversation = client.conversations \
-                         .v1 \
-                         .services(service_sid) \
-                         .conversations \
-                         .create(friendly_name=f"Travel Guru {user_phone}")
+    entry = conversation_index.get(service_sid, user_phone)
+    if entry is not None and entry.proxy_address == proxy_phone:
+        return entry.conversation_sid
+    return provisioning_flight.do(
+        (service_sid, user_phone), _provision_conversation, service_sid, user_phone, proxy_phone
+    )
+
+
+def _provision_conversation(service_sid, user_phone, proxy_phone):
+    conversations = get_twilio_client().conversations.v1.services(service_sid).conversations
+    conversation = conversations.create(friendly_name=f"Travel Guru {user_phone}")
 
     try:
-        client.conversations \
-            .v1 \
-            .services(service_sid) \
-            .conversations(conversation.sid) \
-            .participants \
-            .create(
+        participant = conversations(conversation.sid).participants.create(
             messaging_binding_address=user_phone,
             messaging_binding_proxy_address=proxy_phone
         )
     except Exception as e:
-        # Check if the error is due to a duplicate binding (HTTP 409)
-        if "A binding for this participant and proxy address already exists" in str(e):
-            print("Participant binding already exists, skipping addition.")
-        else:
-            # Re-raise the exception if it's a different error
-            raise e
+        # HTTP 409: the user is already bound to another conversation of the service
+        if getattr(e, "status", None) != 409:
+            raise
+        existing = find_existing_conversation(service_sid, user_phone, proxy_phone)
+        if existing is None:
+            raise
+        logger.info("Participant binding already exists, reusing its conversation.")
+        try:
+            conversations(conversation.sid).delete()
+        except Exception as delete_error:
+            logger.warning("Could not delete unused conversation %s: %s", conversation.sid, delete_error)
+        conversation_index.put(service_sid, user_phone, existing)
+        return existing.conversation_sid
 
+    conversation_index.put(service_sid, user_phone,
+                           ConversationEntry(conversation.sid, participant.sid, proxy_phone))
     return conversation.sid
 
+
+def find_existing_conversation(service_sid, user_phone, proxy_phone):
+    """Looks up the conversation the user is already bound to, or returns None."""
+    for found in get_twilio_client().conversations.v1.services(service_sid) \
+            .participant_conversations.list(address=user_phone, limit=20):
+        binding = found.participant_messaging_binding or {}
+        if binding.get("proxy_address", proxy_phone) == proxy_phone:
+            return ConversationEntry(found.conversation_sid, found.participant_sid, proxy_phone)
+    return None
+
+
+def with_conversation(service_sid, user_phone, proxy_phone, func):
+    """
+    Calls func(conversation_sid) with the user's conversation. If Twilio no
+    longer knows an indexed conversation (HTTP 404), the entry is dropped
+    and func is called again with a newly provisioned one.
+    """
+    try:
+        return func(create_conversation_add_participant(service_sid, user_phone, proxy_phone))
+    except Exception as e:
+        if getattr(e, "status", None) != 404:
+            raise
+        conversation_index.invalidate(service_sid, user_phone)
+        return func(create_conversation_add_participant(service_sid, user_phone, proxy_phone))
+
+
+def confirm_conversation(service_sid, user_phone, proxy_phone):
+    """
+    Returns the SID of the user's conversation after checking with Twilio
+    that it still exists, provisioning a new one if it was deleted.
+    """
+    conversations = get_twilio_client().conversations.v1.services(service_sid).conversations
+    return with_conversation(service_sid, user_phone, proxy_phone,
+                             lambda conversation_sid: conversations(conversation_sid).fetch().sid)
+
 # ------------------------------------------------
 # 3) Test function to send a manual WhatsApp message
 # ------------------------------------------------
-def send_test_message(to_number, message):
-    """
-    Sends a test WhatsApp message using Twilio's Messaging API.
-    """
-    sent_message = client.messages.create(
+def create_message(to_number, message):
+    """Makes one Messaging API call and returns the message SID."""
+    sent_message = get_twilio_client().messages.create(
         body=message,
         from_=PROXY_PHONE,  # Use your Twilio WhatsApp number
         to=to_number
     )
     return sent_message.sid
 
+
+# Every outbound message goes through one rate limit, so that replies and
+# broadcasts together stay within the sender's throughput
+outbound_sender = OutboundSender(
+    create_message,
+    rate=float(os.getenv("TWILIO_SEND_RATE", "20")),
+    burst=int(os.getenv("TWILIO_SEND_BURST", "20")),
+    max_workers=int(os.getenv("OUTBOUND_WORKERS", "8")),
+    max_queued=int(os.getenv("OUTBOUND_QUEUE_SIZE", "1000")),
+    guard=CallGuard("twilio", retry_policy_from_env("TWILIO", TWILIO_RETRY_POLICY),
+                    breaker_from_env("twilio", "TWILIO"))
+)
+
+
+def send_message(to_number, message):
+    """
+    Sends a WhatsApp message using Twilio's Messaging API, within the
+    outbound rate limit, retried only if it was certainly not sent.
+    Returns the message SID.
+    """
+    return outbound_sender.send_part(to_number, message)
+
+
+def send_test_message(to_number, message):
+    """
+    Sends a test WhatsApp message using Twilio's Messaging API.
+    """
+    return send_message(to_number, message)
+
 # ------------------------------------------------
 # 4) Message processing logic
 # ------------------------------------------------
-def process_incoming_message(incoming_msg, from_number):
+def process_incoming_message(incoming_msg, from_number, send_chunk=None):
     """
     Process the incoming message from the user.
-    For now, this function simply echoes the message back.
+    Resumes the user's conversation from the session store, advances it by
+    one turn and stores it again until all details have been collected.
+    If send_chunk is given, the final answer is also streamed to it in parts.
+
+    The answer is generated in slots of the fair scheduler. When none can
+    be had, the user is told to try again and the session stays at the last
+    question, so resending the answer to it retries the generation.
+
+    Turns of the same phone number run one at a time in this process, so
+    that a quick second message sees the session the first one saved. The
+    session is saved only if no turn in another worker saved it since it
+    was loaded; otherwise the turn runs again on the newer session.
+    """
+    for _ in range(SESSION_SAVE_ATTEMPTS):
+        try:
+            return run_turn(incoming_msg, from_number, send_chunk)
+        except SessionConflict:
+            continue
+    return BUSY_MESSAGE
+
+
+def run_turn(incoming_msg, from_number, send_chunk):
+    """
+    Runs one turn on the session as loaded. The session is saved before
+    the answer is generated, and the lock of the phone number is released
+    then, so that a long answer does not hold up the next message.
+    """
+    lock = conversation_locks(from_number)
+    lock.acquire()
+    saved = []
+    try:
+        state, version = session_store.load_versioned(from_number)
+        trip_planner = TripPlanner.from_state(state) if state else TripPlanner()
+        trip_planner.stream_to = send_chunk
+        trip_planner.user = from_number
+        trip_planner.generation_slot = lambda weight: llm_scheduler.slot(from_number, weight)
+
+        def save_before_answer():
+            saved.append(save_turn(from_number, trip_planner, version))
+            lock.release()
+
+        trip_planner.before_answer = save_before_answer
+        try:
+            reply_text = trip_planner.process_message(incoming_msg)
+        except SchedulerBusy as e:
+            if saved:
+                # Back to the last question, unless a newer turn has moved on
+                try:
+                    if state:
+                        session_store.save(from_number, state, version=saved[0])
+                    else:
+                        session_store.delete(from_number, version=saved[0])
+                except SessionConflict:
+                    pass
+            return RATE_LIMITED_MESSAGE if e.reason == "rate_limited" else BUSY_MESSAGE
+        if not saved:
+            save_turn(from_number, trip_planner, version)
+    finally:
+        if not saved:
+            lock.release()
+    return reply_text or WELCOME_MESSAGE
+
+
+def save_turn(from_number, trip_planner, version):
     """
-    reply_text = f"You said: {incoming_msg}"
-    return reply_text
+    Stores the session after a turn, or removes it once every detail is
+    collected (or none was started). Raises SessionConflict if it changed
+    since version was loaded. Returns the version of the session now.
+    """
+    if trip_planner.step > 0 and not trip_planner.is_complete():
+        return session_store.save(from_number, trip_planner.to_state(), version=version)
+    session_store.delete(from_number, version=version)
+    return 0
+
+def deliver_reply(incoming_msg, from_number, message_sid=""):
+    """
+    Generates the reply on a background worker and sends it out of band.
+    """
+    try:
+        _deliver_reply(incoming_msg, from_number)
+    except Exception:
+        if message_sid:
+            idempotency_store.release(message_sid)
+        raise
+    if message_sid:
+        idempotency_store.complete(message_sid)
+
+
+def _deliver_reply(incoming_msg, from_number):
+    started_at = time.perf_counter()
+    sent = []
+
+    def send_chunk(chunk):
+        if not sent:
+            record_first_message(time.perf_counter() - started_at)
+        sent.append(send_message(from_number, chunk))
+
+    response_text = process_incoming_message(
+        incoming_msg, from_number, send_chunk=send_chunk if STREAM_REPLIES else None
+    )
+    # Nothing was streamed (a prompt for the next detail, or streaming is off)
+    if not sent:
+        for part in split_message(response_text):
+            send_chunk(part)
+
+
+def record_first_message(elapsed):
+    with first_message_lock:
+        first_message_stats["replies"] += 1
+        first_message_stats["total_time"] += elapsed
+        first_message_stats["max_time"] = max(first_message_stats["max_time"], elapsed)
 
 # ------------------------------------------------
 # 5) Flask route to handle inbound WhatsApp messages
 # ------------------------------------------------
-@app.route("/whatsapp-inbound", methods=["POST"])
+def duplicate_response(message_sid, status, reply):
+    """
+    Answers a webhook retry for a message that is or was handled already:
+    with the stored reply, after waiting for it if needed.
+    """
+    if ASYNC_REPLIES:
+        # The reply is or will be sent out of band
+        return str(MessagingResponse())
+    if status == IdempotencyStore.PENDING:
+        status, reply = idempotency_store.wait(message_sid, IDEMPOTENCY_WAIT)
+    if status != IdempotencyStore.DONE:
+        # Still being handled; ask Twilio to come back rather than drop the reply
+        return Response("", status=503, headers={"Retry-After": "5"})
+    resp = MessagingResponse()
+    resp.message(reply or WELCOME_MESSAGE)
+    return str(resp)
+
+
+@webhooks.route("/whatsapp-inbound", methods=["POST"])
 def whatsapp_inbound():
-    incoming_msg = request.form.get("Body", "").strip()
-    from_number = request.form.get("From", "").strip()
+    with time_stage("webhook"):
+        if draining.is_set():
+            # Nothing has been claimed yet; Twilio retries against a worker that is not stopping
+            return Response("", status=503, headers={"Retry-After": "5"})
+        incoming_msg = request.form.get("Body", "").strip()
+        from_number = request.form.get("From", "").strip()
+        message_sid = request.form.get("MessageSid", "").strip()
 
-    response_text = process_incoming_message(incoming_msg, from_number)
+        if message_sid:
+            status, reply = idempotency_store.begin(message_sid)
+            if status != IdempotencyStore.NEW:
+                return duplicate_response(message_sid, status, reply)
 
-    # Build TwiML response
-    resp = MessagingResponse()
-    resp.message(response_text)
-    return str(resp)
+        if ASYNC_REPLIES:
+            resp = MessagingResponse()
+            # Acknowledge with an empty TwiML; the reply follows via the Messaging API.
+            # If the worker pool is saturated, tell the user instead of queueing forever.
+            if not reply_queue.submit(deliver_reply, incoming_msg, from_number, message_sid):
+                if message_sid:
+                    idempotency_store.release(message_sid)
+                resp.message(BUSY_MESSAGE)
+            return str(resp)
+
+        try:
+            response_text = process_incoming_message(incoming_msg, from_number)
+        except Exception:
+            if message_sid:
+                idempotency_store.release(message_sid)
+            raise
+        if message_sid:
+            idempotency_store.complete(message_sid, response_text)
+
+        # Build TwiML response
+        with time_stage("twiml"):
+            resp = MessagingResponse()
+            resp.message(response_text)
+            return str(resp)
+
+
+@webhooks.route("/metrics", methods=["GET"])
+def metrics():
+    """Prometheus scrape endpoint."""
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+
+def collect_component_stats():
+    """Exposes the counters kept by the queue, cache, single-flight and session store."""
+    queue = reply_queue.stats()
+    cache = get_response_cache().stats()
+    flight = openai_flight.stats()
+    sessions = session_store.stats()
+    inbound = idempotency_store.stats()
+    conversations = conversation_index.stats()
+    outbound = outbound_sender.stats()
+    scheduler = llm_scheduler.stats()
+    venues = get_venue_index().stats()
+    saved_jobs = pending_jobs.stats()
+    usage = get_usage_ledger().stats()
+    return [
+        ("travelguru_reply_queue_depth", "gauge", "Replies waiting for a worker.",
+         [({}, queue["queued"])]),
+        ("travelguru_reply_queue_running", "gauge", "Replies being generated.",
+         [({}, queue["running"])]),
+        ("travelguru_reply_jobs_total", "counter", "Reply jobs by outcome.",
+         [({"outcome": "completed"}, queue["completed"]),
+          ({"outcome": "failed"}, queue["failed"]),
+          ({"outcome": "rejected"}, queue["rejected"])]),
+        ("travelguru_response_cache_total", "counter", "Response cache lookups and evictions.",
+         [({"result": "hit"}, cache["hits"]),
+          ({"result": "warm_hit"}, cache["warm_hits"]),
+          ({"result": "stale_hit"}, cache["stale_hits"]),
+          ({"result": "miss"}, cache["misses"]),
+          ({"result": "eviction"}, cache["evictions"])]),
+        ("travelguru_openai_calls_total", "counter", "OpenAI calls made or coalesced by single-flight.",
+         [({"result": "called"}, flight["calls"]),
+          ({"result": "coalesced"}, flight["coalesced"])]),
+        ("travelguru_session_operations_total", "counter", "Session store operations.",
+         [({"operation": "load"}, sessions["loads"]),
+          ({"operation": "save"}, sessions["saves"]),
+          ({"operation": "expire"}, sessions["expired"]),
+          ({"operation": "evict"}, sessions["evicted"])]),
+        ("travelguru_inbound_messages_total", "counter", "Inbound messages by MessageSid deduplication result.",
+         [({"result": "new"}, inbound["new"]),
+          ({"result": "duplicate"}, inbound["duplicates"]),
+          ({"result": "reclaimed"}, inbound["reclaimed"])]),
+        ("travelguru_conversation_index_total", "counter", "Conversation index lookups and invalidations.",
+         [({"result": "hit"}, conversations["hits"]),
+          ({"result": "miss"}, conversations["misses"]),
+          ({"result": "invalidation"}, conversations["invalidations"])]),
+        ("travelguru_outbound_queue_depth", "gauge", "Outbound messages waiting for a dispatch worker.",
+         [({}, outbound["queue"]["queued"])]),
+        ("travelguru_outbound_parts_total", "counter", "Outbound message parts by outcome.",
+         [({"outcome": "sent"}, outbound["parts_sent"]),
+          ({"outcome": "failed"}, outbound["parts_failed"])]),
+        ("travelguru_venue_index_lookups_total", "counter", "Venue index lookups by coverage.",
+         [({"result": "hit"}, venues["hits"]),
+          ({"result": "partial"}, venues["partial_hits"]),
+          ({"result": "miss"}, venues["misses"])]),
+        ("travelguru_generation_slots_in_use", "gauge", "OpenAI requests holding a generation slot.",
+         [({}, scheduler["running"])]),
+        ("travelguru_generation_queue_depth", "gauge", "Answer generations waiting for a slot.",
+         [({}, scheduler["queued"])]),
+        ("travelguru_generation_expected_wait_seconds", "gauge", "Expected wait for a generation slot.",
+         [({}, scheduler["expected_wait"])]),
+        ("travelguru_pending_jobs_total", "counter", "Jobs saved by a stopping worker and claimed by a new one.",
+         [({"result": "saved"}, saved_jobs["saved"]),
+          ({"result": "claimed"}, saved_jobs["claimed"])]),
+        ("travelguru_usage_rows_total", "counter", "Answers recorded in the usage ledger.",
+         [({}, usage["recorded"])]),
+        ("travelguru_usage_rows_buffered", "gauge", "Usage rows not yet written to the ledger.",
+         [({}, usage["buffered"])]),
+        ("travelguru_draining", "gauge", "1 while the worker is shutting down.",
+         [({}, int(draining.is_set()))]),
+    ]
+
+
+REGISTRY.register_collector(collect_component_stats)
+
+
+@webhooks.route("/queue-stats", methods=["GET"])
+def queue_stats():
+    """Reports reply queue depth and per-job timings for sizing workers."""
+    stats = reply_queue.stats()
+    with first_message_lock:
+        replies = first_message_stats["replies"]
+        stats["avg_time_to_first_message"] = first_message_stats["total_time"] / replies if replies else 0.0
+        stats["max_time_to_first_message"] = first_message_stats["max_time"]
+    return stats
+
+
+@webhooks.route("/session-stats", methods=["GET"])
+def session_stats():
+    """Reports session store load/save latencies."""
+    return session_store.stats()
+
+
+@webhooks.route("/idempotency-stats", methods=["GET"])
+def idempotency_stats():
+    """Reports how many inbound messages were new and how many were webhook retries."""
+    return idempotency_store.stats()
+
+
+@webhooks.route("/outbound-stats", methods=["GET"])
+def outbound_stats():
+    """Reports outbound parts sent and failed, dispatch queue depth and Twilio retries."""
+    return outbound_sender.stats()
+
+
+@webhooks.route("/scheduler-stats", methods=["GET"])
+def scheduler_stats():
+    """Reports generation slots in use, waiting users, rejections and the expected wait."""
+    return llm_scheduler.stats()
+
+
+@webhooks.route("/openai-stats", methods=["GET"])
+def openai_stats():
+    """
+    Reports response cache and venue index counters, coalesced calls, and
+    the retry and circuit breaker state.
+    """
+    return {"cache": get_response_cache().stats(), "venue_index": get_venue_index().stats(),
+            "single_flight": openai_flight.stats(), "resilience": get_openai_guard().stats()}
+
+@webhooks.route("/usage-stats", methods=["GET"])
+def usage_stats():
+    """
+    Reports today's answers, OpenAI calls, tokens, web searches and cost
+    per service and source, e.g. how many answers the cache saved, and the
+    spend caps.
+    """
+    ledger = get_usage_ledger()
+    day = request.args.get("day") or time.strftime("%Y-%m-%d", time.gmtime())
+    return {"day": day, "services": ledger.rollups(day),
+            "budgets": ledger.budgets._asdict(), "ledger": ledger.stats()}
+
+
+@webhooks.route("/livez", methods=["GET"])
+def livez():
+    """Liveness: the worker is up and serving requests."""
+    return {"status": "ok", "pid": os.getpid()}
+
+
+@webhooks.route("/readyz", methods=["GET"])
+def readyz():
+    """Readiness: 503 once the worker is shutting down, so no new webhooks are routed to it."""
+    if draining.is_set():
+        return {"status": "draining", "pid": os.getpid()}, 503
+    return {"status": "ready", "pid": os.getpid(), "reply_queue": reply_queue.depth(),
+            "generation_queue": llm_scheduler.stats()["queued"]}
 
 # ------------------------------------------------
-# 6) Main execution: test the connection and start Flask
+# 6) Worker lifecycle: start-up and graceful drain
 # ------------------------------------------------
-if __name__ == "__main__":
-    # Create the conversation and add participant
-    conversation_id = create_conversation_add_participant(
-        CHAT_SERVICE_SID,
-        USER_PHONE,
-        PROXY_PHONE
-    )
-    print(f"Conversation created with ID: {conversation_id}")
+# In production, run the app factory under a preforking server, e.g.
+#   gunicorn -c gunicorn.conf.py "flask-app:create_app()"
+# Every worker imports this module and calls create_app() after the fork,
+# so it gets its own clients, connections and thread pools. The hooks in
+# gunicorn.conf.py call begin_drain() on SIGTERM and drain() once the
+# worker has stopped serving.
+_drain_registered = False
+_drain_lock = threading.Lock()
+_drained = False
+
+
+def create_app():
+    """
+    Builds the Flask application for one worker process: creates the
+    shared clients before the first webhook, queues the jobs a stopped
+    worker left behind, and registers drain() for the server's shutdown
+    hooks under app.extensions["worker"], and at exit as a fallback.
+    """
+    global _drain_registered
+    app = Flask(__name__)
+    app.register_blueprint(webhooks)
+    app.extensions["worker"] = SimpleNamespace(begin_drain=begin_drain, drain=drain)
+    init_worker()
+    if not _drain_registered:
+        atexit.register(drain)
+        _drain_registered = True
+    return app
+
+
+def init_worker():
+    """
+    Creates this process's API clients and loads the gazetteer, so that no
+    webhook pays for them, then resumes the saved jobs and keeps checking
+    for new ones every PENDING_JOBS_POLL seconds.
+    """
+    get_twilio_client()
+    get_openai_client()
+    get_openai_guard()
+    get_gazetteer()
+    resumed = resume_pending_jobs()
+    if resumed:
+        logger.info("Resumed %d jobs saved by a stopped worker.", resumed)
+    if PENDING_JOBS_POLL > 0:
+        threading.Thread(target=poll_pending_jobs, name="pending-jobs", daemon=True).start()
+
+
+def poll_pending_jobs():
+    """Resumes the jobs other workers save while this one runs, until it starts draining."""
+    while not draining.wait(PENDING_JOBS_POLL):
+        try:
+            resumed = resume_pending_jobs()
+        except Exception as e:
+            logger.warning("Could not resume saved jobs: %s", e)
+            continue
+        if resumed:
+            logger.info("Resumed %d jobs saved by a stopped worker.", resumed)
+
+
+def resume_pending_jobs():
+    """
+    Queues the replies and messages that stopped workers saved while
+    draining. Jobs the queues cannot take right now are saved again.
+    Returns the number of jobs queued.
+    """
+    resumed = 0
+    for kind, args in pending_jobs.claim():
+        if kind == "reply":
+            queued = reply_queue.submit(deliver_reply, *args)
+        else:
+            queued = outbound_sender.dispatch(*args)
+        if queued:
+            resumed += 1
+        else:
+            pending_jobs.add(kind, args)
+    return resumed
+
+
+def begin_drain():
+    """
+    Turns new webhooks away (Twilio retries them against another worker)
+    and fails readiness, while the server still answers requests.
+    """
+    draining.set()
+
 
-    # Send a manual test message
-    test_sid = send_test_message(USER_PHONE, "Hello from Travel Guru test!")
-    print(f"Test message sent with SID: {test_sid}")
+def drain(timeout=None):
+    """
+    Shuts the worker down without dropping conversations: turns new
+    webhooks away, gives queued replies and outbound messages up to
+    timeout seconds (DRAIN_TIMEOUT by default) to be sent, and saves those
+    that have not started by then for the next worker. Replies still being
+    generated at the deadline are not saved: running them twice could send
+    the same answer twice. Only the first call drains.
+
+    Returns:
+    int: The number of jobs saved.
+    """
+    global _drained
+    with _drain_lock:
+        if _drained:
+            return 0
+        _drained = True
+    begin_drain()
+    deadline = time.monotonic() + (DRAIN_TIMEOUT if timeout is None else timeout)
+    saved = 0
+    for _, args, _ in reply_queue.drain(max(0.0, deadline - time.monotonic())):
+        # (incoming_msg, from_number, message_sid); the message stays claimed until it is resumed
+        pending_jobs.add("reply", args)
+        saved += 1
+    for _, args, _ in outbound_sender.queue.drain(max(0.0, deadline - time.monotonic())):
+        pending_jobs.add("outbound", args)
+        saved += 1
+    if saved:
+        logger.info("Saved %d unfinished jobs for the next worker.", saved)
+    # The replies that did finish are in the usage ledger's buffer
+    get_usage_ledger().flush()
+    return saved
+
+# ------------------------------------------------
+# 7) Development server: python flask-app.py
+# ------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Runs the Travel Guru webhook on the Flask development server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--debug", action="store_true")
+    parser.add_argument("--test-message", action="store_true",
+                        help="create the conversation of USER_PHONE and send it a test message first")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    if args.test_message:
+        # Create the conversation and add participant, or reuse the indexed one if Twilio still has it
+        conversation_id = confirm_conversation(
+            CHAT_SERVICE_SID,
+            USER_PHONE,
+            PROXY_PHONE
+        )
+        print(f"Conversation ready with ID: {conversation_id}")
+
+        # Send a manual test message
+        test_sid = send_test_message(USER_PHONE, "Hello from Travel Guru test!")
+        print(f"Test message sent with SID: {test_sid}")
 
-    # Start Flask server
-    app.run(debug=True)
\ No newline at end of file
+    app = create_app()
+    signal.signal(signal.SIGTERM, stop_on_signal)
+    # The reloader would run the app in a second process that is not drained
+    app.run(host=args.host, port=args.port, debug=args.debug, use_reloader=False)
+
+
+def stop_on_signal(signum, frame):
+    """
+    SIGTERM handler of the development server: turns webhooks away at once,
+    drains while the server still answers /readyz, then stops the server
+    as Ctrl+C would.
+    """
+    begin_drain()
+    threading.Thread(target=_drain_and_stop, name="drain", daemon=True).start()
+
+
+def _drain_and_stop():
+    drain()
+    _thread.interrupt_main()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""
+Destination gazetteer: maps free-text destinations such as "NYC", "new york",
+"New York City " or "Barcelonna" to one canonical destination with its
+country, time zone and coordinates, so that spelling variants share cache
+entries and the web search gets a precise location hint.
+
+Names and aliases are normalized (case, accents, punctuation) and looked
+up in a dict. Misspellings of names of at least eight characters are
+matched within one edit, and only when a single destination is that
+close: shorter names are too often another real place one letter away
+("Bari", "Mali" and "Bali"). Candidates come from an index of the names
+with one character deleted (symmetric delete), so a fuzzy lookup costs a
+few dozen dict probes instead of a scan of the gazetteer.
+
+The gazetteer is a CSV file with the columns id, name, country, region,
+timezone, latitude, longitude and aliases (separated by "|"), most
+popular destinations first. A second CSV file with the columns country,
+region and names (separated by "|") lists the countries and regions that
+may follow a comma, as in "Paris, Texas", so that such a place is not
+taken for the destination of the same name in another country.
+"""
+import csv
+import re
+import unicodedata
+from collections import namedtuple
+
+Destination = namedtuple(
+    "Destination", ["id", "name", "country", "region", "timezone", "latitude", "longitude"]
+)
+
+_NON_ALNUM = re.compile(r"[^a-z0-9]+")
+
+# Lookups remembered per process; destinations are a small, repetitive set
+MEMO_SIZE = 4096
+
+
+def normalize_destination(text):
+    """Lowercases, strips accents and punctuation, and collapses whitespace: "São  Paulo!" -> "sao paulo"."""
+    text = unicodedata.normalize("NFKD", str(text)).encode("ascii", "ignore").decode("ascii")
+    text = _NON_ALNUM.sub(" ", text.lower()).strip()
+    return text[4:] if text.startswith("the ") else text
+
+
+def max_edits(length):
+    """Edits tolerated in a name of this length: none up to 7 characters, then 1."""
+    return 0 if length <= 7 else 1
+
+
+def deletes(word, edits):
+    """Returns the strings made by deleting up to edits characters from word, word included."""
+    found = {word}
+    frontier = {word}
+    for _ in range(edits):
+        frontier = {variant[:i] + variant[i + 1:] for variant in frontier for i in range(len(variant))}
+        found |= frontier
+    return found
+
+
+def edit_distance(a, b, limit):
+    """
+    Optimal string alignment distance between a and b (insertions,
+    deletions, substitutions and adjacent transpositions), or limit + 1
+    as soon as it is known to exceed limit. Only cells within limit of the
+    diagonal are computed.
+    """
+    len_a, len_b = len(a), len(b)
+    if abs(len_a - len_b) > limit:
+        return limit + 1
+    over = limit + 1
+    previous_previous = None
+    previous = [j if j <= limit else over for j in range(len_b + 1)]
+    for i in range(1, len_a + 1):
+        current = [over] * (len_b + 1)
+        if i <= limit:
+            current[0] = i
+        char_a = a[i - 1]
+        row_min = current[0]
+        for j in range(max(1, i - limit), min(len_b, i + limit) + 1):
+            char_b = b[j - 1]
+            value = previous[j - 1] + (char_a != char_b)
+            if previous[j] + 1 < value:
+                value = previous[j] + 1
+            if current[j - 1] + 1 < value:
+                value = current[j - 1] + 1
+            if (previous_previous is not None and j > 1 and char_a == b[j - 2] and a[i - 2] == char_b
+                    and previous_previous[j - 2] + 1 < value):
+                value = previous_previous[j - 2] + 1
+            current[j] = value
+            if value < row_min:
+                row_min = value
+        if row_min > limit:
+            return over
+        previous_previous, previous = previous, current
+    return min(previous[len_b], over)
+
+
+class Gazetteer:
+    """In-memory index of destinations by normalized name and alias."""
+
+    def __init__(self, destinations=(), aliases=(), regions=()):
+        """
+        Parameters:
+        destinations (list): Destination tuples, most popular first.
+        aliases (list): (alias, index into destinations) pairs; the names
+        of the destinations are added automatically.
+        regions (list): (name, country, region) triples naming a country
+        (region None) or a region; the countries and regions of the
+        destinations are added automatically.
+        """
+        self.destinations = tuple(destinations)
+        self._names = {}
+        self._deletes = {}
+        self._regions = {}
+        self._memo = {}
+        for index, destination in enumerate(self.destinations):
+            self._add(destination.name, index)
+            self._add_region(destination.country, destination.country, None)
+            if destination.region:
+                self._add_region(destination.region, destination.country, destination.region)
+        for alias, index in aliases:
+            self._add(alias, index)
+        for name, country, region in regions:
+            self._add_region(name, country, region)
+        # Most variants belong to a single name, which is then stored without a container
+        for name in self._names:
+            for variant in deletes(name, max_edits(len(name))):
+                names = self._deletes.get(variant)
+                if names is None:
+                    self._deletes[variant] = name
+                elif isinstance(names, str):
+                    self._deletes[variant] = (names, name)
+                else:
+                    self._deletes[variant] = names + (name,)
+
+    def _add(self, name, index):
+        key = normalize_destination(name)
+        if key:
+            # The first, most popular destination keeps a shared name
+            self._names.setdefault(key, index)
+
+    def _add_region(self, name, country, region):
+        key = normalize_destination(name)
+        if key:
+            self._regions.setdefault(key, set()).add((country, normalize_destination(region or "")))
+
+    @classmethod
+    def from_csv(cls, path, regions_path=None):
+        """Loads a gazetteer CSV file and optionally a regions CSV file, see the module docstring."""
+        destinations = []
+        aliases = []
+        regions = []
+        if regions_path is not None:
+            with open(regions_path, newline="", encoding="utf-8") as regions_file:
+                for row in csv.DictReader(regions_file):
+                    names = [name for name in row["names"].split("|") if name]
+                    if not row["region"]:
+                        names.append(row["country"])
+                    regions.extend((name, row["country"], row["region"] or None) for name in names)
+        with open(path, newline="", encoding="utf-8") as gazetteer_file:
+            for row in csv.DictReader(gazetteer_file):
+                index = len(destinations)
+                destinations.append(Destination(
+                    row["id"], row["name"], row["country"], row["region"] or None, row["timezone"] or None,
+                    float(row["latitude"]), float(row["longitude"]),
+                ))
+                aliases.extend((alias, index) for alias in (row.get("aliases") or "").split("|") if alias)
+        return cls(destinations, aliases, regions)
+
+    def lookup(self, text, partial=False, fuzzy=True):
+        """
+        Returns the Destination that text names, allowing for misspellings
+        unless fuzzy is false, or None. With partial, "Lisbon, Alfama" also
+        finds Lisbon by the part before the first comma, but "Paris, Texas"
+        does not find Paris, France: a country or region after a comma must
+        be the destination's own.
+        """
+        memo_key = (text, partial, fuzzy)
+        destination = self._memo.get(memo_key, self)
+        if destination is self:
+            destination = self._lookup(normalize_destination(text), fuzzy)
+            if destination is None and partial and "," in str(text):
+                head, *qualifiers = str(text).split(",")
+                destination = self._lookup(normalize_destination(head), fuzzy)
+                if destination is not None and not all(self._within(destination, qualifier)
+                                                       for qualifier in qualifiers):
+                    destination = None
+            if len(self._memo) >= MEMO_SIZE:
+                self._memo.clear()
+            self._memo[memo_key] = destination
+        return destination
+
+    def _lookup(self, key, fuzzy):
+        if not key:
+            return None
+        index = self._names.get(key)
+        if index is not None:
+            return self.destinations[index]
+        edits = max_edits(len(key)) if fuzzy else 0
+        if not edits:
+            return None
+        candidates = set()
+        for variant in deletes(key, edits):
+            names = self._deletes.get(variant)
+            if isinstance(names, str):
+                candidates.add(names)
+            elif names:
+                candidates.update(names)
+        matches = set()
+        for name in candidates:
+            limit = min(edits, max_edits(len(name)))
+            if edit_distance(key, name, limit) <= limit:
+                matches.add(self._names[name])
+        # Two destinations equally close is a guess, not a correction
+        return self.destinations[matches.pop()] if len(matches) == 1 else None
+
+    def _within(self, destination, qualifier):
+        """False if qualifier names a country or region that destination is not in."""
+        meanings = self._regions.get(normalize_destination(qualifier))
+        if not meanings:
+            return True
+        region = normalize_destination(destination.region or "")
+        return any(country == destination.country and (not named or named == region)
+                   for country, named in meanings)
+
+    def stats(self):
+        """Returns the number of destinations, names, indexed deletion variants and regions."""
+        return {"destinations": len(self.destinations), "names": len(self._names),
+                "delete_variants": len(self._deletes), "regions": len(self._regions), "memoized": len(self._memo)}
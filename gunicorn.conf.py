@@ -0,0 +1,57 @@
+"""
+Gunicorn settings for the WhatsApp webhook:
+    gunicorn -c gunicorn.conf.py "flask-app:create_app()"
+
+On SIGTERM a worker turns new webhooks away and fails /readyz at once,
+while gunicorn lets its last requests finish; once it has stopped serving,
+the worker drains its queued replies and messages (see drain() in
+flask-app.py) before it exits.
+"""
+import logging
+import os
+import signal
+
+bind = os.getenv("BIND", "127.0.0.1:5000")
+workers = int(os.getenv("WEB_CONCURRENCY", "4"))
+threads = int(os.getenv("WEB_THREADS", "8"))
+# Requests in flight plus the drain must end before the worker is killed
+graceful_timeout = float(os.getenv("DRAIN_TIMEOUT", "20")) + 10
+
+
+def on_starting(server):
+    """Sends the app's log lines, e.g. jobs resumed after a restart, to stderr like gunicorn's own."""
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(),
+                        format="[%(asctime)s] [%(process)d] [%(levelname)s] %(name)s: %(message)s")
+
+
+def _lifecycle(worker):
+    # What create_app() registered, unless the worker failed to load the app
+    app = getattr(worker, "wsgi", None)
+    return getattr(app, "extensions", {}).get("worker")
+
+
+def post_worker_init(worker):
+    """Wraps gunicorn's SIGTERM handler so that draining starts before the worker stops serving."""
+    handle_exit = signal.getsignal(signal.SIGTERM)
+
+    def begin_drain_and_exit(signum, frame):
+        lifecycle = _lifecycle(worker)
+        if lifecycle is not None:
+            lifecycle.begin_drain()
+        handle_exit(signum, frame)
+
+    signal.signal(signal.SIGTERM, begin_drain_and_exit)
+
+
+def worker_int(worker):
+    """SIGINT or SIGQUIT: stop taking webhooks; the worker exits right after."""
+    lifecycle = _lifecycle(worker)
+    if lifecycle is not None:
+        lifecycle.begin_drain()
+
+
+def worker_exit(server, worker):
+    """Drains the worker once it has stopped serving; the drain at exit is only a fallback."""
+    lifecycle = _lifecycle(worker)
+    if lifecycle is not None:
+        lifecycle.drain()
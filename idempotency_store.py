@@ -0,0 +1,138 @@
+import sqlite3
+import threading
+import time
+
+
+class IdempotencyStore:
+    """
+    Remembers which inbound messages (by Twilio MessageSid) are being or have
+    been handled, and their reply, in a SQLite database in WAL mode shared
+    by every worker process.
+
+    Twilio retries a webhook that is slow or fails. With this store a retry
+    gets the reply computed for the first delivery, or waits for it,
+    instead of running the conversation turn and the LLM call again.
+
+    Entries are forgotten after ttl seconds. A message still marked as in
+    progress after pending_timeout seconds is assumed to have been lost
+    with its worker and may be handled again.
+    """
+
+    NEW = "new"
+    PENDING = "pending"
+    DONE = "done"
+
+    # How many begin() calls happen between two clean-up passes
+    CLEANUP_INTERVAL = 256
+
+    def __init__(self, path, ttl=24 * 60 * 60, pending_timeout=300):
+        self.path = path
+        self.ttl = ttl
+        self.pending_timeout = pending_timeout
+        self._conn = None
+        self._lock = threading.Lock()
+        self._begins_since_cleanup = 0
+        self.new = 0
+        self.duplicates = 0
+        self.reclaimed = 0
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                "sid TEXT PRIMARY KEY, status TEXT, reply TEXT, started_at REAL) WITHOUT ROWID"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS messages_started_at ON messages (started_at)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def begin(self, sid):
+        """
+        Claims a message for handling.
+
+        Returns:
+        tuple: (NEW, None) if the caller should handle the message,
+        (PENDING, None) if another request is handling it, or
+        (DONE, reply) if it has been handled already.
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            # BEGIN IMMEDIATE so that two processes cannot both claim the message
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT status, reply, started_at FROM messages WHERE sid = ?", (sid,)
+                ).fetchone()
+                if row is not None and row[2] + self.ttl > now and (
+                        row[0] == self.DONE or row[2] + self.pending_timeout > now):
+                    self.duplicates += 1
+                    return row[0], row[1]
+                if row is not None and row[0] == self.PENDING:
+                    self.reclaimed += 1
+                conn.execute(
+                    "INSERT OR REPLACE INTO messages (sid, status, reply, started_at) VALUES (?, ?, NULL, ?)",
+                    (sid, self.PENDING, now),
+                )
+                self.new += 1
+                self._begins_since_cleanup += 1
+                if self._begins_since_cleanup >= self.CLEANUP_INTERVAL:
+                    self._cleanup(conn, now)
+            finally:
+                conn.commit()
+        return self.NEW, None
+
+    def complete(self, sid, reply=None):
+        """Marks a message as handled and stores the reply that retries should get."""
+        with self._lock:
+            conn = self._connect()
+            conn.execute("UPDATE messages SET status = ?, reply = ? WHERE sid = ?", (self.DONE, reply, sid))
+            conn.commit()
+
+    def release(self, sid):
+        """Forgets a message whose handling failed, so that a retry handles it again."""
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM messages WHERE sid = ? AND status = ?", (sid, self.PENDING))
+            conn.commit()
+
+    def wait(self, sid, timeout, poll_interval=0.05):
+        """
+        Waits up to timeout seconds for another request to finish a message.
+
+        Returns:
+        tuple: (status, reply) as returned by begin(), without claiming the message.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                row = self._connect().execute(
+                    "SELECT status, reply FROM messages WHERE sid = ?", (sid,)
+                ).fetchone()
+            if row is None:
+                return self.NEW, None
+            if row[0] == self.DONE or time.monotonic() >= deadline:
+                return row[0], row[1]
+            time.sleep(min(poll_interval, max(deadline - time.monotonic(), 0)))
+            poll_interval = min(poll_interval * 2, 0.5)
+
+    def cleanup(self):
+        """Drops entries older than the TTL."""
+        with self._lock:
+            conn = self._connect()
+            self._cleanup(conn, time.time())
+            conn.commit()
+
+    def _cleanup(self, conn, now):
+        self._begins_since_cleanup = 0
+        conn.execute("DELETE FROM messages WHERE started_at <= ?", (now - self.ttl,))
+
+    def stats(self):
+        """Returns how many messages were new, duplicates or reclaimed in this process."""
+        with self._lock:
+            return {"new": self.new, "duplicates": self.duplicates, "reclaimed": self.reclaimed}
@@ -0,0 +1,171 @@
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from metrics import QUEUE_WAIT_SECONDS, record_error
+
+
+class JobQueue:
+    """
+    A bounded pool of worker threads for background jobs.
+
+    At most max_workers jobs run at once and at most max_queued jobs wait
+    for a free worker. When both are taken, submit() refuses the job so
+    the caller can shed load instead of piling up work it cannot finish.
+
+    drain() is for shutting down without losing work: it stops accepting
+    jobs, gives the accepted ones time to finish and hands back those that
+    never started, so the caller can save them.
+    """
+
+    def __init__(self, max_workers=4, max_queued=32, name="job"):
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.name = name
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._slots = threading.BoundedSemaphore(max_workers + max_queued)
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        # Accepted jobs that have not started, by job number
+        self._waiting = {}
+        self._job_numbers = itertools.count()
+        self.closed = False
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.total_wait_time = 0.0
+        self.total_run_time = 0.0
+        self.max_wait_time = 0.0
+        self.max_run_time = 0.0
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Enqueues func(*args, **kwargs) without blocking.
+
+        Returns:
+        bool: True if the job was accepted, False if the queue is full.
+        """
+        return self._submit(False, None, func, args, kwargs)
+
+    def submit_wait(self, func, *args, timeout=None, **kwargs):
+        """
+        Enqueues func(*args, **kwargs), waiting up to timeout seconds (or as
+        long as it takes if None) for room in the queue. For producers that
+        should slow down to the pace of the workers rather than drop jobs.
+
+        Returns:
+        bool: True if the job was accepted, False if it timed out.
+        """
+        return self._submit(True, timeout, func, args, kwargs)
+
+    def _submit(self, blocking, timeout, func, args, kwargs):
+        if self.closed or not self._slots.acquire(blocking, timeout):
+            with self._lock:
+                self.rejected += 1
+            return False
+        with self._lock:
+            if self.closed:
+                self.rejected += 1
+                self._slots.release()
+                return False
+            self.queued += 1
+            number = next(self._job_numbers)
+            self._waiting[number] = (func, args, kwargs)
+        try:
+            self._executor.submit(self._run, time.perf_counter(), number)
+        except RuntimeError:
+            # The executor has been shut down
+            with self._lock:
+                self._waiting.pop(number, None)
+                self.queued -= 1
+                self.rejected += 1
+            self._slots.release()
+            return False
+        return True
+
+    def _run(self, enqueued_at, number):
+        started_at = time.perf_counter()
+        wait_time = started_at - enqueued_at
+        with self._lock:
+            job = self._waiting.pop(number, None)
+            if job is None:
+                # Handed back by drain()
+                return
+            self.queued -= 1
+            self.running += 1
+        QUEUE_WAIT_SECONDS.labels(self.name).observe(wait_time)
+        func, args, kwargs = job
+        failed = False
+        try:
+            func(*args, **kwargs)
+        except Exception as e:
+            failed = True
+            record_error(self.name, e)
+            print(f"Background job {getattr(func, '__name__', func)} failed: {e}")
+        finally:
+            run_time = time.perf_counter() - started_at
+            with self._lock:
+                self.running -= 1
+                if failed:
+                    self.failed += 1
+                else:
+                    self.completed += 1
+                self.total_wait_time += wait_time
+                self.total_run_time += run_time
+                self.max_wait_time = max(self.max_wait_time, wait_time)
+                self.max_run_time = max(self.max_run_time, run_time)
+                self._idle.notify_all()
+            self._slots.release()
+
+    def depth(self):
+        """Returns the number of jobs waiting for a worker."""
+        return self.queued
+
+    def stats(self):
+        """Returns counters and timing totals for sizing the pool."""
+        with self._lock:
+            finished = self.completed + self.failed
+            return {
+                "max_workers": self.max_workers,
+                "max_queued": self.max_queued,
+                "queued": self.queued,
+                "running": self.running,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "avg_wait_time": self.total_wait_time / finished if finished else 0.0,
+                "avg_run_time": self.total_run_time / finished if finished else 0.0,
+                "max_wait_time": self.max_wait_time,
+                "max_run_time": self.max_run_time,
+            }
+
+    def drain(self, timeout):
+        """
+        Stops accepting jobs and waits up to timeout seconds for the queued
+        and running ones to finish.
+
+        Returns:
+        list: (func, args, kwargs) of the jobs that had not started by then;
+        they will not run. Jobs still running are left to finish.
+        """
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            self.closed = True
+            while self.queued or self.running:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._idle.wait(remaining)
+            unstarted = list(self._waiting.values())
+            self._waiting.clear()
+            self.queued -= len(unstarted)
+        for _ in unstarted:
+            self._slots.release()
+        self._executor.shutdown(wait=False)
+        return unstarted
+
+    def shutdown(self, wait=True):
+        """Stops accepting jobs and optionally waits for running ones."""
+        self._executor.shutdown(wait=wait)
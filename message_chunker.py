@@ -0,0 +1,86 @@
+import re
+
+# Twilio rejects WhatsApp message bodies longer than this
+MAX_MESSAGE_LENGTH = 1600
+
+# Don't send a message before at least this much text is available
+MIN_CHUNK_LENGTH = 200
+
+# A paragraph break, or a line break followed by a list item ("- ", "* ", "1. ", "2) ")
+_BOUNDARY = re.compile(r"\n[ \t]*\n|\n(?=[ \t]*(?:[-*•]|\d+[.)])[ \t])")
+
+
+def split_point(text, limit):
+    """
+    Returns where to cut text so that the first part is at most limit
+    characters, preferring paragraph/list boundaries, then line breaks,
+    then spaces.
+    """
+    best = 0
+    for match in _BOUNDARY.finditer(text, 0, limit):
+        if match.start() > 0:
+            best = match.end()
+    if best:
+        return best
+    for separator in ("\n", " "):
+        index = text.rfind(separator, 0, limit)
+        if index > 0:
+            return index + 1
+    return limit
+
+
+def split_message(text, max_length=MAX_MESSAGE_LENGTH):
+    """Splits a complete answer into WhatsApp-sized messages, in order."""
+    parts = []
+    text = text.strip()
+    while len(text) > max_length:
+        cut = split_point(text, max_length)
+        part = text[:cut].strip()
+        if part:
+            parts.append(part)
+        text = text[cut:].strip()
+    if text:
+        parts.append(text)
+    return parts
+
+
+class MessageChunker:
+    """
+    Turns a stream of text deltas into WhatsApp-sized messages. A message
+    is released as soon as at least min_length characters are followed by
+    a paragraph or list-item boundary, so the first message goes out long
+    before the whole answer is generated.
+    """
+
+    def __init__(self, max_length=MAX_MESSAGE_LENGTH, min_length=MIN_CHUNK_LENGTH):
+        self.max_length = max_length
+        self.min_length = min_length
+        self.buffer = ""
+
+    def feed(self, text):
+        """Adds generated text and returns the messages that are ready to send."""
+        self.buffer += text
+        chunks = []
+        while True:
+            cut = self._find_cut()
+            if not cut:
+                return chunks
+            chunk = self.buffer[:cut].strip()
+            self.buffer = self.buffer[cut:]
+            if chunk:
+                chunks.append(chunk)
+
+    def flush(self):
+        """Returns whatever text is left once the stream has ended."""
+        chunks = split_message(self.buffer, self.max_length)
+        self.buffer = ""
+        return chunks
+
+    def _find_cut(self):
+        if len(self.buffer) > self.max_length:
+            return split_point(self.buffer, self.max_length)
+        cut = 0
+        for match in _BOUNDARY.finditer(self.buffer):
+            if match.start() >= self.min_length:
+                cut = match.end()
+        return cut
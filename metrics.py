@@ -0,0 +1,284 @@
+"""
+Minimal Prometheus-style metrics: counters, gauges and histograms with
+labels, rendered in the Prometheus text exposition format.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from sub-millisecond validation to slow LLM calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Registry:
+    """Holds metrics and collector callbacks and renders them on scrape."""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def register_collector(self, collector):
+        """
+        Registers a callable that is run on every scrape. It returns a list of
+        (name, type, help, samples) tuples, samples being (labels dict, value) pairs.
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self):
+        """Returns every metric in the Prometheus text format."""
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+        for metric in metrics:
+            metric.render(lines)
+        for collector in collectors:
+            for name, metric_type, documentation, samples in collector():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(sorted(labels.items()))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    metric_type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._default = self.labels()
+        registry.register(self)
+
+    def labels(self, *values):
+        """Returns the child metric for the given label values."""
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self, lines):
+        lines.append(f"# HELP {self.name} {self.documentation}")
+        lines.append(f"# TYPE {self.name} {self.metric_type}")
+        with self._lock:
+            children = list(self._children.items())
+        for key, child in children:
+            child.render(self.name, list(zip(self.labelnames, key)), lines)
+
+
+class _Value:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+    def render(self, name, labels, lines):
+        lines.append(f"{name}{_format_labels(labels)} {_format_value(self.value)}")
+
+
+class Counter(_Metric):
+    metric_type = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+
+class Gauge(_Metric):
+    metric_type = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value):
+        self._default.set(value)
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def dec(self, amount=1):
+        self._default.dec(amount)
+
+
+class _HistogramValue:
+    __slots__ = ("bounds", "counts", "sum", "_lock")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def render(self, name, labels, lines):
+        with self._lock:
+            counts = list(self.counts)
+            total = self.sum
+        cumulative = 0
+        for bound, count in zip(self.bounds + (float("inf"),), counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels(labels + [('le', _format_value(bound))])} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+        lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+
+
+class Histogram(_Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(float(bucket) for bucket in buckets)
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+
+# Metrics shared by the app modules
+STAGE_SECONDS = Histogram(
+    "travelguru_stage_seconds", "Time spent in each stage of handling a message.", ["stage"]
+)
+ERRORS = Counter(
+    "travelguru_errors_total", "Errors by stage and exception type.", ["stage", "type"]
+)
+OPENAI_TOKENS = Counter(
+    "travelguru_openai_tokens_total", "Tokens reported by the OpenAI API.", ["type"]
+)
+QUEUE_WAIT_SECONDS = Histogram(
+    "travelguru_queue_wait_seconds", "Time jobs wait in a queue before a worker picks them up.", ["queue"]
+)
+RETRIES = Counter(
+    "travelguru_retries_total", "Attempts repeated after a retryable upstream error.", ["call"]
+)
+HEDGES = Counter(
+    "travelguru_hedged_requests_total", "Second attempts started because the first one was slow.", ["call"]
+)
+BREAKER_STATE = Gauge(
+    "travelguru_circuit_breaker_state", "Circuit breaker state: 0 closed, 1 half-open, 2 open.", ["breaker"]
+)
+BREAKER_REJECTIONS = Counter(
+    "travelguru_circuit_breaker_rejections_total", "Calls refused while the circuit breaker was open.",
+    ["breaker"]
+)
+STALE_FALLBACKS = Counter(
+    "travelguru_stale_fallbacks_total", "Expired cached answers served because the upstream call failed.",
+    ["service"]
+)
+POLICY_SECONDS = Histogram(
+    "travelguru_search_policy_seconds", "OpenAI call latency by web search policy.", ["policy"]
+)
+POLICY_TOKENS = Counter(
+    "travelguru_search_policy_tokens_total", "Tokens reported by the OpenAI API by web search policy.",
+    ["policy", "type"]
+)
+SCHEDULER_REJECTIONS = Counter(
+    "travelguru_scheduler_rejections_total", "Answer generations refused by admission control, by reason.",
+    ["reason"]
+)
+BUDGET_ACTIONS = Counter(
+    "travelguru_budget_actions_total", "Answers degraded to cheaper settings or refused by a spend cap.",
+    ["service", "action"]
+)
+
+
+@contextmanager
+def time_stage(stage):
+    """Records how long the with-block takes in STAGE_SECONDS."""
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - started_at)
+
+
+@contextmanager
+def time_policy(policy):
+    """Records how long the with-block takes in POLICY_SECONDS."""
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        POLICY_SECONDS.labels(policy).observe(time.perf_counter() - started_at)
+
+
+def record_error(stage, error):
+    """Counts an exception under ERRORS by stage and exception class."""
+    ERRORS.labels(stage, type(error).__name__).inc()
+
+
+def record_usage(response, policy=None):
+    """
+    Adds the token usage of an OpenAI response to OPENAI_TOKENS, and to
+    POLICY_TOKENS when the name of the search policy is given.
+    """
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    input_tokens = getattr(usage, "input_tokens", 0) or 0
+    output_tokens = getattr(usage, "output_tokens", 0) or 0
+    OPENAI_TOKENS.labels("input").inc(input_tokens)
+    OPENAI_TOKENS.labels("output").inc(output_tokens)
+    if policy:
+        POLICY_TOKENS.labels(policy, "input").inc(input_tokens)
+        POLICY_TOKENS.labels(policy, "output").inc(output_tokens)
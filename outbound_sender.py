@@ -0,0 +1,132 @@
+"""
+Outbound WhatsApp messages: a token bucket that keeps us within the
+sender's throughput, a bounded pool of dispatch workers, splitting of long
+answers into WhatsApp-sized parts, and retries with backoff when a message
+certainly was not sent (429 or no connection). Sending is not idempotent:
+after a timeout or a 5xx Twilio may have accepted the message, so it is
+not sent again.
+"""
+import threading
+import time
+from job_queue import JobQueue
+from message_chunker import split_message
+from metrics import time_stage
+from resilience import CallGuard, is_safe_to_resend
+
+
+class TokenBucket:
+    """
+    Allows rate events per second on average, with bursts of up to burst
+    events. acquire() blocks until a token is available.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(rate, 1))
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def acquire(self, timeout=None):
+        """
+        Takes one token, waiting up to timeout seconds (forever if None).
+
+        Returns:
+        bool: True if a token was taken, False if the timeout ran out first.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if deadline is not None:
+                if now + wait > deadline:
+                    return False
+            time.sleep(wait)
+
+
+class OutboundSender:
+    """
+    Sends messages through create_message(to, body), which returns the
+    message SID. Every part goes through the token bucket and, for 429 and
+    connection errors, is retried by the guard.
+
+    send() sends on the caller's thread. dispatch() and broadcast() hand
+    messages to max_workers dispatch workers; the parts of one message are
+    always sent in order by a single worker.
+    """
+
+    def __init__(self, create_message, rate=10, burst=None, max_workers=8, max_queued=1000, guard=None):
+        self.create_message = create_message
+        self.bucket = TokenBucket(rate, burst)
+        self.guard = guard or CallGuard("twilio")
+        self.queue = JobQueue(max_workers=max_workers, max_queued=max_queued, name="outbound")
+        self._lock = threading.Lock()
+        self.parts_sent = 0
+        self.parts_failed = 0
+
+    def send_part(self, to, body):
+        """Sends one part of at most MAX_MESSAGE_LENGTH characters and returns its SID."""
+        with time_stage("outbound_rate_limit"):
+            self.bucket.acquire()
+        try:
+            with time_stage("outbound_send"):
+                sid = self.guard.call(lambda timeout: self.create_message(to, body), hedge=False,
+                                      retry_on=is_safe_to_resend)
+        except Exception:
+            with self._lock:
+                self.parts_failed += 1
+            raise
+        with self._lock:
+            self.parts_sent += 1
+        return sid
+
+    def send(self, to, body):
+        """Splits body into WhatsApp-sized parts, sends them in order and returns their SIDs."""
+        return [self.send_part(to, part) for part in split_message(body)]
+
+    def dispatch(self, to, body):
+        """
+        Queues a message for the dispatch workers without blocking.
+
+        Returns:
+        bool: False if the dispatch queue is full.
+        """
+        return self.queue.submit(self.send, to, body)
+
+    def broadcast(self, recipients, body, timeout=None):
+        """
+        Queues the same message for many recipients, waiting for room in the
+        dispatch queue instead of dropping messages.
+
+        Returns:
+        int: The number of messages queued; lower than the number of
+        recipients only if timeout ran out while waiting for room.
+        """
+        queued = 0
+        for to in recipients:
+            if self.queue.submit_wait(self.send, to, body, timeout=timeout):
+                queued += 1
+        return queued
+
+    def depth(self):
+        """Returns the number of messages waiting for a dispatch worker."""
+        return self.queue.depth()
+
+    def stats(self):
+        """Returns part counters and the dispatch queue statistics."""
+        with self._lock:
+            counters = {"parts_sent": self.parts_sent, "parts_failed": self.parts_failed}
+        return dict(counters, queue=self.queue.stats(), guard=self.guard.stats())
+
+    def shutdown(self, wait=True):
+        """Stops the dispatch workers, optionally after the queued messages are sent."""
+        self.queue.shutdown(wait=wait)
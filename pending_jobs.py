@@ -0,0 +1,71 @@
+import json
+import sqlite3
+import threading
+import time
+
+
+class PendingJobStore:
+    """
+    Keeps background jobs that a worker could not finish before shutting
+    down, so that the next worker to start runs them instead of the work
+    being lost with the process.
+
+    A job is a kind (e.g. "reply") and a list of JSON arguments. Jobs live
+    in a SQLite database in WAL mode shared by every worker process; each
+    job is claimed by exactly one worker.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+        self.saved = 0
+        self.claimed = 0
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS pending_jobs ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT, args TEXT, saved_at REAL)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def add(self, kind, args):
+        """Saves a job to be run by the next worker to start."""
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT INTO pending_jobs (kind, args, saved_at) VALUES (?, ?, ?)",
+                (kind, json.dumps(list(args)), time.time()),
+            )
+            conn.commit()
+            self.saved += 1
+
+    def claim(self):
+        """Removes every saved job and returns them as (kind, args) pairs, oldest first."""
+        with self._lock:
+            conn = self._connect()
+            # BEGIN IMMEDIATE so that workers starting together cannot claim the same jobs
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = conn.execute("SELECT id, kind, args FROM pending_jobs ORDER BY id").fetchall()
+                if rows:
+                    conn.execute("DELETE FROM pending_jobs WHERE id <= ?", (rows[-1][0],))
+            finally:
+                conn.commit()
+            self.claimed += len(rows)
+            return [(kind, json.loads(args)) for _, kind, args in rows]
+
+    def count(self):
+        """Returns the number of jobs waiting for a worker."""
+        with self._lock:
+            return self._connect().execute("SELECT COUNT(*) FROM pending_jobs").fetchone()[0]
+
+    def stats(self):
+        """Returns how many jobs this process saved and claimed."""
+        with self._lock:
+            return {"saved": self.saved, "claimed": self.claimed}
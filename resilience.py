@@ -0,0 +1,364 @@
+"""
+Protection around calls to a slow or failing upstream: a deadline per call,
+bounded retries with exponential backoff and jitter, a circuit breaker that
+fails fast while the upstream is unhealthy, and optional hedged requests
+that race a second attempt against a slow first one.
+"""
+import os
+import random
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from metrics import BREAKER_REJECTIONS, BREAKER_STATE, HEDGES, RETRIES
+
+# OpenAI SDK and requests errors worth retrying, by class name so that
+# neither library is imported here
+RETRYABLE_ERRORS = {"APITimeoutError", "APIConnectionError", "RateLimitError", "InternalServerError",
+                    "ConnectionError", "Timeout", "ConnectTimeout", "ReadTimeout"}
+RETRYABLE_STATUS = {408, 409, 429}
+# Errors raised before a request reached the upstream, by class name
+CONNECT_ERRORS = {"ConnectTimeout", "NewConnectionError", "NameResolutionError", "ConnectionRefusedError"}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the upstream while the circuit breaker is open."""
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when the overall deadline of a call runs out between attempts."""
+
+
+def is_retryable(error):
+    """Whether a failed attempt may succeed when repeated: timeouts, connection errors, 429 and 5xx."""
+    if isinstance(error, (TimeoutError, ConnectionError)) or type(error).__name__ in RETRYABLE_ERRORS:
+        return True
+    # status_code on OpenAI errors, status on TwilioRestException
+    status = getattr(error, "status_code", None) or getattr(error, "status", None)
+    return isinstance(status, int) and (status in RETRYABLE_STATUS or status >= 500)
+
+
+def is_safe_to_resend(error):
+    """
+    Whether a failed call that is not idempotent, such as sending a message,
+    may be repeated: only if the request never reached the upstream (the
+    connection could not be made) or the upstream refused it with 429. After
+    a timeout or a 5xx, the upstream may have acted on it already.
+    """
+    cause = error
+    # requests wraps the connection error of urllib3 in one or two layers
+    for _ in range(4):
+        if cause is None:
+            break
+        if type(cause).__name__ in CONNECT_ERRORS:
+            return True
+        cause = getattr(cause, "reason", None) or (cause.args[0] if getattr(cause, "args", None) else None)
+        if not isinstance(cause, BaseException):
+            break
+    status = getattr(error, "status_code", None) or getattr(error, "status", None)
+    return status == 429
+
+
+# attempts:        maximum number of attempts, including the first one
+# base_delay:      backoff before the first retry, doubled for every further retry
+# max_delay:       upper bound of a single backoff
+# deadline:        seconds for all attempts and backoffs together
+# attempt_timeout: seconds for a single attempt
+# hedge_after:     seconds after which a second, hedged attempt is started; 0 disables hedging
+RetryPolicy = namedtuple(
+    "RetryPolicy", ["attempts", "base_delay", "max_delay", "deadline", "attempt_timeout", "hedge_after"]
+)
+
+DEFAULT_RETRY_POLICY = RetryPolicy(3, 0.5, 8.0, 90.0, 60.0, 0.0)
+
+
+def retry_policy_from_env(prefix, defaults=DEFAULT_RETRY_POLICY):
+    """
+    Reads a retry policy from <prefix>_RETRY_ATTEMPTS, <prefix>_RETRY_BASE_DELAY,
+    <prefix>_RETRY_MAX_DELAY, <prefix>_DEADLINE, <prefix>_TIMEOUT and
+    <prefix>_HEDGE_AFTER, falling back to defaults.
+    """
+    return RetryPolicy(
+        attempts=max(int(os.getenv(f"{prefix}_RETRY_ATTEMPTS", defaults.attempts)), 1),
+        base_delay=float(os.getenv(f"{prefix}_RETRY_BASE_DELAY", defaults.base_delay)),
+        max_delay=float(os.getenv(f"{prefix}_RETRY_MAX_DELAY", defaults.max_delay)),
+        deadline=float(os.getenv(f"{prefix}_DEADLINE", defaults.deadline)),
+        attempt_timeout=float(os.getenv(f"{prefix}_TIMEOUT", defaults.attempt_timeout)),
+        hedge_after=float(os.getenv(f"{prefix}_HEDGE_AFTER", defaults.hedge_after)),
+    )
+
+
+def backoff_delay(retry, base_delay, max_delay):
+    """Full-jitter backoff: a random delay up to base_delay * 2**retry, capped at max_delay."""
+    return random.uniform(0, min(max_delay, base_delay * (2 ** retry)))
+
+
+class CircuitBreaker:
+    """
+    Tracks the outcome of recent calls and opens when at least
+    failure_rate of the calls in the last window seconds failed (and there
+    were at least min_calls of them). While open, allow() refuses calls.
+    After reset_timeout seconds a single probe call is let through; its
+    outcome closes the breaker again or keeps it open. Outcomes of calls
+    let through before the breaker opened are ignored until it closes.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    # Returned by allow() for the probe call; its outcome is recorded with probe=True
+    PROBE = "probe"
+    STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, name, failure_rate=0.5, min_calls=10, window=60.0, reset_timeout=30.0):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.opened = 0
+        self.rejected = 0
+        self._outcomes = deque()  # (timestamp, failed)
+        self._failures = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+        BREAKER_STATE.labels(name).set(0)
+
+    def _set_state(self, state):
+        self.state = state
+        BREAKER_STATE.labels(self.name).set(self.STATE_VALUES[state])
+
+    def _trim(self, now):
+        while self._outcomes and self._outcomes[0][0] < now - self.window:
+            if self._outcomes.popleft()[1]:
+                self._failures -= 1
+
+    def allow(self):
+        """
+        Whether a call may go to the upstream now: False, True, or PROBE for
+        the probe call of a half-open breaker.
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self._set_state(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return self.PROBE
+            self.rejected += 1
+        BREAKER_REJECTIONS.labels(self.name).inc()
+        return False
+
+    def record_success(self, probe=False):
+        self._record(False, probe)
+
+    def record_failure(self, probe=False):
+        self._record(True, probe)
+
+    def _record(self, failed, probe):
+        now = time.monotonic()
+        with self._lock:
+            if self.state != self.CLOSED:
+                if not probe:
+                    # A call let through before the breaker opened says nothing about the upstream now
+                    return
+                self._probe_in_flight = False
+                if failed:
+                    self.opened_at = now
+                    self.opened += 1
+                    self._set_state(self.OPEN)
+                else:
+                    self._outcomes.clear()
+                    self._failures = 0
+                    self._set_state(self.CLOSED)
+                return
+
+            self._outcomes.append((now, failed))
+            self._failures += failed
+            self._trim(now)
+            calls = len(self._outcomes)
+            if failed and calls >= self.min_calls and self._failures >= self.failure_rate * calls:
+                self.opened_at = now
+                self.opened += 1
+                self._set_state(self.OPEN)
+
+    def stats(self):
+        with self._lock:
+            self._trim(time.monotonic())
+            return {
+                "state": self.state,
+                "recent_calls": len(self._outcomes),
+                "recent_failures": self._failures,
+                "opened": self.opened,
+                "rejected": self.rejected,
+            }
+
+
+def breaker_from_env(name, prefix):
+    """
+    Creates a circuit breaker configured by <prefix>_BREAKER_FAILURE_RATE,
+    <prefix>_BREAKER_MIN_CALLS, <prefix>_BREAKER_WINDOW and <prefix>_BREAKER_RESET.
+    """
+    return CircuitBreaker(
+        name,
+        failure_rate=float(os.getenv(f"{prefix}_BREAKER_FAILURE_RATE", "0.5")),
+        min_calls=int(os.getenv(f"{prefix}_BREAKER_MIN_CALLS", "10")),
+        window=float(os.getenv(f"{prefix}_BREAKER_WINDOW", "60")),
+        reset_timeout=float(os.getenv(f"{prefix}_BREAKER_RESET", "30")),
+    )
+
+
+class CallGuard:
+    """
+    Runs calls to one upstream under a retry policy and a circuit breaker.
+
+    The guarded function receives the timeout of the attempt in seconds.
+    Only retryable errors count against the breaker; others, such as a bad
+    request, are raised right away.
+    """
+
+    def __init__(self, name, policy=DEFAULT_RETRY_POLICY, breaker=None):
+        self.name = name
+        self.policy = policy
+        self.breaker = breaker or CircuitBreaker(name)
+        self.retries = 0
+        self.hedges = 0
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def call(self, func, hedge=True, retry_on=is_retryable):
+        """
+        Calls func(timeout) and returns its result, retrying the errors for
+        which retry_on is true; is_safe_to_resend() for calls that are not idempotent.
+        """
+        policy = self.policy
+        deadline_at = time.monotonic() + policy.deadline
+        attempt = 0
+        while True:
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceeded(f"{self.name} deadline of {policy.deadline:g}s exceeded")
+            allowed = self.breaker.allow()
+            if not allowed:
+                raise CircuitOpenError(f"{self.name} is temporarily unavailable, please try again later")
+            probe = allowed == CircuitBreaker.PROBE
+            timeout = min(policy.attempt_timeout, remaining)
+            try:
+                if hedge and 0 < policy.hedge_after < timeout:
+                    result = self._hedged(func, timeout)
+                else:
+                    result = func(timeout)
+            except Exception as e:
+                delay = self._after_failure(e, attempt, deadline_at, retry_on, probe)
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self.breaker.record_success(probe)
+            return result
+
+    async def call_async(self, func, hedge=True):
+        """Async variant of call(); func(timeout) returns an awaitable."""
+        import asyncio
+        policy = self.policy
+        deadline_at = time.monotonic() + policy.deadline
+        attempt = 0
+        while True:
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceeded(f"{self.name} deadline of {policy.deadline:g}s exceeded")
+            allowed = self.breaker.allow()
+            if not allowed:
+                raise CircuitOpenError(f"{self.name} is temporarily unavailable, please try again later")
+            probe = allowed == CircuitBreaker.PROBE
+            timeout = min(policy.attempt_timeout, remaining)
+            try:
+                if hedge and 0 < policy.hedge_after < timeout:
+                    result = await self._hedged_async(func, timeout)
+                else:
+                    result = await asyncio.wait_for(func(timeout), timeout)
+            except Exception as e:
+                delay = self._after_failure(e, attempt, deadline_at, probe=probe)
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            self.breaker.record_success(probe)
+            return result
+
+    def _after_failure(self, error, attempt, deadline_at, retry_on=is_retryable, probe=False):
+        """Records a failed attempt and returns the backoff before the next one, or re-raises."""
+        if not is_retryable(error):
+            # The upstream answered; the request itself was wrong
+            self.breaker.record_success(probe)
+            raise error
+        self.breaker.record_failure(probe)
+        if attempt + 1 >= self.policy.attempts or not retry_on(error):
+            raise error
+        delay = backoff_delay(attempt, self.policy.base_delay, self.policy.max_delay)
+        if time.monotonic() + delay >= deadline_at:
+            raise error
+        with self._lock:
+            self.retries += 1
+        RETRIES.labels(self.name).inc()
+        return delay
+
+    def _hedged(self, func, timeout):
+        """Runs func, and a second copy if the first is still running after hedge_after seconds."""
+        executor = self._get_executor()
+        started_at = time.monotonic()
+        pending = {executor.submit(func, timeout)}
+        done, pending = wait(pending, timeout=self.policy.hedge_after)
+        if not done:
+            with self._lock:
+                self.hedges += 1
+            HEDGES.labels(self.name).inc()
+            pending.add(executor.submit(func, max(timeout - (time.monotonic() - started_at), 0.001)))
+        error = None
+        while True:
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+            if not pending:
+                raise error
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+    async def _hedged_async(self, func, timeout):
+        import asyncio
+        started_at = time.monotonic()
+        pending = {asyncio.ensure_future(asyncio.wait_for(func(timeout), timeout))}
+        done, pending = await asyncio.wait(pending, timeout=self.policy.hedge_after)
+        if not done:
+            with self._lock:
+                self.hedges += 1
+            HEDGES.labels(self.name).inc()
+            remaining = max(timeout - (time.monotonic() - started_at), 0.001)
+            pending.add(asyncio.ensure_future(asyncio.wait_for(func(remaining), remaining)))
+        error = None
+        try:
+            while True:
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+                if not pending:
+                    raise error
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(thread_name_prefix=f"{self.name}-hedge")
+        return self._executor
+
+    def stats(self):
+        """Returns the breaker state and the retry and hedge counters of this process."""
+        with self._lock:
+            counters = {"retries": self.retries, "hedges": self.hedges}
+        return dict(self.breaker.stats(), **counters)
@@ -0,0 +1,204 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+
+# Default time-to-live (seconds) per service. Restaurant answers go stale
+# faster than attraction lists or itineraries.
+DEFAULT_TTLS = {
+    "1": 6 * 60 * 60,   # Restaurant Finder
+    "2": 24 * 60 * 60,  # Tourist Attractions
+    "3": 24 * 60 * 60,  # Mystery Planning Guide
+}
+
+# Upper edges of the budget buckets used in cache keys. A budget is mapped
+# to the first edge that is greater than or equal to it.
+BUDGET_BUCKETS = (10, 25, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+# Source of the entries stored by the warm-up job, see cache_warmup.py
+WARMUP_SOURCE = "warmup"
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(value):
+    """Lowercases a value and collapses runs of whitespace."""
+    return _WHITESPACE.sub(" ", str(value)).strip().lower()
+
+
+def bucket_budget(budget):
+    """
+    Maps a budget to the upper edge of its bucket, so that close budgets
+    share a cache entry. Non-numeric budgets are returned normalized.
+    """
+    text = normalize_text(budget)
+    if not text.isdigit():
+        return text
+    amount = int(text)
+    for edge in BUDGET_BUCKETS:
+        if amount <= edge:
+            return str(edge)
+    return f"{BUDGET_BUCKETS[-1]}+"
+
+
+def make_cache_key(service, user_details):
+    """
+    Builds a cache key from the selected service and the collected user details.
+
+    Parameters:
+    service (str): The selected service ("1", "2" or "3").
+    user_details (dict): The details collected by TripPlanner.
+
+    Returns:
+    str: A key such as "1|budget=50|cuisine=sushi|location=lisbon".
+    """
+    parts = [str(service)]
+    for field in sorted(user_details):
+        if field == "budget":
+            value = bucket_budget(user_details[field])
+        else:
+            value = normalize_text(user_details[field])
+        parts.append(f"{field}={value}")
+    return "|".join(parts)
+
+
+class ResponseCache:
+    """
+    SQLite-backed cache for OpenAI responses with a per-service TTL and an
+    LRU bound on the number of stored entries. The database file is shared
+    by every process that points at the same path.
+    """
+
+    def __init__(self, path, max_entries=10000, ttls=None):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttls = dict(DEFAULT_TTLS)
+        if ttls:
+            self.ttls.update(ttls)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale_hits = 0
+        self.warm_hits = 0
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, service TEXT, value TEXT, "
+                "expires_at REAL, last_access REAL, source TEXT DEFAULT 'live')"
+            )
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(responses)")}
+            if "source" not in columns:
+                # Caches created before warm-up entries were told apart
+                self._conn.execute("ALTER TABLE responses ADD COLUMN source TEXT DEFAULT 'live'")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def get(self, key):
+        """Returns the cached response for the key, or None if missing or expired."""
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT value, expires_at, source FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[1] <= now:
+                self.misses += 1
+                return None
+            conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            conn.commit()
+            self.hits += 1
+            if row[2] == WARMUP_SOURCE:
+                self.warm_hits += 1
+            return row[0]
+
+    def expires_in(self, key):
+        """Returns the seconds until the entry for the key expires (negative once expired), or None."""
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+        return None if row is None else row[0] - time.time()
+
+    def get_stale(self, key):
+        """
+        Returns the cached response for the key even if it has expired, as a
+        fallback when a fresh answer cannot be fetched. Entries are only gone
+        once evicted.
+        """
+        with self._lock:
+            row = self._connect().execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self.stale_hits += 1
+            return row[0]
+
+    def set(self, key, service, value, source="live"):
+        """
+        Stores a response and evicts entries beyond max_entries. The source
+        tells answers generated for users ("live") from precomputed ones
+        (WARMUP_SOURCE).
+        """
+        now = time.time()
+        ttl = self.ttls.get(service, max(self.ttls.values()))
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, service, value, expires_at, last_access, source) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, service, value, now + ttl, now, source),
+            )
+            self._evict(conn, now)
+            conn.commit()
+
+    def _evict(self, conn, now):
+        """Drops expired entries first, then the least recently used ones."""
+        count = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        if count <= self.max_entries:
+            return
+        removed = conn.execute("DELETE FROM responses WHERE expires_at <= ?", (now,)).rowcount
+        overflow = count - removed - self.max_entries
+        if overflow > 0:
+            removed += conn.execute(
+                "DELETE FROM responses WHERE key IN "
+                "(SELECT key FROM responses ORDER BY last_access LIMIT ?)",
+                (overflow,),
+            ).rowcount
+        self.evictions += removed
+
+    def clear(self):
+        """Removes every entry from the cache."""
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM responses")
+            conn.commit()
+
+    def stats(self):
+        """
+        Returns the lookup counters of this process. warm_coverage is the
+        fraction of lookups answered by a precomputed (warmed) entry.
+        """
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "stale_hits": self.stale_hits, "warm_hits": self.warm_hits,
+                "warm_coverage": self.warm_hits / lookups if lookups else 0.0}
+
+
+def ttls_from_env():
+    """Reads per-service TTL overrides such as RESPONSE_CACHE_TTL_1=3600."""
+    ttls = {}
+    for service in DEFAULT_TTLS:
+        value = os.getenv(f"RESPONSE_CACHE_TTL_{service}")
+        if value and value.isdigit():
+            ttls[service] = int(value)
+    return ttls
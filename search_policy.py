@@ -0,0 +1,102 @@
+"""
+Per-service web search policies: how much search context the model gets,
+whether the user's city is passed as a location hint, and how many output
+tokens the answer may use.
+
+The search context is the largest lever on latency and cost of a call, so
+quick lookups (a restaurant for tonight) use a small context while
+multi-day itineraries get a larger context and an output budget that
+grows with the number of days.
+"""
+import os
+from collections import namedtuple
+
+# name:              label under which latency and tokens are recorded
+# context_size:      search_context_size of the web search tool: "low", "medium" or "high"
+# use_location:      whether the user's city is sent as an approximate user_location
+# max_output_tokens: output budget of the answer
+# tokens_per_day:    extra output budget per travel day, for itineraries
+# max_tokens_cap:    upper bound of the output budget after scaling by days
+SearchPolicy = namedtuple(
+    "SearchPolicy",
+    ["name", "context_size", "use_location", "max_output_tokens", "tokens_per_day", "max_tokens_cap"]
+)
+
+CONTEXT_SIZES = ("low", "medium", "high")
+
+DEFAULT_POLICY = SearchPolicy("default", "medium", True, 500, 0, 500)
+
+DEFAULT_POLICIES = {
+    "1": SearchPolicy("restaurant", "low", True, 500, 0, 500),         # Restaurant Finder
+    "2": SearchPolicy("attractions", "medium", True, 500, 0, 500),     # Tourist Attractions
+    "3": SearchPolicy("itinerary", "medium", True, 300, 250, 2000),    # Mystery Planning Guide
+}
+
+
+def policies_from_env():
+    """
+    Returns DEFAULT_POLICIES with overrides such as SEARCH_CONTEXT_SIZE_1=medium
+    or MAX_OUTPUT_TOKENS_3=400 applied.
+    """
+    policies = dict(DEFAULT_POLICIES)
+    for service, policy in DEFAULT_POLICIES.items():
+        context_size = os.getenv(f"SEARCH_CONTEXT_SIZE_{service}", "").strip().lower()
+        if context_size in CONTEXT_SIZES:
+            policy = policy._replace(context_size=context_size)
+        max_output_tokens = os.getenv(f"MAX_OUTPUT_TOKENS_{service}", "")
+        if max_output_tokens.isdigit():
+            policy = policy._replace(max_output_tokens=int(max_output_tokens),
+                                     max_tokens_cap=max(policy.max_tokens_cap, int(max_output_tokens)))
+        policies[service] = policy
+    return policies
+
+
+def _days(user_details):
+    value = str(user_details.get("days") or user_details.get("days_spent") or "").strip()
+    return int(value) if value.isdecimal() else 1
+
+
+def search_options(policy, user_details, destination=None):
+    """
+    Applies a policy to the collected user details. destination, the
+    gazetteer entry of the user's city, makes the location hint precise.
+
+    Returns:
+    dict: Keyword arguments for the get_response_with_websearch family:
+    context_size, user_location, max_output_tokens and policy (the policy name).
+    """
+    max_output_tokens = policy.max_output_tokens
+    if policy.tokens_per_day:
+        max_output_tokens = min(max_output_tokens + policy.tokens_per_day * _days(user_details),
+                                policy.max_tokens_cap)
+
+    user_location = None
+    city = (user_details.get("location") or user_details.get("city") or "").strip()
+    if policy.use_location and destination is not None:
+        user_location = {"type": "approximate", "city": destination.name, "country": destination.country}
+        if destination.region:
+            user_location["region"] = destination.region
+        if destination.timezone:
+            user_location["timezone"] = destination.timezone
+    elif policy.use_location and city:
+        user_location = {"type": "approximate", "city": city}
+
+    return {
+        "context_size": policy.context_size,
+        "user_location": user_location,
+        "max_output_tokens": max_output_tokens,
+        "policy": policy.name,
+    }
+
+
+# Share of the output budget kept by economy_options()
+ECONOMY_TOKEN_SHARE = 0.6
+
+
+def economy_options(options):
+    """
+    Returns search options made cheaper for a service or user close to its
+    spend cap: the smallest search context and a smaller output budget.
+    """
+    return dict(options, context_size="low",
+                max_output_tokens=max(int(options["max_output_tokens"] * ECONOMY_TOKEN_SHARE), 150))
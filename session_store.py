@@ -0,0 +1,209 @@
+import json
+import sqlite3
+import threading
+import time
+
+
+class SessionConflict(Exception):
+    """Raised when a session changed since it was loaded, e.g. by another worker."""
+
+
+class StripedLock:
+    """
+    A fixed set of locks shared out by the hash of a key, so that the turns
+    of one conversation run one at a time in this process without keeping
+    a lock for every phone number. Keys that share a stripe wait for each
+    other, which more stripes make rare.
+    """
+
+    def __init__(self, stripes=256):
+        self._locks = tuple(threading.Lock() for _ in range(stripes))
+
+    def __call__(self, key):
+        """Returns the lock of key, to be used in a with statement."""
+        return self._locks[hash(key) % len(self._locks)]
+
+
+class SessionStore:
+    """
+    Stores conversation state per phone number in a SQLite database in WAL
+    mode, so every worker process pointing at the same file can pick up the
+    next turn of a conversation.
+
+    Sessions expire after ttl seconds without activity. The table is kept
+    below max_sessions by dropping the least recently active sessions.
+
+    Every save bumps the version of a session. A turn that passes the
+    version it loaded (see load_versioned()) to save() or delete() only
+    writes if no other turn, in this or another process, wrote meanwhile;
+    otherwise SessionConflict is raised and the turn can be run again.
+    """
+
+    # How many saves happen between two clean-up passes
+    CLEANUP_INTERVAL = 256
+
+    def __init__(self, path, ttl=1800, max_sessions=500000):
+        self.path = path
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._conn = None
+        self._lock = threading.Lock()
+        self._saves_since_cleanup = 0
+        self.loads = 0
+        self.saves = 0
+        self.expired = 0
+        self.evicted = 0
+        self.load_time_total = 0.0
+        self.load_time_max = 0.0
+        self.save_time_total = 0.0
+        self.save_time_max = 0.0
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "phone TEXT PRIMARY KEY, state TEXT, updated_at REAL, version INTEGER NOT NULL DEFAULT 1) "
+                "WITHOUT ROWID"
+            )
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(sessions)")}
+            if "version" not in columns:
+                # Files created before sessions had versions
+                self._conn.execute("ALTER TABLE sessions ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def load(self, phone):
+        """Returns the stored state for the phone number, or None."""
+        return self.load_versioned(phone)[0]
+
+    def load_versioned(self, phone):
+        """Returns (state, version) for the phone number; (None, 0) if it has no session."""
+        started_at = time.perf_counter()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT state, updated_at, version FROM sessions WHERE phone = ?", (phone,)
+            ).fetchone()
+            state, version = None, 0
+            if row is not None:
+                if row[1] + self.ttl <= time.time():
+                    conn.execute("DELETE FROM sessions WHERE phone = ? AND version = ?", (phone, row[2]))
+                    conn.commit()
+                    self.expired += 1
+                else:
+                    state, version = json.loads(row[0]), row[2]
+            elapsed = time.perf_counter() - started_at
+            self.loads += 1
+            self.load_time_total += elapsed
+            self.load_time_max = max(self.load_time_max, elapsed)
+        return state, version
+
+    def save(self, phone, state, version=None):
+        """
+        Stores the state for the phone number and refreshes its TTL. With
+        version, raises SessionConflict unless the session is still at that
+        version (0: no session). Returns the new version.
+        """
+        started_at = time.perf_counter()
+        data = json.dumps(state, separators=(",", ":"))
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            if version is None:
+                conn.execute(
+                    "INSERT INTO sessions (phone, state, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT (phone) DO UPDATE SET state = excluded.state, "
+                    "updated_at = excluded.updated_at, version = version + 1",
+                    (phone, data, now),
+                )
+                new_version = conn.execute("SELECT version FROM sessions WHERE phone = ?", (phone,)).fetchone()[0]
+            elif version == 0:
+                written = conn.execute(
+                    "INSERT OR IGNORE INTO sessions (phone, state, updated_at) VALUES (?, ?, ?)",
+                    (phone, data, now),
+                ).rowcount
+                new_version = 1
+            else:
+                written = conn.execute(
+                    "UPDATE sessions SET state = ?, updated_at = ?, version = version + 1 "
+                    "WHERE phone = ? AND version = ?",
+                    (data, now, phone, version),
+                ).rowcount
+                new_version = version + 1
+            if version is not None and not written:
+                conn.rollback()
+                raise SessionConflict(phone)
+            self._saves_since_cleanup += 1
+            if self._saves_since_cleanup >= self.CLEANUP_INTERVAL:
+                self._cleanup(conn)
+            conn.commit()
+            elapsed = time.perf_counter() - started_at
+            self.saves += 1
+            self.save_time_total += elapsed
+            self.save_time_max = max(self.save_time_max, elapsed)
+        return new_version
+
+    def delete(self, phone, version=None):
+        """
+        Removes the session for the phone number, if any. With version,
+        raises SessionConflict unless the session is still at that version
+        (0: no session).
+        """
+        with self._lock:
+            conn = self._connect()
+            if version is None:
+                conn.execute("DELETE FROM sessions WHERE phone = ?", (phone,))
+            elif version == 0:
+                if conn.execute("SELECT 1 FROM sessions WHERE phone = ?", (phone,)).fetchone():
+                    raise SessionConflict(phone)
+            elif not conn.execute("DELETE FROM sessions WHERE phone = ? AND version = ?",
+                                  (phone, version)).rowcount:
+                conn.rollback()
+                raise SessionConflict(phone)
+            conn.commit()
+
+    def cleanup(self):
+        """Drops expired sessions and enforces max_sessions."""
+        with self._lock:
+            conn = self._connect()
+            self._cleanup(conn)
+            conn.commit()
+
+    def _cleanup(self, conn):
+        self._saves_since_cleanup = 0
+        self.expired += conn.execute(
+            "DELETE FROM sessions WHERE updated_at <= ?", (time.time() - self.ttl,)
+        ).rowcount
+        count = conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        overflow = count - self.max_sessions
+        if overflow > 0:
+            self.evicted += conn.execute(
+                "DELETE FROM sessions WHERE phone IN "
+                "(SELECT phone FROM sessions ORDER BY updated_at LIMIT ?)",
+                (overflow,),
+            ).rowcount
+
+    def count(self):
+        """Returns the number of stored sessions, including expired ones not yet purged."""
+        with self._lock:
+            return self._connect().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def stats(self):
+        """Returns load/save counts and latencies of this process."""
+        with self._lock:
+            return {
+                "loads": self.loads,
+                "saves": self.saves,
+                "expired": self.expired,
+                "evicted": self.evicted,
+                "avg_load_time": self.load_time_total / self.loads if self.loads else 0.0,
+                "max_load_time": self.load_time_max,
+                "avg_save_time": self.save_time_total / self.saves if self.saves else 0.0,
+                "max_save_time": self.save_time_max,
+            }
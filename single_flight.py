@@ -0,0 +1,104 @@
+import threading
+import weakref
+from response_cache import normalize_text
+
+
+def prompt_key(system_prompt, user_input):
+    """Builds a single-flight key from the formatted system prompt and user input."""
+    return normalize_text(system_prompt) + "\n" + normalize_text(user_input)
+
+
+class _Call:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key: the first caller runs the
+    function, later callers wait for it and receive the same result, or the
+    same exception if it failed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        # Event loop -> in-flight futures of that loop by key; an entry goes with its loop
+        self._async_calls = weakref.WeakKeyDictionary()
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key, func, *args, **kwargs):
+        """Runs func(*args, **kwargs) unless a call for key is already in flight."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.calls += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    async def do_async(self, key, func, *args, **kwargs):
+        """Async variant of do(); func must be a coroutine function."""
+        import asyncio  # only async callers pay for the import
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            calls = self._async_calls.get(loop)
+            if calls is None:
+                calls = self._async_calls[loop] = {}
+            future = calls.get(key)
+            leader = future is None
+            if leader:
+                future = calls[key] = loop.create_future()
+                # Mark the outcome as retrieved even when nobody else was waiting
+                future.add_done_callback(lambda f: f.cancelled() or f.exception())
+                self.calls += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            # Shield so that a cancelled waiter does not cancel the shared call
+            return await asyncio.shield(future)
+
+        try:
+            result = await func(*args, **kwargs)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del calls[key]
+
+    def stats(self):
+        """Returns how many upstream calls were made and how many were coalesced."""
+        with self._lock:
+            return {"calls": self.calls, "coalesced": self.coalesced}
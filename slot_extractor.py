@@ -0,0 +1,243 @@
+"""
+Rule-based extraction of trip details from one free-text message, such as
+"cheap sushi in Lisbon under 40 euros" or "3 day trip to Rome for 2 people,
+budget 900", so that the conversation only asks for what is still missing
+instead of walking through every question.
+
+Everything is local: keyword lists, a few regular expressions and the
+destination gazetteer. Nothing is extracted that the message does not say.
+"""
+import re
+from collections import namedtuple
+
+# service:  "1", "2" or "3", or None if the message does not ask for one
+# details:  the fields of the service found in the message
+Extraction = namedtuple("Extraction", ["service", "details"])
+
+CUISINES = (
+    "italian", "pizza", "pasta", "sushi", "japanese", "ramen", "chinese", "dim sum", "thai", "vietnamese",
+    "korean", "indian", "mexican", "tacos", "spanish", "tapas", "french", "greek", "turkish", "lebanese",
+    "middle eastern", "moroccan", "portuguese", "seafood", "fish", "steak", "steakhouse", "burgers", "bbq",
+    "barbecue", "vegan", "vegetarian", "brunch", "local", "traditional", "street food", "fine dining",
+)
+
+# Attraction preferences, by the words that ask for them
+PREFERENCES = {
+    "monuments": ("monument", "monuments", "landmark", "landmarks", "historic", "history", "historical"),
+    "parks": ("park", "parks", "garden", "gardens", "nature", "green"),
+    "viewpoints": ("viewpoint", "viewpoints", "view", "views", "panorama", "lookout", "skyline"),
+    "museums": ("museum", "museums", "gallery", "galleries", "art"),
+    "beaches": ("beach", "beaches"),
+    "architecture": ("architecture", "churches", "church", "cathedral", "cathedrals", "castle", "castles"),
+    "markets": ("market", "markets", "shopping"),
+    "nightlife": ("nightlife", "bars", "clubs"),
+}
+
+# Words that point to a service, in addition to a cuisine, a preference or a trip length
+SERVICE_WORDS = {
+    "1": ("restaurant", "restaurants", "eat", "eating", "food", "dinner", "lunch", "breakfast", "dine",
+          "dining", "cuisine", "hungry", "meal"),
+    "2": ("attraction", "attractions", "sights", "sightseeing", "see", "visit", "things to do", "tour"),
+    "3": ("itinerary", "trip", "travel", "traveling", "travelling", "holiday", "vacation", "getaway",
+          "mystery", "plan"),
+}
+
+NUMBER_WORDS = {"a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6,
+                "seven": 7, "eight": 8, "nine": 9, "ten": 10}
+_NUMBER = r"(\d+|a|an|one|two|three|four|five|six|seven|eight|nine|ten)"
+
+_CURRENCY = r"(?:euros?|eur|dollars?|usd|bucks|pounds?|gbp|[$€£])"
+_BUDGET_PATTERNS = (
+    re.compile(r"(?:under|below|less than|max(?:imum)?|up to|budget(?: of| is)?|around|about|spend(?:ing)?)"
+               r"\s*[$€£]?\s*(\d+(?:[.,]\d+)*)\b"),
+    re.compile(r"[$€£]\s*(\d+(?:[.,]\d+)*)\b"),
+    re.compile(r"\b(\d+(?:[.,]\d+)*)\s*" + _CURRENCY),
+)
+_BARE_NUMBER = re.compile(r"\b(\d+)\b")
+# A bare number is not a budget when it counts something, tells the time or
+# the date, or is a year: "for 4 people", "open 24 hours", "in 2025"
+_COUNTED = re.compile(r"\s*(?:people|persons?|adults|kids|children|guests|pax|of us|friends|travell?ers|"
+                      r"hours?|hrs?|h|minutes?|mins?|am|pm|o'?clock|days?|nights?|weeks?|months?|years?|"
+                      r"stars?|st|nd|rd|th|km|miles?|%)\b")
+_COUNTED_AFTER = re.compile(r"\b(?:for|in|at|on|since|until|till|by|before|after|from|open|of)\s+$")
+_YEAR = re.compile(r"(?:19|20)\d\d")
+# "1.500" and "1,500" are fifteen hundred, "12.50" is twelve and a half
+_THOUSANDS = re.compile(r"\d{1,3}(?:[.,]\d{3})+")
+_DAYS = re.compile(r"\b" + _NUMBER + r"[\s-]*(day|days|night|nights|week|weeks)\b")
+# Matched against the text before a _DAYS match
+_WHEN = re.compile(r"\b(?:in|within)\s+$")
+_WEEKEND = re.compile(r"\b(?:long\s+)?weekend\b")
+_PEOPLE = re.compile(r"\b(?:for\s+|of\s+)?" + _NUMBER +
+                     r"\s+(?:people|persons|adults|travell?ers|friends|guests|pax|of us)\b")
+_PARTY_WORDS = (
+    (re.compile(r"\bfamily of (\d+|three|four|five|six)\b"), None),
+    (re.compile(r"\b(?:couple|partner|wife|husband|girlfriend|boyfriend|honeymoon)\b"), 2),
+    (re.compile(r"\b(?:solo|alone|myself|by myself)\b"), 1),
+)
+# A place follows one of these words, up to one of the stop words. The
+# lookahead lets "to eat in Alfama" match both "to ..." and "in ..."
+_PLACE = re.compile(r"\b(?:in|to|at|near|visiting|around)\s+(?=([^,.;!?]+))")
+_PLACE_STOP_WORDS = {"for", "with", "under", "below", "on", "budget", "and", "next", "this", "from", "of",
+                     "less", "max", "up", "around", "about", "during", "by", "at", "in", "to", "spending"}
+_MAX_PLACE_WORDS = 4
+_WORD = re.compile(r"[^\W\d_]+(?:['-][^\W\d_]+)*|\d+")
+
+
+def _number(word):
+    return int(word) if word.isdigit() else NUMBER_WORDS.get(word)
+
+
+def _contains(text, phrase):
+    return re.search(r"\b" + re.escape(phrase) + r"\b", text) is not None
+
+
+def find_budget(text, bare_number=False):
+    """
+    Returns the budget in text as a whole number, e.g. "under 40 euros" -> "40",
+    or None. With bare_number, the only number of a message counts as the
+    budget, e.g. "sushi in Lisbon 40", unless it says how many, when or
+    what year ("for 4 people", "open 24 hours", "in 2025").
+    """
+    for pattern in _BUDGET_PATTERNS:
+        match = pattern.search(text)
+        if match:
+            amount = match.group(1)
+            if _THOUSANDS.fullmatch(amount):
+                return amount.replace(",", "").replace(".", "")
+            return str(int(float(amount.replace(",", "."))))
+    if bare_number:
+        numbers = list(_BARE_NUMBER.finditer(text))
+        if len(numbers) == 1:
+            match = numbers[0]
+            if not (_COUNTED.match(text, match.end()) or _COUNTED_AFTER.search(text, 0, match.start()) or
+                    _YEAR.fullmatch(match.group(1))):
+                return match.group(1)
+    return None
+
+
+def find_days(text):
+    """
+    Returns the trip length in days, e.g. "3 day trip" -> "3", "a week" -> "7",
+    or None. "in 2 weeks" and "within 3 days" say when, not how long.
+    """
+    for match in _DAYS.finditer(text):
+        if _WHEN.search(text, 0, match.start()):
+            continue
+        count = _number(match.group(1))
+        return str(count * 7 if match.group(2).startswith("week") else count)
+    if _WEEKEND.search(text):
+        return "2"
+    return None
+
+
+def find_people(text):
+    """Returns the number of travellers, e.g. "for 2 people" -> "2", "with my wife" -> "2", or None."""
+    match = _PEOPLE.search(text)
+    if match:
+        return str(_number(match.group(1)))
+    for pattern, count in _PARTY_WORDS:
+        match = pattern.search(text)
+        if match:
+            return str(count or _number(match.group(1)))
+    return None
+
+
+def find_cuisine(text):
+    """Returns the first cuisine named in text, or None."""
+    found = [(match.start(), cuisine) for cuisine in CUISINES
+             for match in [re.search(r"\b" + re.escape(cuisine) + r"\b", text)] if match]
+    return min(found)[1] if found else None
+
+
+def find_preferences(text):
+    """Returns the attraction preferences named in text, e.g. "parks and viewpoints", or None."""
+    found = [preference for preference, words in PREFERENCES.items()
+             if any(_contains(text, word) for word in words)]
+    return " and ".join(found) if found else None
+
+
+def find_place(text, original, gazetteer):
+    """
+    Returns the place named in the message: the longest run of words after
+    "in", "to", ... that the gazetteer knows (misspellings included), else
+    a name of at least four letters anywhere in the message that the
+    gazetteer knows exactly, else the capitalized words after "in", "to", ...
+    """
+    for match in _PLACE.finditer(text):
+        words = _place_words(match.group(1))
+        for length in range(len(words), 0, -1):
+            destination = gazetteer.lookup(" ".join(words[:length]))
+            if destination is not None:
+                return destination.name
+
+    words = _WORD.findall(text)
+    for length in range(_MAX_PLACE_WORDS, 0, -1):
+        for start in range(len(words) - length + 1):
+            candidate = " ".join(words[start:start + length])
+            if len(candidate) >= 4:
+                destination = gazetteer.lookup(candidate, fuzzy=False)
+                if destination is not None:
+                    return destination.name
+
+    for match in _PLACE.finditer(original):
+        words = _place_words(match.group(1))
+        capitalized = []
+        for word in words:
+            if not word[0].isupper():
+                break
+            capitalized.append(word)
+        if capitalized:
+            return " ".join(capitalized)
+    return None
+
+
+def _place_words(phrase):
+    """The words of phrase up to the first stop word, at most _MAX_PLACE_WORDS of them."""
+    words = []
+    for word in _WORD.findall(phrase):
+        if word.lower() in _PLACE_STOP_WORDS or word.isdigit() or len(words) == _MAX_PLACE_WORDS:
+            break
+        words.append(word)
+    return words
+
+
+def detect_service(text, cuisine, preferences, days):
+    """Picks the service the message asks for, or None."""
+    scores = {service: sum(_contains(text, word) for word in words) for service, words in SERVICE_WORDS.items()}
+    scores["1"] += 2 if cuisine else 0
+    scores["2"] += 2 if preferences else 0
+    scores["3"] += 2 if days else 0
+    service, score = max(scores.items(), key=lambda item: (item[1], item[0] == "1"))
+    return service if score > 0 else None
+
+
+def extract_slots(message, gazetteer):
+    """
+    Extracts the service and as many of its details as the message gives.
+
+    Parameters:
+    message (str): The user's message.
+    gazetteer (Gazetteer): Destinations the message may name.
+
+    Returns:
+    Extraction: The service (None if no service is asked for) and a dict of
+    the details found, keyed by the field names of trip_plan.SERVICE_FLOWS.
+    """
+    text = message.lower()
+    cuisine = find_cuisine(text)
+    preferences = find_preferences(text)
+    days = find_days(text)
+    service = detect_service(text, cuisine, preferences, days)
+    if service is None:
+        return Extraction(None, {})
+
+    place = find_place(text, message, gazetteer)
+    # Only itineraries ask for other numbers, so elsewhere a lone number is the budget
+    budget = find_budget(text, bare_number=service != "3")
+    if service == "1":
+        details = {"location": place, "cuisine": cuisine, "budget": budget}
+    elif service == "2":
+        details = {"location": place, "preferences": preferences, "budget": budget}
+    else:
+        details = {"city": place, "people": find_people(text), "budget": budget, "days": days}
+    return Extraction(service, {field: value for field, value in details.items() if value})
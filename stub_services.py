@@ -0,0 +1,273 @@
+"""
+Local stand-ins for the OpenAI Responses endpoint and the Twilio Messaging
+API, used by bench_webhook.py to measure the app without spending real money.
+"""
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+from twilio.http.http_client import TwilioHttpClient
+
+STUB_ANSWER = (
+    "Here are three places that match what you asked for.\n\n"
+    "1. Stub Place One - a well-reviewed spot in the old town. About 25 per person. https://example.com/one\n"
+    "2. Stub Place Two - quiet, close to the river. About 35 per person. https://example.com/two\n"
+    "3. Stub Place Three - popular with locals, book ahead. About 45 per person. https://example.com/three\n\n"
+    "Enjoy your trip!"
+)
+
+# Answer to requests for structured output (see venue_index.VENUE_FORMAT)
+STUB_VENUES = json.dumps({"venues": [
+    {"name": f"Stub Place {number}", "category": "stub", "price_estimate": price,
+     "link": f"https://example.com/{number}", "neighbourhood": "Old Town"}
+    for number, price in enumerate((15, 25, 35, 45, 60), 1)
+]})
+
+# Relative latency of a web search by search_context_size, so that the
+# benchmark reflects the search policy of each service
+CONTEXT_LATENCY = {"low": 0.6, "medium": 1.0, "high": 1.6}
+
+
+class StageRecorder:
+    """Thread-safe collection of latency samples and error counts per stage."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+        self.errors = {}
+
+    def record(self, stage, elapsed, error=None):
+        with self._lock:
+            self.samples.setdefault(stage, []).append(elapsed)
+            if error:
+                stage_errors = self.errors.setdefault(stage, {})
+                stage_errors[error] = stage_errors.get(error, 0) + 1
+
+
+class StubOpenAI:
+    """
+    Serves POST /v1/responses with a canned answer after a log-normal delay
+    (median latency_median seconds, scaled by the search context size),
+    failing failure_rate of the calls with an HTTP 500. Streaming requests
+    get server-sent events.
+    """
+
+    def __init__(self, latency_median=0.5, latency_sigma=0.4, failure_rate=0.0, answer=STUB_ANSWER):
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.failure_rate = failure_rate
+        self.answer = answer
+        self.recorder = StageRecorder()
+        self.server = None
+
+    def delay(self):
+        if self.latency_median <= 0:
+            return 0.0
+        return random.lognormvariate(0, self.latency_sigma) * self.latency_median
+
+    def response_body(self, request_body):
+        answer = STUB_VENUES if (request_body.get("text") or {}).get("format") else self.answer
+        output_tokens = len(answer.split())
+        input_tokens = sum(len(str(message.get("content", "")).split())
+                           for message in request_body.get("input", []))
+        return {
+            "id": "resp_stub",
+            "object": "response",
+            "created_at": int(time.time()),
+            "model": request_body.get("model", "gpt-4o"),
+            "status": "completed",
+            "output": [{
+                "type": "web_search_call",
+                "id": "ws_stub",
+                "status": "completed"
+            }, {
+                "type": "message",
+                "id": "msg_stub",
+                "role": "assistant",
+                "status": "completed",
+                "content": [{"type": "output_text", "text": answer, "annotations": []}]
+            }],
+            "parallel_tool_calls": True,
+            "tool_choice": request_body.get("tool_choice", "auto"),
+            "tools": request_body.get("tools", []),
+            "usage": {
+                "input_tokens": input_tokens,
+                "input_tokens_details": {"cached_tokens": 0},
+                "output_tokens": output_tokens,
+                "output_tokens_details": {"reasoning_tokens": 0},
+                "total_tokens": input_tokens + output_tokens
+            }
+        }
+
+    def start(self, host="127.0.0.1", port=0):
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f"http://{host}:{self.server.server_address[1]}/v1"
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                started_at = time.perf_counter()
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if not self.path.endswith("/responses"):
+                    self._send_json(404, {"error": {"message": "not found"}})
+                    return
+                context_size = next((tool.get("search_context_size") for tool in body.get("tools", [])
+                                     if tool.get("type") == "web_search_preview"), None)
+                delay = stub.delay() * CONTEXT_LATENCY.get(context_size, 1.0)
+                if random.random() < stub.failure_rate:
+                    time.sleep(delay / 2)
+                    self._send_json(500, {"error": {"message": "stub failure", "type": "server_error"}})
+                    stub.recorder.record("openai", time.perf_counter() - started_at, "http_500")
+                    return
+                if body.get("stream"):
+                    self._stream(body, delay)
+                else:
+                    time.sleep(delay)
+                    self._send_json(200, stub.response_body(body))
+                stub.recorder.record("openai", time.perf_counter() - started_at)
+
+            def _stream(self, body, delay):
+                words = stub.answer.split(" ")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                # Spend a third of the delay before the first token, the rest while streaming
+                time.sleep(delay / 3)
+                pause = (delay * 2 / 3) / max(len(words), 1)
+                for number, word in enumerate(words):
+                    delta = word if number == len(words) - 1 else word + " "
+                    self._send_event({"type": "response.output_text.delta", "item_id": "msg_stub",
+                                      "output_index": 0, "content_index": 0, "delta": delta,
+                                      "sequence_number": number})
+                    time.sleep(pause)
+                self._send_event({"type": "response.completed", "response": stub.response_body(body),
+                                  "sequence_number": len(words)})
+                self.close_connection = True
+
+            def _send_event(self, event):
+                self.wfile.write(f"event: {event['type']}\ndata: {json.dumps(event)}\n\n".encode())
+                self.wfile.flush()
+
+            def _send_json(self, status, payload):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+
+class StubTwilio:
+    """
+    Accepts Twilio REST calls (message sends, conversations, participants)
+    after a fixed delay and remembers the messages sent to each phone
+    number, so the harness can measure out-of-band delivery.
+    """
+
+    def __init__(self, latency=0.05):
+        self.latency = latency
+        self.recorder = StageRecorder()
+        self.server = None
+        self._lock = threading.Lock()
+        self._arrived = threading.Condition(self._lock)
+        self._sequence = 0
+        self.messages = {}
+
+    def start(self, host="127.0.0.1", port=0):
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f"http://{host}:{self.server.server_address[1]}"
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+
+    def wait_for_message(self, phone, since, timeout):
+        """
+        Waits until a message to phone arrives after since (a perf_counter
+        timestamp) and returns its arrival time, or None on timeout.
+        """
+        deadline = time.perf_counter() + timeout
+        with self._arrived:
+            while True:
+                for arrived_at, body in self.messages.get(phone, []):
+                    if arrived_at >= since:
+                        return arrived_at
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    return None
+                self._arrived.wait(remaining)
+
+    def _next_sid(self, prefix):
+        with self._lock:
+            self._sequence += 1
+            return f"{prefix}{self._sequence:032d}"
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                started_at = time.perf_counter()
+                length = int(self.headers.get("Content-Length", 0))
+                form = {key: values[0] for key, values in parse_qs(self.rfile.read(length).decode()).items()}
+                time.sleep(stub.latency)
+                if self.path.endswith("/Messages.json"):
+                    with stub._arrived:
+                        stub.messages.setdefault(form.get("To", ""), []).append((time.perf_counter(), form.get("Body", "")))
+                        stub._arrived.notify_all()
+                    payload = {"sid": stub._next_sid("SM"), "status": "queued", "to": form.get("To"),
+                               "from": form.get("From"), "body": form.get("Body")}
+                    stub.recorder.record("twilio_send", time.perf_counter() - started_at)
+                elif self.path.endswith("/Participants"):
+                    payload = {"sid": stub._next_sid("MB")}
+                    stub.recorder.record("twilio_participant", time.perf_counter() - started_at)
+                else:
+                    payload = {"sid": stub._next_sid("CH")}
+                    stub.recorder.record("twilio_conversation", time.perf_counter() - started_at)
+                data = json.dumps(payload).encode()
+                self.send_response(201)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+
+class StubRoutingHttpClient(TwilioHttpClient):
+    """Twilio HTTP client that sends every *.twilio.com request to a local stub."""
+
+    _TWILIO_HOST = re.compile(r"^https://[a-z0-9.-]*twilio\.com")
+
+    def __init__(self, base_url, **kwargs):
+        super().__init__(**kwargs)
+        self.base_url = base_url
+
+    def request(self, method, url, *args, **kwargs):
+        return super().request(method, self._TWILIO_HOST.sub(self.base_url, url), *args, **kwargs)
@@ -0,0 +1,90 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+from batch_plan import check_request, finished_ids, flow_details, generate_answer, read_requests, run_batch
+
+class TestBatchPlan(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.input_path = os.path.join(self.tmp_dir.name, "requests.jsonl")
+        self.output_path = os.path.join(self.tmp_dir.name, "results.jsonl")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_lines(self, path, lines):
+        with open(path, "w", encoding="utf-8") as file:
+            file.write("\n".join(lines) + "\n")
+
+    def test_read_and_check_requests(self):
+        self.write_lines(self.input_path, [
+            json.dumps({"id": 7, "service": "1", "location": "Lisbon", "cuisine": "fish", "budget": 50}),
+            "not json",
+            "",
+            json.dumps({"service": "2", "location": ""}),
+        ])
+        rows = list(read_requests(self.input_path))
+        self.assertEqual([request_id for request_id, _ in rows], ["7", "line-2", "line-4"])
+        self.assertEqual(check_request(rows[0][1]), [])
+        self.assertEqual(check_request(rows[1][1]), ["Malformed JSON."])
+        self.assertEqual(check_request(rows[2][1]), ["Location is required."])
+        self.assertEqual(check_request({"service": "1", "location": "Lisbon"}), ["Missing fields: cuisine, budget."])
+        self.assertEqual(check_request({"service": "1", "location": "Lisbon", "cuisine": " ", "budget": 50}),
+                         ["Missing fields: cuisine."])
+        self.assertEqual(check_request({"service": "9"}), ["Unknown service."])
+
+    def test_aliased_keys_reach_the_prompt(self):
+        request = {"service": "2", "location": "Rome", "preferences": "parks", "total_budget": 900}
+        self.assertEqual(flow_details("2", request, ("location", "preferences", "budget")),
+                         {"location": "Rome", "preferences": "parks", "budget": 900})
+        request = {"service": "3", "city": "Rome", "number_of_people": 2, "budget": 900, "days_spent": 3}
+        self.assertEqual(check_request(request), [])
+        with mock.patch("trip_plan.TripPlanner.fetch_data_from_openai", return_value="plan") as fetch, \
+                mock.patch("trip_plan.get_usage_ledger"):
+            result = generate_answer("a", "3", request)
+        self.assertEqual(result["status"], "ok")
+        fetch.assert_called_once_with("The user wants to travel to Rome for 3 days with 2 people "
+                                      "and a budget of 900.")
+
+    def test_finished_ids_ignore_errors_and_partial_lines(self):
+        self.write_lines(self.output_path, [
+            json.dumps({"id": "a", "status": "ok"}),
+            json.dumps({"id": "b", "status": "error"}),
+            json.dumps({"id": "c", "status": "invalid"}),
+            '{"id": "d", "sta',
+        ])
+        self.assertEqual(finished_ids(self.output_path), {"a", "c"})
+
+    def test_run_resumes_and_retries_errors(self):
+        self.write_lines(self.input_path, [
+            json.dumps({"id": "done", "service": "1", "location": "Lisbon", "cuisine": "fish", "budget": 50}),
+            json.dumps({"id": "bad", "service": "1", "location": ""}),
+            json.dumps({"id": "retry", "service": "1", "location": "Porto", "cuisine": "fish", "budget": 40}),
+            json.dumps({"id": "retry", "service": "1", "location": "Faro", "cuisine": "fish", "budget": 40}),
+        ])
+        self.write_lines(self.output_path, [
+            json.dumps({"id": "done", "status": "ok", "answer": "kept"}),
+            json.dumps({"id": "retry", "status": "error", "error": "timeout"}),
+        ])
+
+        def fake_answer(request_id, service, details):
+            return {"id": request_id, "service": service, "status": "ok", "answer": details["location"]}
+
+        with mock.patch("batch_plan.ProcessPoolExecutor") as pool_class, \
+                mock.patch("batch_plan.generate_answer", fake_answer):
+            from concurrent.futures import ThreadPoolExecutor
+            pool_class.side_effect = lambda max_workers: ThreadPoolExecutor(max_workers)
+            counts = run_batch(self.input_path, self.output_path, workers=2, progress_every=0)
+
+        self.assertEqual(counts, {"skipped": 1, "ok": 1, "invalid": 1, "error": 0, "duplicate": 1})
+        with open(self.output_path, encoding="utf-8") as output:
+            results = [json.loads(line) for line in output]
+        self.assertEqual(len(results), 4)
+        self.assertEqual(results[-1]["answer"], "Porto")
+        self.assertEqual(finished_ids(self.output_path), {"done", "bad", "retry"})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+from cache_warmup import expand_spec, run_warmup
+from response_cache import make_cache_key
+from trip_plan import OPENAI_ERROR_PREFIX, TripPlanner
+from test_support import TempStoresMixin
+from usage_ledger import meter_usage
+
+SPEC = {"1": {"location": ["Lisbon", "Porto"], "cuisine": ["sushi"], "budget": [50]}}
+
+class TestCacheWarmup(TempStoresMixin, unittest.TestCase):
+
+    def setUp(self):
+        self.use_temp_stores()
+        self.answer = mock.Mock(side_effect=lambda system_prompt, user_input, **options: "warm: " + user_input)
+        self.patch_trip_plan(get_response_with_websearch=self.answer)
+
+    def test_expand_spec_keeps_popularity_order(self):
+        combinations = list(expand_spec(SPEC))
+        self.assertEqual([details["location"] for _, details in combinations], ["Lisbon", "Porto"])
+        self.assertEqual(combinations[0], ("1", {"location": "Lisbon", "cuisine": "sushi", "budget": "50"}))
+
+    def test_warm_entries_serve_live_traffic(self):
+        report = run_warmup(SPEC, rate=0)
+        self.assertEqual(report["generated"], 2)
+        self.assertEqual(report["coverage"], 1.0)
+
+        planner = TripPlanner()
+        for message in ("help", "1", "lisbon", "Sushi", "45"):
+            answer = planner.process_message(message)
+        self.assertTrue(answer.startswith("warm: "))
+        self.assertEqual(self.answer.call_count, 2)
+        self.assertEqual(self.cache.stats()["warm_hits"], 1)
+
+    def test_fresh_entries_are_skipped_and_expiring_ones_refreshed(self):
+        run_warmup(SPEC, rate=0)
+        report = run_warmup(SPEC, rate=0, refresh_ahead=60)
+        self.assertEqual((report["fresh"], report["generated"]), (2, 0))
+        report = run_warmup(SPEC, rate=0, refresh_ahead=7 * 60 * 60)
+        self.assertEqual((report["fresh"], report["generated"]), (0, 2))
+
+    def test_spend_budget_and_failures(self):
+        self.answer.side_effect = lambda system_prompt, user_input, **options: OPENAI_ERROR_PREFIX + "timeout"
+        report = run_warmup(SPEC, rate=0, max_calls=1)
+        self.assertEqual((report["failed"], report["over_budget"]), (1, 1))
+        self.assertEqual(report["coverage"], 0.0)
+        details = {"location": "Lisbon", "cuisine": "sushi", "budget": "50"}
+        self.assertIsNone(self.cache.expires_in(make_cache_key("1", details)))
+
+    def test_token_budget_counts_this_runs_usage(self):
+        def answer(system_prompt, user_input, **options):
+            meter_usage(SimpleNamespace(usage=SimpleNamespace(input_tokens=60, output_tokens=40), output=[]))
+            return "warm: " + user_input
+
+        self.answer.side_effect = answer
+        spec = {"1": {"location": ["Lisbon", "Porto", "Faro"], "cuisine": ["sushi"], "budget": [50]}}
+        report = run_warmup(spec, rate=0, max_tokens=150, workers=3)
+        self.assertEqual((report["generated"], report["over_budget"]), (1, 2))
+        report = run_warmup(spec, rate=0, max_tokens=250, workers=1)
+        self.assertEqual((report["fresh"], report["generated"], report["over_budget"]), (1, 2, 0))
+
+    def test_destinations_are_checked_under_their_canonical_name(self):
+        spec = {"1": {"location": ["nyc"], "cuisine": ["pizza"], "budget": [50]}}
+        run_warmup(spec, rate=0)
+        report = run_warmup(spec, rate=0, refresh_ahead=60)
+        self.assertEqual((report["fresh"], report["generated"]), (1, 0))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,26 @@
+import asyncio
+import os
+import unittest
+from unittest import mock
+from clients import get_async_openai_client, get_openai_limiter
+
+class TestClients(unittest.TestCase):
+
+    def test_each_event_loop_has_its_own_limiter_and_client(self):
+        async def contend():
+            async def hold():
+                async with get_openai_limiter():
+                    await asyncio.sleep(0.01)
+
+            await asyncio.gather(hold(), hold())
+            return get_openai_limiter(), get_async_openai_client()
+
+        with mock.patch.dict(os.environ, {"OPENAI_MAX_IN_FLIGHT": "1", "OPENAI_API_KEY": "test"}):
+            first = asyncio.run(contend())
+            # Used to fail with "... is bound to a different event loop"
+            second = asyncio.run(contend())
+        self.assertIsNot(first[0], second[0])
+        self.assertIsNot(first[1], second[1])
+
+if __name__ == "__main__":
+    unittest.main()
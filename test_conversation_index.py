@@ -0,0 +1,94 @@
+import importlib.util
+import os
+import tempfile
+import unittest
+from unittest import mock
+from conversation_index import ConversationEntry, ConversationIndex
+
+class TwilioError(Exception):
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+
+class TestConversationIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "conversations.sqlite3")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_entries_are_shared_and_invalidated(self):
+        entry = ConversationEntry("CH1", "MB1", "whatsapp:+200")
+        ConversationIndex(self.path).put("IS1", "whatsapp:+100", entry)
+        index = ConversationIndex(self.path)
+        self.assertEqual(index.get("IS1", "whatsapp:+100"), entry)
+        self.assertIsNone(index.get("IS2", "whatsapp:+100"))
+        index.invalidate("IS1", "whatsapp:+100")
+        self.assertIsNone(index.get("IS1", "whatsapp:+100"))
+        self.assertEqual(index.stats(), {"hits": 1, "misses": 2, "invalidations": 1})
+
+class TestProvisioning(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        paths = {name: os.path.join(self.tmp_dir.name, f"{name.lower()}.sqlite3")
+                 for name in ("CONVERSATION_INDEX_PATH", "SESSION_STORE_PATH", "IDEMPOTENCY_STORE_PATH")}
+        with mock.patch.dict(os.environ, paths):
+            spec = importlib.util.spec_from_file_location("flask_app", "flask-app.py")
+            self.app = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(self.app)
+        self.client = mock.Mock()
+        patcher = mock.patch.object(self.app, "get_twilio_client", return_value=self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.conversations = self.client.conversations.v1.services.return_value.conversations
+        self.conversations.create.return_value.sid = "CH1"
+        self.conversations.return_value.participants.create.return_value.sid = "MB1"
+
+    def provision(self):
+        return self.app.create_conversation_add_participant("IS1", "whatsapp:+100", "whatsapp:+200")
+
+    def test_known_users_cost_no_round_trips(self):
+        self.assertEqual(self.provision(), "CH1")
+        self.assertEqual(self.provision(), "CH1")
+        self.assertEqual(self.conversations.create.call_count, 1)
+
+    def test_existing_binding_is_adopted(self):
+        self.conversations.return_value.participants.create.side_effect = TwilioError(409)
+        existing = mock.Mock(conversation_sid="CH0", participant_sid="MB0",
+                             participant_messaging_binding={"proxy_address": "whatsapp:+200"})
+        self.client.conversations.v1.services.return_value.participant_conversations.list.return_value = [existing]
+        self.assertEqual(self.provision(), "CH0")
+        self.conversations.return_value.delete.assert_called_once()
+        self.assertEqual(self.provision(), "CH0")
+        self.assertEqual(self.conversations.create.call_count, 1)
+
+    def test_deleted_conversation_is_reprovisioned(self):
+        self.provision()
+        self.conversations.create.return_value.sid = "CH2"
+        used = []
+
+        def use(conversation_sid):
+            used.append(conversation_sid)
+            if conversation_sid == "CH1":
+                raise TwilioError(404)
+            return conversation_sid
+
+        self.assertEqual(self.app.with_conversation("IS1", "whatsapp:+100", "whatsapp:+200", use), "CH2")
+        self.assertEqual(used, ["CH1", "CH2"])
+
+    def test_confirmed_conversation_is_reprovisioned_if_deleted(self):
+        self.provision()
+        self.conversations.create.return_value.sid = "CH2"
+        by_sid = {"CH1": mock.Mock(fetch=mock.Mock(side_effect=TwilioError(404))),
+                   "CH2": mock.Mock(**{"fetch.return_value.sid": "CH2", "participants.create.return_value.sid": "MB2"})}
+        self.conversations.side_effect = lambda sid: by_sid.get(sid, mock.DEFAULT)
+        self.assertEqual(self.app.confirm_conversation("IS1", "whatsapp:+100", "whatsapp:+200"), "CH2")
+        self.assertEqual(self.app.confirm_conversation("IS1", "whatsapp:+100", "whatsapp:+200"), "CH2")
+        self.assertEqual(self.conversations.create.call_count, 2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+import threading
+import time
+import unittest
+from fair_scheduler import FairScheduler, SchedulerBusy
+
+class TestFairScheduler(unittest.TestCase):
+
+    def occupy(self, scheduler, user, release):
+        """Holds a slot for user on another thread until release is set."""
+        entered = threading.Event()
+
+        def hold():
+            with scheduler.slot(user):
+                entered.set()
+                release.wait(5)
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        self.assertTrue(entered.wait(5))
+        self.addCleanup(thread.join, 5)
+        return thread
+
+    def test_runs_when_slot_free(self):
+        scheduler = FairScheduler(max_concurrent=2, user_rate=0)
+        with scheduler.slot("+1"):
+            self.assertEqual(scheduler.stats()["running"], 1)
+        self.assertEqual(scheduler.stats()["running"], 0)
+        self.assertEqual(scheduler.stats()["admitted"], 1)
+
+    def test_user_rate_limit(self):
+        scheduler = FairScheduler(user_rate=0.01, user_burst=2)
+        for _ in range(2):
+            with scheduler.slot("+1"):
+                pass
+        with self.assertRaises(SchedulerBusy) as raised:
+            with scheduler.slot("+1"):
+                pass
+        self.assertEqual(raised.exception.reason, "rate_limited")
+        # Other users are not affected
+        with scheduler.slot("+2"):
+            pass
+
+    def test_round_robin_between_users(self):
+        scheduler = FairScheduler(max_concurrent=1, user_rate=0, max_wait=5)
+        release = threading.Event()
+        self.occupy(scheduler, "holder", release)
+
+        order = []
+        order_lock = threading.Lock()
+
+        def request(user):
+            with scheduler.slot(user):
+                with order_lock:
+                    order.append(user)
+
+        threads = []
+        # A chatty user queues three requests before a quiet one queues its first
+        for user in ("chatty", "chatty", "chatty", "quiet"):
+            thread = threading.Thread(target=request, args=(user,))
+            thread.start()
+            threads.append(thread)
+            while scheduler.stats()["queued"] < len(threads):
+                time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(order, ["chatty", "quiet", "chatty", "chatty"])
+
+    def test_sheds_load_when_expected_wait_exceeds_slo(self):
+        scheduler = FairScheduler(max_concurrent=1, user_rate=0, max_wait=0.5)
+        scheduler.avg_hold_time = 1.0
+        release = threading.Event()
+        self.occupy(scheduler, "holder", release)
+        started_at = time.monotonic()
+        with self.assertRaises(SchedulerBusy) as raised:
+            with scheduler.slot("+1"):
+                pass
+        release.set()
+        self.assertEqual(raised.exception.reason, "overloaded")
+        self.assertLess(time.monotonic() - started_at, 0.1)
+
+    def test_overload_does_not_use_up_the_rate_token(self):
+        scheduler = FairScheduler(max_concurrent=1, user_rate=0.01, user_burst=1, max_wait=0.5)
+        scheduler.avg_hold_time = 1.0
+        release = threading.Event()
+        self.occupy(scheduler, "holder", release)
+        with self.assertRaises(SchedulerBusy) as raised:
+            with scheduler.slot("+1"):
+                pass
+        self.assertEqual(raised.exception.reason, "overloaded")
+        release.set()
+        while scheduler.stats()["running"]:
+            time.sleep(0.001)
+        with scheduler.slot("+1"):
+            pass
+
+    def test_weighted_slot_counts_each_request(self):
+        scheduler = FairScheduler(max_concurrent=4, user_rate=0, max_wait=5)
+        with scheduler.slot("+1", weight=3) as release:
+            self.assertEqual(scheduler.stats()["running"], 3)
+            self.assertEqual(scheduler.expected_wait(weight=2), 2 / 4 * scheduler.avg_hold_time)
+            release()
+            release()
+            self.assertEqual(scheduler.stats()["running"], 1)
+        self.assertEqual(scheduler.stats()["running"], 0)
+        # More slots than there are are capped at max_concurrent
+        with scheduler.slot("+1", weight=10):
+            self.assertEqual(scheduler.stats()["running"], 4)
+
+    def test_wait_timeout(self):
+        scheduler = FairScheduler(max_concurrent=1, user_rate=0, max_wait=0.05)
+        release = threading.Event()
+        self.occupy(scheduler, "holder", release)
+        with self.assertRaises(SchedulerBusy) as raised:
+            with scheduler.slot("+1"):
+                pass
+        release.set()
+        self.assertEqual(raised.exception.reason, "timeout")
+        self.assertEqual(scheduler.stats()["queued"], 0)
+        self.assertEqual(scheduler.stats()["waiting_users"], 0)
+
+if __name__ == "__main__":
+    unittest.main()
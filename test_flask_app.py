@@ -0,0 +1,171 @@
+import importlib.util
+import os
+import signal
+import tempfile
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+import trip_plan
+from session_store import SessionStore
+from test_support import TempStoresMixin
+
+class TestWorkerLifecycle(TempStoresMixin, unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.env = {name: os.path.join(self.tmp_dir.name, f"{name.lower()}.sqlite3")
+                    for name in ("CONVERSATION_INDEX_PATH", "SESSION_STORE_PATH", "IDEMPOTENCY_STORE_PATH",
+                                 "PENDING_JOBS_PATH")}
+        self.env["REPLY_WORKERS"] = "1"
+        self.env["PENDING_JOBS_POLL"] = "0.05"
+        self.use_temp_stores()
+
+    def load_module(self):
+        """Imports flask-app.py as a new worker process would, with its clients mocked."""
+        with mock.patch.dict(os.environ, self.env):
+            spec = importlib.util.spec_from_file_location("flask_app", "flask-app.py")
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+        for name in ("get_twilio_client", "get_openai_client"):
+            patcher = mock.patch.object(module, name)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(module.drain, 0)
+        return module
+
+    def create_app(self, module):
+        with mock.patch("atexit.register") as register:
+            app = module.create_app()
+        register.assert_called_once_with(module.drain)
+        return app.test_client()
+
+    def test_draining_worker_is_not_ready_and_turns_webhooks_away(self):
+        module = self.load_module()
+        client = self.create_app(module)
+        self.assertEqual(client.get("/livez").status_code, 200)
+        self.assertEqual(client.get("/readyz").status_code, 200)
+        self.assertEqual(module.drain(1), 0)
+        self.assertEqual(client.get("/readyz").status_code, 503)
+        response = client.post("/whatsapp-inbound", data={"Body": "help", "From": "whatsapp:+100"})
+        self.assertEqual((response.status_code, response.headers["Retry-After"]), (503, "5"))
+        self.assertEqual(client.get("/livez").status_code, 200)
+
+    def test_sigterm_turns_webhooks_away_before_the_worker_stops_serving(self):
+        module = self.load_module()
+        client = self.create_app(module)
+        spec = importlib.util.spec_from_file_location("gunicorn_conf", "gunicorn.conf.py")
+        conf = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(conf)
+        worker = SimpleNamespace(wsgi=client.application)
+        handle_exit = mock.Mock()
+        previous = signal.signal(signal.SIGTERM, handle_exit)
+        self.addCleanup(signal.signal, signal.SIGTERM, previous)
+
+        conf.post_worker_init(worker)
+        signal.getsignal(signal.SIGTERM)(signal.SIGTERM, None)
+        handle_exit.assert_called_once_with(signal.SIGTERM, None)
+        self.assertEqual(client.get("/readyz").status_code, 503)
+        self.assertEqual(client.post("/whatsapp-inbound", data={"Body": "help"}).status_code, 503)
+        # The queues are drained once the worker has stopped serving
+        ran = threading.Event()
+        module.reply_queue.submit(ran.set)
+        conf.worker_exit(None, worker)
+        self.assertTrue(ran.is_set())
+        self.assertEqual(module.drain(0), 0)
+
+    def test_turns_of_one_phone_run_one_at_a_time(self):
+        module = self.load_module()
+        process_message = trip_plan.TripPlanner.process_message
+
+        def slow_first_turn(planner, message):
+            if message == "help":
+                time.sleep(0.1)
+            return process_message(planner, message)
+
+        with mock.patch.object(trip_plan.TripPlanner, "process_message", slow_first_turn):
+            first = threading.Thread(target=module.process_incoming_message, args=("help", "whatsapp:+100"))
+            first.start()
+            time.sleep(0.02)
+            self.assertEqual(module.process_incoming_message("1", "whatsapp:+100"), "Enter your location:")
+            first.join()
+        self.assertEqual(module.session_store.load("whatsapp:+100"), [trip_plan.STEP_FIRST_FIELD, "1"])
+
+    def test_turn_runs_again_when_another_worker_saved_the_session(self):
+        module = self.load_module()
+        other_worker = SessionStore(self.env["SESSION_STORE_PATH"])
+        process_message = trip_plan.TripPlanner.process_message
+        turns = []
+
+        def racing_turn(planner, message):
+            turns.append(planner.step)
+            if len(turns) == 1:
+                # Another worker handles "help" while this turn runs
+                other_worker.save("whatsapp:+100", [trip_plan.STEP_SERVICE, ""], version=0)
+            return process_message(planner, message)
+
+        with mock.patch.object(trip_plan.TripPlanner, "process_message", racing_turn):
+            self.assertEqual(module.process_incoming_message("1", "whatsapp:+100"), "Enter your location:")
+        self.assertEqual(turns, [trip_plan.STEP_START, trip_plan.STEP_SERVICE])
+
+    def test_session_is_saved_before_the_answer_without_holding_the_lock(self):
+        module = self.load_module()
+        seen = []
+
+        def answer(planner, formatted_text):
+            seen.append((module.conversation_locks("whatsapp:+100").locked(),
+                         module.session_store.load("whatsapp:+100")))
+            return "Try Sushi Bar."
+
+        with mock.patch.object(trip_plan.TripPlanner, "fetch_data_from_openai", answer):
+            for message in ("help", "1", "Lisbon", "sushi"):
+                module.process_incoming_message(message, "whatsapp:+100")
+            self.assertEqual(module.process_incoming_message("50", "whatsapp:+100"), "Try Sushi Bar.")
+        self.assertEqual(seen, [(False, None)])
+
+    def test_sync_replies_wait_for_a_slot_within_the_webhook_timeout(self):
+        self.env["LLM_QUEUE_SLO"] = "20"
+        self.assertEqual(self.load_module().llm_scheduler.max_wait, 7.5)
+        self.env["ASYNC_REPLIES"] = "1"
+        self.assertEqual(self.load_module().llm_scheduler.max_wait, 20)
+
+    def test_usage_stats(self):
+        client = self.create_app(self.load_module())
+        self.ledger.record("1", "Lisbon", "whatsapp:+100", "cache", trip_plan.UsageMeter())
+        stats = client.get("/usage-stats").get_json()
+        self.assertEqual([(row["key"], row["source"], row["requests"]) for row in stats["services"]],
+                         [("1", "cache", 1)])
+        self.assertEqual(stats["ledger"]["recorded"], 1)
+
+    def test_unstarted_replies_are_resumed_by_the_next_worker(self):
+        old = self.load_module()
+        self.create_app(old)
+        release = threading.Event()
+        self.addCleanup(release.set)
+        old.reply_queue.submit(release.wait, 1)
+        old.reply_queue.submit(old.deliver_reply, "sushi in Lisbon", "whatsapp:+100", "SM1")
+        self.assertEqual(old.drain(0.05), 1)
+
+        new = self.load_module()
+        new.deliver_reply = mock.Mock()
+        self.create_app(new)
+        self.assertEqual(new.reply_queue.drain(1), [])
+        new.deliver_reply.assert_called_once_with("sushi in Lisbon", "whatsapp:+100", "SM1")
+        self.assertEqual(new.pending_jobs.count(), 0)
+
+    def test_jobs_saved_after_start_are_resumed_by_a_running_worker(self):
+        running = self.load_module()
+        running.deliver_reply = mock.Mock()
+        self.create_app(running)
+        # An old worker drains after the new one has started
+        running.pending_jobs.add("reply", ["sushi in Lisbon", "whatsapp:+100", "SM1"])
+        deadline = time.monotonic() + 2
+        while not running.deliver_reply.called and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(running.pending_jobs.count(), 0)
+        running.deliver_reply.assert_called_once_with("sushi in Lisbon", "whatsapp:+100", "SM1")
+
+if __name__ == "__main__":
+    unittest.main()
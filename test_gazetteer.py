@@ -0,0 +1,72 @@
+import os
+import tempfile
+import unittest
+from gazetteer import Gazetteer, deletes, edit_distance, normalize_destination
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+class TestGazetteer(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.gazetteer = Gazetteer.from_csv(os.path.join(HERE, "destinations.csv"),
+                                           os.path.join(HERE, "regions.csv"))
+
+    def name(self, text, partial=False):
+        destination = self.gazetteer.lookup(text, partial)
+        return destination and destination.name
+
+    def test_normalize_destination(self):
+        self.assertEqual(normalize_destination("  São  Paulo! "), "sao paulo")
+        self.assertEqual(normalize_destination("The Hague"), "hague")
+        self.assertEqual(normalize_destination("St. Petersburg"), "st petersburg")
+
+    def test_spelling_variants_share_a_destination(self):
+        for text in ("NYC", "new york", "New York City ", "NEW-YORK"):
+            self.assertEqual(self.name(text), "New York City")
+        destination = self.gazetteer.lookup("nyc")
+        self.assertEqual((destination.id, destination.country), ("us-new-york", "US"))
+        self.assertAlmostEqual(destination.latitude, 40.7128)
+
+    def test_misspellings_within_edit_bound(self):
+        self.assertEqual(self.name("Barcelonna"), "Barcelona")
+        self.assertEqual(self.name("Barcleona"), "Barcelona")
+        self.assertEqual(self.name("Amsterdan"), "Amsterdam")
+        self.assertEqual(self.name("Buenos Aries"), "Buenos Aires")
+        # Too far from any name, or too short to correct
+        self.assertIsNone(self.name("Bracleonna"))
+        self.assertIsNone(self.name("Rom"))
+        self.assertIsNone(self.name("Atlantis"))
+        # Other real places one letter away from a destination
+        for text in ("Bari", "Mali", "Gent", "Lisbn"):
+            self.assertIsNone(self.name(text))
+
+    def test_partial_lookup(self):
+        self.assertIsNone(self.name("Lisbon, Alfama"))
+        self.assertEqual(self.name("Lisbon, Alfama", partial=True), "Lisbon")
+        self.assertEqual(self.name("Paris, France", partial=True), "Paris")
+        self.assertEqual(self.name("Austin, TX", partial=True), "Austin")
+        # A country or region after the comma that is not the destination's
+        for text in ("Paris, Texas", "Rome, Georgia", "Lisbon, Alfama, Spain"):
+            self.assertIsNone(self.name(text, partial=True))
+
+    def test_most_popular_destination_wins_ties(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "gazetteer.csv")
+            with open(path, "w", encoding="utf-8") as gazetteer_file:
+                gazetteer_file.write("id,name,country,region,timezone,latitude,longitude,aliases\n"
+                                     "fr-paris,Paris,FR,,,48.85,2.35,\n"
+                                     "us-paris,Paris,US,Texas,,33.66,-95.55,paris tx\n")
+            gazetteer = Gazetteer.from_csv(path)
+        self.assertEqual(gazetteer.lookup("paris").id, "fr-paris")
+        self.assertEqual(gazetteer.lookup("Paris, TX").id, "us-paris")
+
+    def test_edit_distance(self):
+        self.assertEqual(edit_distance("lisbon", "lisbon", 2), 0)
+        self.assertEqual(edit_distance("lisbon", "lsibon", 2), 1)
+        self.assertEqual(edit_distance("lisbon", "lisbn", 2), 1)
+        self.assertEqual(edit_distance("lisbon", "london", 2), 3)
+        self.assertEqual(deletes("abc", 1), {"abc", "bc", "ac", "ab"})
+
+if __name__ == "__main__":
+    unittest.main()
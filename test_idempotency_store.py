@@ -0,0 +1,56 @@
+import os
+import tempfile
+import threading
+import unittest
+from idempotency_store import IdempotencyStore
+
+class TestIdempotencyStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "idempotency.sqlite3")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_retry_gets_the_stored_reply(self):
+        store = IdempotencyStore(self.path)
+        self.assertEqual(store.begin("SM1"), (IdempotencyStore.NEW, None))
+        self.assertEqual(IdempotencyStore(self.path).begin("SM1"), (IdempotencyStore.PENDING, None))
+        store.complete("SM1", "Enter your location:")
+        self.assertEqual(store.begin("SM1"), (IdempotencyStore.DONE, "Enter your location:"))
+        self.assertEqual(store.stats(), {"new": 1, "duplicates": 1, "reclaimed": 0})
+
+    def test_released_and_abandoned_messages_are_handled_again(self):
+        store = IdempotencyStore(self.path, pending_timeout=0)
+        store.begin("SM1")
+        store.release("SM1")
+        self.assertEqual(store.begin("SM1")[0], IdempotencyStore.NEW)
+        self.assertEqual(store.begin("SM1")[0], IdempotencyStore.NEW)
+        self.assertEqual(store.stats()["reclaimed"], 1)
+
+    def test_entries_expire(self):
+        store = IdempotencyStore(self.path, ttl=0)
+        store.begin("SM1")
+        store.complete("SM1", "reply")
+        self.assertEqual(store.begin("SM1")[0], IdempotencyStore.NEW)
+
+    def test_wait_returns_when_the_first_delivery_finishes(self):
+        store = IdempotencyStore(self.path)
+        store.begin("SM1")
+        threading.Timer(0.1, store.complete, ("SM1", "reply")).start()
+        self.assertEqual(IdempotencyStore(self.path).wait("SM1", 2), (IdempotencyStore.DONE, "reply"))
+        self.assertEqual(store.wait("SM2", 0), (IdempotencyStore.NEW, None))
+
+    def test_concurrent_deliveries_claim_once(self):
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(IdempotencyStore(self.path).begin("SM1")[0]))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results.count(IdempotencyStore.NEW), 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import threading
+import unittest
+from job_queue import JobQueue
+
+class TestJobQueue(unittest.TestCase):
+
+    def test_runs_jobs_and_records_timing(self):
+        queue = JobQueue(max_workers=2, max_queued=2)
+        done = threading.Event()
+        self.assertTrue(queue.submit(done.set))
+        self.assertTrue(done.wait(1))
+        queue.shutdown()
+        stats = queue.stats()
+        self.assertEqual(stats["completed"], 1)
+        self.assertEqual(stats["queued"], 0)
+        self.assertGreaterEqual(stats["max_run_time"], 0.0)
+
+    def test_rejects_when_full(self):
+        queue = JobQueue(max_workers=1, max_queued=1)
+        release = threading.Event()
+        self.assertTrue(queue.submit(release.wait, 1))
+        self.assertTrue(queue.submit(release.wait, 1))
+        self.assertFalse(queue.submit(release.wait, 1))
+        release.set()
+        queue.shutdown()
+        self.assertEqual(queue.stats()["rejected"], 1)
+        self.assertEqual(queue.stats()["completed"], 2)
+
+    def test_failed_job_is_counted(self):
+        queue = JobQueue(max_workers=1, max_queued=1)
+        queue.submit(lambda: 1 / 0)
+        queue.shutdown()
+        self.assertEqual(queue.stats()["failed"], 1)
+
+    def test_drain_hands_back_jobs_that_did_not_start(self):
+        queue = JobQueue(max_workers=1, max_queued=2)
+        release = threading.Event()
+        ran = []
+        self.assertTrue(queue.submit(release.wait, 1))
+        self.assertTrue(queue.submit(ran.append, "second"))
+        unstarted = queue.drain(0.05)
+        self.assertEqual(unstarted, [(ran.append, ("second",), {})])
+        self.assertFalse(queue.submit(ran.append, "third"))
+        release.set()
+        queue.shutdown()
+        self.assertEqual(ran, [])
+        stats = queue.stats()
+        self.assertEqual((stats["queued"], stats["completed"], stats["rejected"]), (0, 1, 1))
+
+    def test_drain_waits_for_queued_jobs(self):
+        queue = JobQueue(max_workers=1, max_queued=2)
+        ran = []
+        for name in ("first", "second"):
+            queue.submit(ran.append, name)
+        self.assertEqual(queue.drain(1), [])
+        self.assertEqual(ran, ["first", "second"])
+
+if __name__ == "__main__":
+    unittest.main()
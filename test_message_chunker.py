@@ -0,0 +1,37 @@
+import unittest
+from message_chunker import MessageChunker, split_message
+
+class TestMessageChunker(unittest.TestCase):
+
+    def test_split_respects_limit_and_order(self):
+        text = "\n\n".join(f"Paragraph {number}: " + "x" * 50 for number in range(10))
+        parts = split_message(text, max_length=150)
+        self.assertTrue(all(len(part) <= 150 for part in parts))
+        self.assertEqual("".join(parts).replace("\n", ""), text.replace("\n", ""))
+        self.assertTrue(parts[0].startswith("Paragraph 0"))
+
+    def test_split_prefers_list_items(self):
+        text = "Intro line\n- first item\n- second item\n- third item"
+        self.assertEqual(split_message(text, max_length=30), ["Intro line\n- first item", "- second item\n- third item"])
+
+    def test_long_word_is_cut_hard(self):
+        self.assertEqual(split_message("a" * 25, max_length=10), ["a" * 10, "a" * 10, "a" * 5])
+
+    def test_stream_releases_chunk_at_boundary(self):
+        chunker = MessageChunker(max_length=100, min_length=10)
+        self.assertEqual(chunker.feed("Day 1: museums"), [])
+        self.assertEqual(chunker.feed("\n\nDay 2"), ["Day 1: museums"])
+        self.assertEqual(chunker.feed(": parks"), [])
+        self.assertEqual(chunker.flush(), ["Day 2: parks"])
+
+    def test_stream_never_exceeds_limit(self):
+        chunker = MessageChunker(max_length=40, min_length=10)
+        chunks = []
+        for word in ("lorem ipsum dolor sit amet " * 10).split(" "):
+            chunks.extend(chunker.feed(word + " "))
+        chunks.extend(chunker.flush())
+        self.assertTrue(all(len(chunk) <= 40 for chunk in chunks))
+        self.assertEqual(" ".join(chunks).split(), ("lorem ipsum dolor sit amet " * 10).split())
+
+if __name__ == "__main__":
+    unittest.main()
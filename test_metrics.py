@@ -0,0 +1,46 @@
+import unittest
+from metrics import Counter, Gauge, Histogram, Registry
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter_with_labels(self):
+        errors = Counter("errors_total", "Errors.", ["stage"], registry=self.registry)
+        errors.labels("llm").inc()
+        errors.labels("llm").inc(2)
+        self.assertIn('errors_total{stage="llm"} 3', self.registry.render())
+
+    def test_gauge(self):
+        depth = Gauge("queue_depth", "Depth.", registry=self.registry)
+        depth.set(4)
+        depth.dec()
+        self.assertIn("queue_depth 3", self.registry.render())
+
+    def test_histogram_buckets_are_cumulative(self):
+        latency = Histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0), registry=self.registry)
+        for value in (0.05, 0.5, 0.7, 5.0):
+            latency.observe(value)
+        output = self.registry.render()
+        self.assertIn('latency_seconds_bucket{le="0.1"} 1', output)
+        self.assertIn('latency_seconds_bucket{le="1"} 3', output)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 4', output)
+        self.assertIn("latency_seconds_count 4", output)
+        self.assertIn("latency_seconds_sum 6.25", output)
+
+    def test_collector_and_escaping(self):
+        self.registry.register_collector(
+            lambda: [("cache_total", "counter", "Cache.", [({"result": 'h"it'}, 7)])]
+        )
+        output = self.registry.render()
+        self.assertIn("# TYPE cache_total counter", output)
+        self.assertIn('cache_total{result="h\\"it"} 7', output)
+
+    def test_wrong_label_count(self):
+        errors = Counter("errors_total", "Errors.", ["stage", "type"], registry=self.registry)
+        with self.assertRaises(ValueError):
+            errors.labels("llm")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import threading
+import time
+import unittest
+from message_chunker import MAX_MESSAGE_LENGTH
+from outbound_sender import OutboundSender, TokenBucket
+from resilience import CallGuard, RetryPolicy
+
+class TwilioError(Exception):
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+
+FAST_RETRIES = RetryPolicy(attempts=3, base_delay=0.001, max_delay=0.01, deadline=5.0, attempt_timeout=1.0,
+                           hedge_after=0.0)
+
+class TestOutboundSender(unittest.TestCase):
+
+    def setUp(self):
+        self.sent = []
+        self.lock = threading.Lock()
+
+    def create_message(self, to, body):
+        with self.lock:
+            self.sent.append((to, body))
+            return f"SM{len(self.sent)}"
+
+    def sender(self, create_message=None, **kwargs):
+        sender = OutboundSender(create_message or self.create_message,
+                                guard=CallGuard("test", FAST_RETRIES), **kwargs)
+        self.addCleanup(sender.shutdown)
+        return sender
+
+    def test_token_bucket_rate(self):
+        bucket = TokenBucket(rate=50, burst=5)
+        started_at = time.monotonic()
+        for _ in range(15):
+            bucket.acquire()
+        # 5 tokens of burst, then 10 more at 50 per second
+        self.assertGreaterEqual(time.monotonic() - started_at, 0.18)
+
+        slow_bucket = TokenBucket(rate=1, burst=1)
+        self.assertTrue(slow_bucket.acquire(timeout=0))
+        self.assertFalse(slow_bucket.acquire(timeout=0.1))
+
+    def test_long_answers_are_split_in_order(self):
+        paragraphs = [f"Day {day}: " + "x" * 900 for day in range(1, 4)]
+        sids = self.sender(rate=1000).send("whatsapp:+100", "\n\n".join(paragraphs))
+        self.assertEqual(sids, ["SM1", "SM2", "SM3"])
+        self.assertTrue(all(len(body) <= MAX_MESSAGE_LENGTH for _, body in self.sent))
+        self.assertEqual([body[:5] for _, body in self.sent], ["Day 1", "Day 2", "Day 3"])
+
+    def test_parts_that_were_not_sent_are_retried(self):
+        failures = [TwilioError(429), ConnectionRefusedError()]
+
+        def flaky(to, body):
+            if failures:
+                raise failures.pop(0)
+            return self.create_message(to, body)
+
+        sender = self.sender(flaky, rate=1000)
+        self.assertEqual(sender.send_part("whatsapp:+100", "hi"), "SM1")
+        self.assertEqual(sender.stats()["guard"]["retries"], 2)
+
+        # A bad request fails again; after a 5xx or a timeout Twilio may have sent the message already
+        for error in (TwilioError(400), TwilioError(503), TimeoutError()):
+            failures.append(error)
+            with self.assertRaises(type(error)):
+                sender.send_part("whatsapp:+100", "hi")
+        self.assertEqual(sender.stats()["parts_failed"], 3)
+        self.assertEqual(sender.stats()["guard"]["retries"], 2)
+
+    def test_broadcast_is_dispatched_concurrently(self):
+        def slow(to, body):
+            time.sleep(0.05)
+            return self.create_message(to, body)
+
+        sender = self.sender(slow, rate=1000, max_workers=8, max_queued=4)
+        recipients = [f"whatsapp:+{number}" for number in range(40)]
+        started_at = time.monotonic()
+        self.assertEqual(sender.broadcast(recipients, "Your itinerary changed."), 40)
+        sender.shutdown()
+        self.assertLess(time.monotonic() - started_at, 1.0)
+        self.assertEqual(sorted(to for to, _ in self.sent), sorted(recipients))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,27 @@
+import os
+import tempfile
+import unittest
+from pending_jobs import PendingJobStore
+
+class TestPendingJobStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "pending_jobs.sqlite3")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_jobs_are_claimed_once_by_any_process(self):
+        store = PendingJobStore(self.path)
+        store.add("reply", ("sushi in Lisbon", "whatsapp:+100", "SM1"))
+        store.add("outbound", ["whatsapp:+200", "Hello"])
+        other = PendingJobStore(self.path)
+        self.assertEqual(other.count(), 2)
+        self.assertEqual(other.claim(), [("reply", ["sushi in Lisbon", "whatsapp:+100", "SM1"]),
+                                         ("outbound", ["whatsapp:+200", "Hello"])])
+        self.assertEqual(store.claim(), [])
+        self.assertEqual(other.stats(), {"saved": 0, "claimed": 2})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,160 @@
+import asyncio
+import threading
+import time
+import unittest
+from resilience import (CallGuard, CircuitBreaker, CircuitOpenError, DeadlineExceeded, RetryPolicy,
+                        backoff_delay, is_retryable, is_safe_to_resend)
+
+class ServerError(Exception):
+    status_code = 503
+
+class BadRequest(Exception):
+    status_code = 400
+
+FAST = RetryPolicy(attempts=3, base_delay=0.001, max_delay=0.01, deadline=5.0, attempt_timeout=1.0,
+                   hedge_after=0.0)
+
+class TestResilience(unittest.TestCase):
+
+    def test_retryable_errors(self):
+        self.assertTrue(is_retryable(ServerError()))
+        self.assertTrue(is_retryable(TimeoutError()))
+        self.assertFalse(is_retryable(BadRequest()))
+        self.assertFalse(is_retryable(ValueError()))
+
+    def test_safe_to_resend(self):
+        class NewConnectionError(Exception):
+            pass
+
+        class MaxRetryError(Exception):
+            def __init__(self, reason):
+                super().__init__(None, "/Messages.json")
+                self.reason = reason
+
+        class RateLimited(Exception):
+            status = 429
+
+        # requests.ConnectionError(MaxRetryError(reason=NewConnectionError(...)))
+        self.assertTrue(is_safe_to_resend(ConnectionError(MaxRetryError(NewConnectionError()))))
+        self.assertTrue(is_safe_to_resend(RateLimited()))
+        self.assertFalse(is_safe_to_resend(ServerError()))
+        self.assertFalse(is_safe_to_resend(TimeoutError()))
+        self.assertFalse(is_safe_to_resend(ConnectionError("Connection reset by peer")))
+
+    def test_backoff_is_capped(self):
+        for retry in range(10):
+            self.assertLessEqual(backoff_delay(retry, 0.5, 4.0), 4.0)
+
+    def test_retries_until_success(self):
+        outcomes = [ServerError(), ServerError(), "answer"]
+        timeouts = []
+
+        def flaky(timeout):
+            timeouts.append(timeout)
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        guard = CallGuard("test", FAST)
+        self.assertEqual(guard.call(flaky), "answer")
+        self.assertEqual(guard.stats()["retries"], 2)
+        self.assertTrue(all(timeout <= 1.0 for timeout in timeouts))
+
+    def test_gives_up_after_attempts_and_on_bad_requests(self):
+        guard = CallGuard("test", FAST)
+        calls = []
+
+        def failing(error):
+            def call(timeout):
+                calls.append(error)
+                raise error
+            return call
+
+        with self.assertRaises(ServerError):
+            guard.call(failing(ServerError()))
+        self.assertEqual(len(calls), 3)
+        with self.assertRaises(BadRequest):
+            guard.call(failing(BadRequest()))
+        self.assertEqual(len(calls), 4)
+
+    def test_deadline(self):
+        guard = CallGuard("test", FAST._replace(deadline=0.0))
+        with self.assertRaises(DeadlineExceeded):
+            guard.call(lambda timeout: "never")
+
+    def test_breaker_opens_and_recovers(self):
+        breaker = CircuitBreaker("test", failure_rate=0.5, min_calls=4, window=60, reset_timeout=0.05)
+        guard = CallGuard("test", FAST._replace(attempts=1), breaker)
+
+        def failing(timeout):
+            raise ServerError()
+
+        for _ in range(4):
+            with self.assertRaises(ServerError):
+                guard.call(failing)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(CircuitOpenError):
+            guard.call(lambda timeout: "skipped")
+
+        time.sleep(0.06)
+        self.assertEqual(guard.call(lambda timeout: "probe"), "probe")
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(breaker.stats()["rejected"], 1)
+
+    def test_failed_probe_reopens(self):
+        breaker = CircuitBreaker("test", min_calls=1, reset_timeout=0.01)
+        breaker.record_failure()
+        time.sleep(0.02)
+        self.assertEqual(breaker.allow(), CircuitBreaker.PROBE)
+        self.assertFalse(breaker.allow())  # only one probe at a time
+        breaker.record_failure(probe=True)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(breaker.stats()["opened"], 2)
+
+    def test_late_outcomes_of_older_calls_are_ignored(self):
+        breaker = CircuitBreaker("test", min_calls=1, reset_timeout=0.05)
+        breaker.record_failure()
+        # A call let through before the breaker opened succeeds late
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        time.sleep(0.06)
+        self.assertEqual(breaker.allow(), CircuitBreaker.PROBE)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertFalse(breaker.allow())  # the probe is still in flight
+        breaker.record_success(probe=True)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(breaker.stats()["opened"], 1)
+
+    def test_hedged_request_wins_over_slow_one(self):
+        guard = CallGuard("test", FAST._replace(hedge_after=0.05))
+        first = threading.Event()
+
+        def slow_then_fast(timeout):
+            if not first.is_set():
+                first.set()
+                time.sleep(0.5)
+                return "slow"
+            return "fast"
+
+        started_at = time.perf_counter()
+        self.assertEqual(guard.call(slow_then_fast), "fast")
+        self.assertLess(time.perf_counter() - started_at, 0.3)
+        self.assertEqual(guard.stats()["hedges"], 1)
+
+    def test_async_retries(self):
+        outcomes = [ServerError(), "answer"]
+
+        async def flaky(timeout):
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        guard = CallGuard("test", FAST)
+        self.assertEqual(asyncio.run(guard.call_async(flaky)), "answer")
+        self.assertEqual(guard.stats()["retries"], 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import os
+import tempfile
+import time
+import unittest
+from response_cache import ResponseCache, make_cache_key, bucket_budget
+
+class TestResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "cache.sqlite3")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_key_is_normalized(self):
+        first = make_cache_key("1", {"location": "Lisbon ", "cuisine": "Sushi", "budget": "50"})
+        second = make_cache_key("1", {"location": "  lisbon", "cuisine": "SUSHI", "budget": "45"})
+        self.assertEqual(first, second)
+        self.assertEqual(first, "1|budget=50|cuisine=sushi|location=lisbon")
+
+    def test_budget_buckets(self):
+        self.assertEqual(bucket_budget("60"), "100")
+        self.assertEqual(bucket_budget("999999"), "10000+")
+        self.assertEqual(bucket_budget(" Cheap "), "cheap")
+
+    def test_hit_and_miss_counters(self):
+        cache = ResponseCache(self.path)
+        self.assertIsNone(cache.get("k"))
+        cache.set("k", "1", "answer")
+        self.assertEqual(cache.get("k"), "answer")
+        self.assertEqual(cache.stats(), {"hits": 1, "misses": 1, "evictions": 0, "stale_hits": 0,
+                                         "warm_hits": 0, "warm_coverage": 0.0})
+
+    def test_entries_expire(self):
+        cache = ResponseCache(self.path, ttls={"1": 0})
+        cache.set("k", "1", "answer")
+        self.assertIsNone(cache.get("k"))
+
+    def test_least_recently_used_is_evicted(self):
+        cache = ResponseCache(self.path, max_entries=2)
+        cache.set("a", "1", "A")
+        time.sleep(0.01)
+        cache.set("b", "1", "B")
+        time.sleep(0.01)
+        cache.get("a")
+        cache.set("c", "1", "C")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), "A")
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_survives_reopen(self):
+        ResponseCache(self.path).set("k", "2", "answer")
+        self.assertEqual(ResponseCache(self.path).get("k"), "answer")
+
+if __name__ == "__main__":
+    unittest.main()
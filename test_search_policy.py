@@ -0,0 +1,43 @@
+import os
+import unittest
+from unittest import mock
+from search_policy import DEFAULT_POLICIES, policies_from_env, search_options
+from trip_plan import build_websearch_request
+
+class TestSearchPolicy(unittest.TestCase):
+
+    def test_restaurant_lookup_uses_low_context_and_city(self):
+        options = search_options(DEFAULT_POLICIES["1"], {"location": " Lisbon ", "cuisine": "sushi"})
+        self.assertEqual(options, {
+            "context_size": "low",
+            "user_location": {"type": "approximate", "city": "Lisbon"},
+            "max_output_tokens": 500,
+            "policy": "restaurant",
+        })
+
+    def test_itinerary_budget_scales_with_days(self):
+        policy = DEFAULT_POLICIES["3"]
+        self.assertEqual(search_options(policy, {"city": "Rome", "days": "2"})["max_output_tokens"], 800)
+        self.assertEqual(search_options(policy, {"city": "Rome", "days": "30"})["max_output_tokens"], 2000)
+        self.assertEqual(search_options(policy, {"city": "Rome", "days": "a week"})["max_output_tokens"], 550)
+
+    def test_no_location_hint_without_city(self):
+        self.assertIsNone(search_options(DEFAULT_POLICIES["2"], {"location": ""})["user_location"])
+
+    def test_env_overrides(self):
+        with mock.patch.dict(os.environ, {"SEARCH_CONTEXT_SIZE_1": "HIGH", "MAX_OUTPUT_TOKENS_2": "800",
+                                          "SEARCH_CONTEXT_SIZE_3": "huge"}):
+            policies = policies_from_env()
+        self.assertEqual(policies["1"].context_size, "high")
+        self.assertEqual(policies["2"].max_output_tokens, 800)
+        self.assertEqual(policies["3"], DEFAULT_POLICIES["3"])
+
+    def test_request_carries_the_policy(self):
+        request = build_websearch_request("system", "user", {"type": "approximate", "city": "Lisbon"},
+                                          "low", 300)
+        self.assertEqual(request["tools"], [{"type": "web_search_preview", "search_context_size": "low",
+                                             "user_location": {"type": "approximate", "city": "Lisbon"}}])
+        self.assertEqual(request["max_output_tokens"], 300)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import os
+import tempfile
+import unittest
+from session_store import SessionConflict, SessionStore, StripedLock
+
+class TestSessionStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "sessions.sqlite3")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_save_and_load_across_instances(self):
+        SessionStore(self.path).save("whatsapp:+100", [2, "1", {"location": "Lisbon"}])
+        state = SessionStore(self.path).load("whatsapp:+100")
+        self.assertEqual(state, [2, "1", {"location": "Lisbon"}])
+
+    def test_idle_sessions_expire(self):
+        store = SessionStore(self.path, ttl=0)
+        store.save("whatsapp:+100", [1, "", {}])
+        self.assertIsNone(store.load("whatsapp:+100"))
+        self.assertEqual(store.stats()["expired"], 1)
+
+    def test_oldest_sessions_are_evicted(self):
+        store = SessionStore(self.path, max_sessions=2)
+        for number in range(5):
+            store.save(f"whatsapp:+{number}", [1, "", {}])
+        store.cleanup()
+        self.assertEqual(store.count(), 2)
+        self.assertIsNone(store.load("whatsapp:+0"))
+        self.assertIsNotNone(store.load("whatsapp:+4"))
+
+    def test_delete(self):
+        store = SessionStore(self.path)
+        store.save("whatsapp:+100", [1, "", {}])
+        store.delete("whatsapp:+100")
+        self.assertIsNone(store.load("whatsapp:+100"))
+        self.assertEqual(store.stats()["loads"], 1)
+
+    def test_save_only_if_unchanged_since_load(self):
+        mine, other = SessionStore(self.path), SessionStore(self.path)
+        self.assertEqual(mine.load_versioned("whatsapp:+100"), (None, 0))
+        self.assertEqual(other.save("whatsapp:+100", [1, ""], version=0), 1)
+        with self.assertRaises(SessionConflict):
+            mine.save("whatsapp:+100", [2, "1"], version=0)
+        state, version = mine.load_versioned("whatsapp:+100")
+        self.assertEqual(mine.save("whatsapp:+100", [2, "1"], version=version), 2)
+        with self.assertRaises(SessionConflict):
+            other.delete("whatsapp:+100", version=1)
+        other.delete("whatsapp:+100", version=2)
+        self.assertEqual(mine.load_versioned("whatsapp:+100"), (None, 0))
+
+    def test_striped_lock(self):
+        locks = StripedLock(4)
+        self.assertIs(locks("whatsapp:+100"), locks("whatsapp:+100"))
+        self.assertEqual(len({locks(f"whatsapp:+{number}") for number in range(100)}), 4)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+import asyncio
+import threading
+import unittest
+from single_flight import SingleFlight, prompt_key
+
+class TestSingleFlight(unittest.TestCase):
+
+    def test_concurrent_calls_share_one_result(self):
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        results = []
+
+        def slow_call():
+            started.set()
+            release.wait(1)
+            return "answer"
+
+        leader = threading.Thread(target=lambda: results.append(flight.do("k", slow_call)))
+        leader.start()
+        started.wait(1)
+        followers = [threading.Thread(target=lambda: results.append(flight.do("k", slow_call)))
+                     for _ in range(3)]
+        for follower in followers:
+            follower.start()
+        while flight.stats()["coalesced"] < 3:
+            pass
+        release.set()
+        for thread in [leader] + followers:
+            thread.join(1)
+
+        self.assertEqual(results, ["answer"] * 4)
+        self.assertEqual(flight.stats(), {"calls": 1, "coalesced": 3})
+
+    def test_error_reaches_every_waiter(self):
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        errors = []
+
+        def failing_call():
+            started.set()
+            release.wait(1)
+            raise ValueError("upstream down")
+
+        def run():
+            try:
+                flight.do("k", failing_call)
+            except ValueError as e:
+                errors.append(str(e))
+
+        threads = [threading.Thread(target=run)]
+        threads[0].start()
+        started.wait(1)
+        threads.append(threading.Thread(target=run))
+        threads[1].start()
+        while flight.stats()["coalesced"] < 1:
+            pass
+        release.set()
+        for thread in threads:
+            thread.join(1)
+        self.assertEqual(errors, ["upstream down", "upstream down"])
+
+    def test_async_calls_are_coalesced(self):
+        flight = SingleFlight()
+        calls = []
+
+        async def slow_call():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "answer"
+
+        async def main():
+            return await asyncio.gather(*(flight.do_async("k", slow_call) for _ in range(5)))
+
+        self.assertEqual(asyncio.run(main()), ["answer"] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight.stats()["coalesced"], 4)
+
+    def test_async_calls_are_not_shared_across_event_loops(self):
+        flight = SingleFlight()
+        started = threading.Barrier(2)
+        results = []
+
+        async def call(name):
+            # Both loops have the key in flight before either finishes
+            await asyncio.to_thread(started.wait, 1)
+            return name
+
+        def run(name):
+            results.append(asyncio.run(flight.do_async("k", call, name)))
+
+        threads = [threading.Thread(target=run, args=(name,)) for name in ("a", "b")]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(2)
+        self.assertEqual(sorted(results), ["a", "b"])
+        self.assertEqual(flight.stats(), {"calls": 2, "coalesced": 0})
+
+    def test_prompt_key_is_normalized(self):
+        self.assertEqual(prompt_key("System  Prompt", "In Lisbon "), prompt_key("system prompt", "in lisbon"))
+
+if __name__ == "__main__":
+    unittest.main()
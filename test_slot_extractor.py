@@ -0,0 +1,63 @@
+import os
+import unittest
+from gazetteer import Gazetteer
+from slot_extractor import extract_slots, find_budget, find_days, find_people
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+class TestSlotExtractor(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.gazetteer = Gazetteer.from_csv(os.path.join(HERE, "destinations.csv"))
+
+    def extract(self, message):
+        return extract_slots(message, self.gazetteer)
+
+    def test_restaurant_in_one_message(self):
+        self.assertEqual(self.extract("cheap sushi in Lisbon under 40 euros"),
+                         ("1", {"location": "Lisbon", "cuisine": "sushi", "budget": "40"}))
+        self.assertEqual(self.extract("Lisbon sushi 40"),
+                         ("1", {"location": "Lisbon", "cuisine": "sushi", "budget": "40"}))
+
+    def test_attractions_with_misspelled_city(self):
+        self.assertEqual(self.extract("museums and parks in Barcelonna, budget 30"),
+                         ("2", {"location": "Barcelona", "preferences": "parks and museums", "budget": "30"}))
+
+    def test_itinerary(self):
+        self.assertEqual(self.extract("3 day trip to Rome for 2 people, budget 900"),
+                         ("3", {"city": "Rome", "people": "2", "budget": "900", "days": "3"}))
+        self.assertEqual(self.extract("Plan a week in tokyo for four people"),
+                         ("3", {"city": "Tokyo", "people": "4", "days": "7"}))
+
+    def test_only_what_the_message_says(self):
+        self.assertEqual(self.extract("I want to eat in Alfama tonight"), ("1", {"location": "Alfama"}))
+        self.assertEqual(self.extract("I'm interested in museums"), ("2", {"preferences": "museums"}))
+        self.assertEqual(self.extract("italian food near me under $25"),
+                         ("1", {"cuisine": "italian", "budget": "25"}))
+
+    def test_numbers_that_are_not_a_budget(self):
+        self.assertEqual(self.extract("dinner for 4 people in Porto"), ("1", {"location": "Porto"}))
+        self.assertEqual(self.extract("what to see in paris in 2025"), ("2", {"location": "Paris"}))
+        self.assertEqual(self.extract("restaurants open 24 hours in Rome"), ("1", {"location": "Rome"}))
+        self.assertEqual(self.extract("sushi at 8 in Lisbon"), ("1", {"location": "Lisbon", "cuisine": "sushi"}))
+
+    def test_no_service(self):
+        for message in ("help", "hello", "1", "Lisbon"):
+            self.assertEqual(self.extract(message), (None, {}))
+
+    def test_numbers(self):
+        self.assertEqual(find_budget("budget of 1.500"), "1500")
+        self.assertEqual(find_budget("$1,200 total"), "1200")
+        self.assertEqual(find_budget("12.50 euros"), "12")
+        self.assertEqual(find_budget("around €80 per person"), "80")
+        self.assertIsNone(find_budget("for 2 people"))
+        self.assertEqual(find_days("a long weekend"), "2")
+        self.assertEqual(find_days("2 weeks"), "14")
+        self.assertIsNone(find_days("in 2 weeks I go to Porto"))
+        self.assertEqual(find_days("within 3 days I fly to Rome for 5 days"), "5")
+        self.assertEqual(find_people("with my wife"), "2")
+        self.assertEqual(find_people("family of four"), "4")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,30 @@
+import os
+import tempfile
+from unittest import mock
+import trip_plan
+from response_cache import ResponseCache
+from usage_ledger import Budgets, UsageLedger
+
+
+class TempStoresMixin:
+    """
+    For test cases that answer through trip_plan: replaces its response
+    cache and usage ledger with empty ones in a temporary directory, so
+    that tests neither share answers nor touch the files of the app.
+    """
+
+    def use_temp_stores(self, ttls=None, budgets=Budgets({}, None, 0.8)):
+        """Patches in a new cache and ledger for this test, kept as self.cache and self.ledger."""
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.tmp_path = tmp_dir.name
+        self.cache = ResponseCache(os.path.join(tmp_dir.name, "cache.sqlite3"), ttls=ttls)
+        self.ledger = UsageLedger(os.path.join(tmp_dir.name, "usage.sqlite3"), budgets=budgets)
+        self.patch_trip_plan(_response_cache=self.cache, _usage_ledger=self.ledger)
+
+    def patch_trip_plan(self, **values):
+        """Sets attributes of trip_plan until the end of the test."""
+        for name, value in values.items():
+            patcher = mock.patch.object(trip_plan, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
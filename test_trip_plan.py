@@ -0,0 +1,459 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from contextlib import contextmanager
+from unittest import mock
+import trip_plan
+from fair_scheduler import FairScheduler, SchedulerBusy
+from resilience import CallGuard, CircuitBreaker, RetryPolicy
+from response_cache import ResponseCache, make_cache_key
+from usage_ledger import Budgets, UsageLedger
+from venue_index import VenueIndex
+from test_support import TempStoresMixin
+from types import SimpleNamespace
+from trip_plan import (TripPlanner, SERVICE_MENU, INVALID_CHOICE, STEP_FIRST_FIELD, OPENAI_ERROR_PREFIX,
+                       BUDGET_EXCEEDED_ERROR, day_chunks)
+
+class TestTripPlanner(unittest.TestCase):
+
+    def test_menu_and_service_choice(self):
+        planner = TripPlanner()
+        self.assertEqual(planner.process_message("help me plan a trip"), SERVICE_MENU)
+        self.assertEqual(planner.process_message("9"), INVALID_CHOICE)
+        self.assertEqual(planner.process_message("1"), "Enter your location:")
+        self.assertEqual(planner.process_message("Lisbon"), "Preferred cuisine?")
+        self.assertFalse(planner.is_complete())
+
+    def test_state_round_trip(self):
+        planner = TripPlanner()
+        for message in ("help", "3", "Rome", "2"):
+            planner.process_message(message)
+        state = planner.to_state()
+        self.assertEqual(state, [STEP_FIRST_FIELD + 2, "3", "Rome", "2"])
+
+        restored = TripPlanner.from_state(state)
+        self.assertEqual(restored.user_details, {"city": "Rome", "people": "2"})
+        self.assertEqual(restored.process_message("100"), "How many days will you travel?")
+
+    def test_invalid_details_are_reported(self):
+        planner = TripPlanner()
+        for message in ("help", "1", "", "sushi"):
+            planner.process_message(message)
+        self.assertEqual(planner.process_message("abc"),
+                         "Error: Location is required., Budget must be a positive number.")
+        self.assertTrue(planner.is_complete())
+
+    def test_destinations_are_canonicalized(self):
+        planner = TripPlanner()
+        for message in ("help", "1", "nyc", "pizza"):
+            planner.process_message(message)
+        self.assertEqual(planner.user_details["location"], "New York City")
+        self.assertEqual(planner.search_options()["user_location"],
+                         {"type": "approximate", "city": "New York City", "country": "US",
+                          "region": "New York", "timezone": "America/New_York"})
+        details = {"location": "New York City ", "cuisine": "pizza", "budget": "50"}
+        self.assertEqual(make_cache_key("1", TripPlanner.from_details("1", details).user_details),
+                         make_cache_key("1", dict(planner.user_details, budget="50")))
+
+    def test_unknown_destination_is_kept(self):
+        planner = TripPlanner()
+        for message in ("help", "1", "Lisbon, Alfama", "sushi"):
+            planner.process_message(message)
+        self.assertEqual(planner.user_details["location"], "Lisbon, Alfama")
+        self.assertEqual(planner.search_options()["user_location"]["country"], "PT")
+
+    def test_near_miss_is_not_taken_for_another_destination(self):
+        planner = TripPlanner.from_details("3", {"city": "Bari", "people": "2", "budget": "900", "days": "3"})
+        self.assertEqual(planner.user_details["city"], "Bari")
+        self.assertIsNone(planner.destination())
+        planner = TripPlanner.from_details("3", {"city": "Paris, Texas", "people": "2", "budget": "900",
+                                                 "days": "3"})
+        self.assertIsNone(planner.destination())
+
+    def test_one_message_with_every_detail_is_answered(self):
+        planner = TripPlanner()
+        with mock.patch.object(TripPlanner, "fetch_data_from_openai", return_value="answer") as fetch:
+            self.assertEqual(planner.process_message("cheap sushi in Lisbon under 40 euros"), "answer")
+        fetch.assert_called_once_with("The user is in Lisbon and needs a sushi restaurant with a budget of 40.")
+        self.assertTrue(planner.is_complete())
+
+    def test_only_missing_details_are_asked(self):
+        planner = TripPlanner()
+        self.assertEqual(planner.process_message("I want to eat in nyc"), "Preferred cuisine?")
+        self.assertEqual(planner.user_details, {"location": "New York City"})
+        self.assertEqual(planner.process_message("pizza"), "Enter your budget:")
+
+        planner = TripPlanner()
+        planner.process_message("help")
+        self.assertEqual(planner.process_message("3 day trip to Rome, budget 900"), "How many people are traveling?")
+        with mock.patch.object(TripPlanner, "fetch_data_from_openai", return_value="plan"):
+            self.assertEqual(planner.process_message("2"), "plan")
+        self.assertEqual(planner.user_details, {"city": "Rome", "people": "2", "budget": "900", "days": "3"})
+
+    def test_import_creates_no_clients(self):
+        code = ("import sys, trip_plan; "
+                "print(any(name in sys.modules for name in ('openai', 'twilio', 'dotenv')))")
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+        self.assertEqual(output.stdout.strip(), "False")
+
+class TestItineraryFanOut(TempStoresMixin, unittest.TestCase):
+
+    def setUp(self):
+        self.use_temp_stores()
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def fake_websearch(self, system_prompt, user_input, **options):
+        with self.lock:
+            self.calls.append((system_prompt, options))
+        time.sleep(0.1)
+        day = system_prompt.rsplit("'Day ", 1)[-1].split("'")[0]
+        return f"Day {day}: plan"
+
+    def plan(self, days):
+        planner = TripPlanner()
+        for message in ("help", "3", "Rome", "2", "900", days):
+            answer = planner.process_message(message)
+        return answer
+
+    def test_day_chunks(self):
+        self.assertEqual(day_chunks(5, 2), [(1, 2), (3, 4), (5, 5)])
+        self.assertEqual(day_chunks(3, 1), [(1, 1), (2, 2), (3, 3)])
+
+    def test_days_are_generated_in_parallel_and_merged_in_order(self):
+        with mock.patch.object(trip_plan, "get_response_with_websearch", self.fake_websearch):
+            started_at = time.perf_counter()
+            answer = self.plan("7")
+            elapsed = time.perf_counter() - started_at
+        self.assertEqual(answer, "\n\n".join(f"Day {day}: plan" for day in range(1, 8)))
+        self.assertEqual(len(self.calls), 7)
+        self.assertLess(elapsed, 0.5)
+        self.assertTrue(all(options["policy"] == "itinerary_chunk" for _, options in self.calls))
+        self.assertTrue(all(options["max_output_tokens"] == 550 for _, options in self.calls))
+
+    def test_long_trip_is_split_into_a_bounded_number_of_requests(self):
+        with mock.patch.object(trip_plan, "get_response_with_websearch", self.fake_websearch):
+            answer = self.plan("30")
+        self.assertEqual(answer, "\n\n".join(f"Day {day}: plan" for day in range(1, 31, 5)))
+        self.assertEqual(len(self.calls), 6)
+        # The outline covers one cycle of themes, not every day of the trip
+        self.assertTrue(all(prompt.count("\n- Day") == 7 for prompt, _ in self.calls))
+        with mock.patch.object(trip_plan, "get_response_with_websearch", self.fake_websearch):
+            self.assertEqual(self.plan("365"), "Error: Days spent must be a number from 1 to 30.")
+        self.assertEqual(len(self.calls), 6)
+
+    def test_short_trip_uses_one_request(self):
+        with mock.patch.object(trip_plan, "get_response_with_websearch", self.fake_websearch):
+            self.plan("2")
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(self.calls[0][1]["policy"], "itinerary")
+
+    def test_failed_chunk_fails_the_answer(self):
+        def flaky(system_prompt, user_input, **options):
+            if "'Day 2'" in system_prompt:
+                return OPENAI_ERROR_PREFIX + "timeout"
+            return "Day: plan"
+
+        with mock.patch.object(trip_plan, "get_response_with_websearch", flaky):
+            self.assertEqual(self.plan("3"), OPENAI_ERROR_PREFIX + "timeout")
+        cache_key = make_cache_key("3", {"city": "Rome", "people": "2", "budget": "900", "days": "3"})
+        self.assertIsNone(trip_plan.get_response_cache().get(cache_key))
+
+    def test_generation_runs_in_slot_but_cache_hits_do_not(self):
+        slots = []
+
+        @contextmanager
+        def generation_slot(weight):
+            slots.append(weight)
+            yield lambda: None
+
+        with mock.patch.object(trip_plan, "get_response_with_websearch", self.fake_websearch):
+            for _ in range(2):
+                planner = TripPlanner()
+                planner.generation_slot = generation_slot
+                for message in ("help", "3", "Rome", "2", "900", "3"):
+                    planner.process_message(message)
+        # One slot for each day chunk
+        self.assertEqual(slots, [3])
+        self.assertEqual(len(self.calls), 3)
+
+    def test_one_users_refusal_is_not_shared_with_others(self):
+        @contextmanager
+        def slow_refusal(weight):
+            time.sleep(0.1)
+            raise SchedulerBusy("timeout")
+            yield
+
+        def ask(generation_slot):
+            planner = TripPlanner()
+            planner.generation_slot = generation_slot
+            for message in ("help", "3", "Rome", "2", "900"):
+                planner.process_message(message)
+            return planner.process_message("2")
+
+        errors = []
+
+        def refused():
+            try:
+                ask(slow_refusal)
+            except SchedulerBusy as e:
+                errors.append(e.reason)
+
+        with mock.patch.object(trip_plan, "get_response_with_websearch", self.fake_websearch):
+            thread = threading.Thread(target=refused)
+            thread.start()
+            time.sleep(0.02)
+            self.assertTrue(ask(None).endswith(": plan"))
+            thread.join()
+        self.assertEqual(errors, ["timeout"])
+
+    def test_slots_are_released_before_the_parts_are_sent(self):
+        scheduler = FairScheduler(max_concurrent=4, user_rate=0)
+        in_use = []
+
+        def send(chunk):
+            in_use.append(scheduler.stats()["running"])
+            time.sleep(0.05)
+
+        with mock.patch.object(trip_plan, "get_response_with_websearch", self.fake_websearch):
+            planner = TripPlanner()
+            planner.stream_to = send
+            planner.generation_slot = lambda weight: scheduler.slot("+1", weight)
+            for message in ("help", "3", "Rome", "2", "900", "3"):
+                planner.process_message(message)
+        self.assertEqual(in_use, [0, 0, 0])
+        self.assertLess(scheduler.stats()["avg_hold_time"], 0.15)
+
+class TestStreaming(unittest.TestCase):
+
+    def test_stream_time_leaves_out_the_consumer(self):
+        events = [SimpleNamespace(type="response.output_text.delta", delta=f"part {n}") for n in range(3)]
+        guard = SimpleNamespace(call=lambda func, hedge: func(1))
+        client = mock.Mock()
+        client.responses.create.return_value = iter(events)
+        stage = trip_plan.STAGE_SECONDS.labels("llm_stream")
+        before = (sum(stage.counts), stage.sum)
+        with mock.patch.object(trip_plan, "get_openai_guard", return_value=guard), \
+                mock.patch.object(trip_plan, "get_openai_client", return_value=client):
+            for _ in trip_plan.stream_response_with_websearch("prompt", "input"):
+                time.sleep(0.05)
+        self.assertEqual(sum(stage.counts), before[0] + 1)
+        self.assertLess(stage.sum - before[1], 0.05)
+
+class TestAsyncWebsearch(TempStoresMixin, unittest.TestCase):
+
+    def setUp(self):
+        self.guard = CallGuard("test", RetryPolicy(2, 0.001, 0.01, 5.0, 0.08, 0.0), CircuitBreaker("test"))
+        self.client = mock.Mock()
+        self.use_temp_stores(ttls={"3": 0})
+        self.patch_trip_plan(get_openai_guard=mock.Mock(return_value=self.guard),
+                             get_async_openai_client=mock.Mock(return_value=self.client))
+        self.details = {"city": "Rome", "people": "2", "budget": "900", "days": "2"}
+
+    def response(self, text):
+        return SimpleNamespace(output_text=text, usage=None, output=[])
+
+    def answer(self, generation_slot=None):
+        planner = TripPlanner.from_details("3", self.details)
+        planner.generation_slot = generation_slot
+        return asyncio.run(planner.fetch_data_from_openai_async(planner.format_user_input()))
+
+    def test_cached_answer_is_served_without_a_call(self):
+        self.cache.ttls = {"3": 60}
+        self.cache.set(make_cache_key("3", self.details), "3", "cached plan")
+        self.client.responses.create = mock.AsyncMock()
+        self.assertEqual(self.answer(), "cached plan")
+        self.client.responses.create.assert_not_called()
+
+    def test_retryable_error_is_retried_in_a_slot(self):
+        class ServerError(Exception):
+            status_code = 503
+
+        self.client.responses.create = mock.AsyncMock(side_effect=[ServerError(), self.response("fresh plan")])
+        slots = []
+
+        @contextmanager
+        def generation_slot(weight):
+            slots.append(weight)
+            yield lambda: None
+
+        self.assertEqual(self.answer(generation_slot), "fresh plan")
+        self.assertEqual(self.guard.stats()["retries"], 1)
+        self.assertEqual(slots, [1])
+
+    def test_open_breaker_falls_back_to_the_last_good_answer(self):
+        self.cache.set(make_cache_key("3", self.details), "3", "last good plan")
+        self.guard.breaker.min_calls = 1
+        self.guard.breaker.record_failure()
+        self.client.responses.create = mock.AsyncMock()
+        self.assertEqual(self.answer(), "last good plan")
+        self.client.responses.create.assert_not_called()
+        self.assertEqual(self.cache.stats()["stale_hits"], 1)
+
+    def test_waiting_for_the_limiter_does_not_time_out_the_attempt(self):
+        async def create(**request):
+            await asyncio.sleep(0.05)
+            return self.response("answer")
+
+        async def two_calls():
+            with mock.patch.object(trip_plan, "get_openai_limiter", return_value=asyncio.Semaphore(1)):
+                return await asyncio.gather(*(trip_plan.get_response_with_websearch_async("prompt", "input")
+                                              for _ in range(2)))
+
+        self.client.responses.create = create
+        # The second call queues for 0.05s behind the first, which with its own 0.05s exceeds the 0.08s timeout
+        self.assertEqual(asyncio.run(two_calls()), ["answer", "answer"])
+        self.assertEqual(self.guard.stats()["recent_failures"], 0)
+
+class TestStaleFallback(unittest.TestCase):
+
+    def test_expired_answer_is_served_when_openai_fails(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache = ResponseCache(os.path.join(tmp_dir, "cache.sqlite3"), ttls={"1": 0})
+            details = {"location": "Lisbon", "cuisine": "sushi", "budget": "50"}
+            cache.set(make_cache_key("1", details), "1", "last good answer")
+            failing = mock.Mock(return_value=OPENAI_ERROR_PREFIX + "timeout")
+            ledger = UsageLedger(os.path.join(tmp_dir, "usage.sqlite3"))
+            with mock.patch.object(trip_plan, "_response_cache", cache), \
+                    mock.patch.object(trip_plan, "_usage_ledger", ledger), \
+                    mock.patch.object(trip_plan, "get_response_with_websearch", failing):
+                planner = TripPlanner()
+                for message in ("help", "1", "Lisbon", "sushi"):
+                    planner.process_message(message)
+                self.assertEqual(planner.process_message("50"), "last good answer")
+            failing.assert_called_once()
+            self.assertEqual(cache.stats()["stale_hits"], 1)
+
+class TestVenueIndexAnswers(TempStoresMixin, unittest.TestCase):
+
+    def setUp(self):
+        self.use_temp_stores()
+        self.patch_trip_plan(_venue_index=VenueIndex(os.path.join(self.tmp_path, "venues.sqlite3")))
+        patcher = mock.patch.dict(os.environ, {"STRUCTURED_RESULTS": "1", "VENUE_INDEX_MIN_RESULTS": "2",
+                                               "VENUE_INDEX_MAX_RESULTS": "3"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.calls = []
+
+    def structured_websearch(self, venues):
+        def websearch(system_prompt, user_input, **options):
+            self.calls.append((system_prompt, options))
+            return json.dumps({"venues": [
+                {"name": name, "category": "italian", "price_estimate": price, "link": None, "neighbourhood": None}
+                for name, price in venues
+            ]})
+        return websearch
+
+    def ask(self, budget, cuisine="italian"):
+        planner = TripPlanner()
+        for message in ("help", "1", "Rome", cuisine):
+            planner.process_message(message)
+        return planner.process_message(budget)
+
+    def test_similar_query_is_answered_from_index(self):
+        websearch = self.structured_websearch([("Roma", 30), ("Nerone", 45), ("Lusso", 75)])
+        with mock.patch.object(trip_plan, "get_response_with_websearch", websearch):
+            first = self.ask("80")
+            # A different budget bucket, so not a response cache hit
+            second = self.ask("45")
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(self.calls[0][1]["text_format"]["name"], "venues")
+        self.assertIn("Lusso", first)
+        self.assertTrue(second.startswith("1. Nerone"))
+        self.assertNotIn("Lusso", second)
+        self.assertEqual(trip_plan.get_venue_index().stats()["hits"], 1)
+
+    def test_thin_coverage_asks_only_for_missing_venues(self):
+        with mock.patch.object(trip_plan, "get_response_with_websearch",
+                               self.structured_websearch([("Roma", 30), ("Lusso", 75)])):
+            self.ask("80")
+        with mock.patch.object(trip_plan, "get_response_with_websearch",
+                               self.structured_websearch([("Roma", 30), ("Nerone", 35)])):
+            answer = self.ask("40")
+        self.assertEqual(len(self.calls), 2)
+        self.assertIn("Return 2 venues", self.calls[1][0])
+        self.assertIn("Do not include these venues: Roma.", self.calls[1][0])
+        self.assertEqual([line.split(" - ")[0] for line in answer.splitlines() if line[0].isdigit()],
+                         ["1. Roma", "2. Nerone"])
+
+    def test_free_text_answer_is_passed_through(self):
+        with mock.patch.object(trip_plan, "get_response_with_websearch", mock.Mock(return_value="Try Roma.")):
+            self.assertEqual(self.ask("80"), "Try Roma.")
+        self.assertEqual(trip_plan.get_venue_index().stats()["added"], 0)
+
+class TestUsageAccounting(TempStoresMixin, unittest.TestCase):
+
+    def setUp(self):
+        self.use_temp_stores(budgets=Budgets({"1": 1.0}, None, 0.8))
+        self.client = mock.Mock()
+        self.client.responses.create.return_value = SimpleNamespace(
+            output_text="Day: plan", usage=SimpleNamespace(input_tokens=100, output_tokens=50),
+            output=[SimpleNamespace(type="web_search_call"), SimpleNamespace(type="message")]
+        )
+        self.patch_trip_plan(get_openai_client=mock.Mock(return_value=self.client))
+
+    def answer(self, service, details, user="whatsapp:+100"):
+        planner = TripPlanner.from_details(service, details)
+        planner.user = user
+        return planner.fetch_data_from_openai(planner.format_user_input())
+
+    def spend(self, cost, user=None):
+        meter = trip_plan.UsageMeter()
+        meter.calls, meter.cost = 1, cost
+        self.ledger.record("1", "Lisbon", user, "live", meter)
+
+    def test_usage_of_every_call_is_recorded_with_the_answer(self):
+        details = {"city": "Rome", "people": "2", "budget": "900", "days": "3"}
+        for _ in range(2):
+            self.answer("3", details)
+        rollups = {row["source"]: row for row in self.ledger.rollups()}
+        self.assertEqual(set(rollups), {"live", "cache"})
+        self.assertEqual((rollups["live"]["calls"], rollups["live"]["input_tokens"],
+                          rollups["live"]["web_searches"]), (3, 300, 3))
+        self.assertEqual((rollups["cache"]["calls"], rollups["cache"]["cost"]), (0, 0.0))
+        self.assertGreater(rollups["live"]["cost"], 0)
+
+    def test_ledger_errors_do_not_fail_the_answer(self):
+        broken = UsageLedger(os.path.join(self.ledger.path, "missing", "usage.sqlite3"), flush_every=1)
+        with mock.patch.object(trip_plan, "_usage_ledger", broken), self.assertLogs("trip_plan", "WARNING") as logs:
+            self.assertEqual(self.answer("1", {"location": "Lisbon", "cuisine": "sushi", "budget": "50"}),
+                             "Day: plan")
+        self.assertIn("Could not write the usage ledger", logs.output[0])
+        self.assertEqual((broken.stats()["buffered"], broken.stats()["failed_flushes"]), (1, 1))
+
+    def test_answers_near_the_cap_use_cheaper_settings(self):
+        self.spend(0.9)
+        self.answer("1", {"location": "Lisbon", "cuisine": "sushi", "budget": "50"})
+        request = self.client.responses.create.call_args.kwargs
+        self.assertEqual((request["tools"][0]["search_context_size"], request["max_output_tokens"]), ("low", 300))
+        self.assertEqual([row["source"] for row in self.ledger.rollups()], ["live", "degraded"])
+
+    def test_degraded_answer_is_not_served_to_other_users(self):
+        self.ledger.budgets = Budgets({"1": 100.0}, 1.0, 0.8)
+        self.spend(0.9, "whatsapp:+100")
+        details = {"location": "Lisbon", "cuisine": "sushi", "budget": "50"}
+        self.answer("1", details)
+        self.assertIsNone(self.cache.get(make_cache_key("1", details)))
+        self.answer("1", details, user="whatsapp:+200")
+        request = self.client.responses.create.call_args.kwargs
+        self.assertEqual(request["max_output_tokens"], 500)
+        self.assertIsNotNone(self.cache.get(make_cache_key("1", details)))
+
+    def test_no_new_answers_at_the_cap(self):
+        self.spend(1.0)
+        details = {"location": "Lisbon", "cuisine": "sushi", "budget": "50"}
+        self.assertEqual(self.answer("1", details), BUDGET_EXCEEDED_ERROR)
+        expired = ResponseCache(self.cache.path, ttls={"1": 0})
+        expired.set(make_cache_key("1", details), "1", "last good answer")
+        self.assertEqual(self.answer("1", details), "last good answer")
+        self.client.responses.create.assert_not_called()
+        self.assertEqual({row["source"] for row in self.ledger.rollups()}, {"live", "budget", "stale"})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from types import SimpleNamespace
+from usage_ledger import (BUDGET_DEGRADED, BUDGET_EXHAUSTED, BUDGET_OK, USER_SCOPE, Budgets, Prices, UsageLedger,
+                          UsageMeter, meter_usage, metering, note_source)
+
+PRICES = Prices(2.0, 8.0, {"low": 25.0, "medium": 30.0, "high": 35.0})
+
+
+def response(input_tokens, output_tokens, web_searches=1):
+    return SimpleNamespace(usage=SimpleNamespace(input_tokens=input_tokens, output_tokens=output_tokens),
+                           output=[SimpleNamespace(type="web_search_call")] * web_searches +
+                                  [SimpleNamespace(type="message")])
+
+
+def meter_costing(cost):
+    meter = UsageMeter(PRICES)
+    meter.calls, meter.cost = 1, cost
+    return meter
+
+class TestUsageMeter(unittest.TestCase):
+
+    def test_usage_and_cost_add_up(self):
+        meter = UsageMeter(PRICES)
+        meter.add(response(1000, 500))
+        meter.add(response(1000, 0, web_searches=2), "low")
+        self.assertEqual((meter.calls, meter.input_tokens, meter.output_tokens, meter.web_searches), (2, 2000, 500, 3))
+        self.assertAlmostEqual(meter.cost, 0.006 + 0.03 + 0.002 + 0.05)
+
+    def test_only_the_current_meter_is_added_to(self):
+        meter_usage(response(10, 10))
+        note_source("cache")
+        meter = UsageMeter(PRICES)
+        with metering(meter):
+            meter_usage(response(10, 10))
+            note_source("stale")
+        meter_usage(response(10, 10))
+        self.assertEqual((meter.calls, meter.source), (1, "stale"))
+
+class TestUsageLedger(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "usage.sqlite3")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def ledger(self, **kwargs):
+        return UsageLedger(self.path, PRICES, **dict(dict(flush_every=2, flush_interval=60), **kwargs))
+
+    def test_rows_are_written_in_batches_and_rolled_up(self):
+        ledger = self.ledger()
+        ledger.record("1", "Lisbon", "whatsapp:+100", "live", meter_costing(0.05))
+        self.assertEqual(ledger.stats(), {"recorded": 1, "flushes": 0, "failed_flushes": 0, "dropped": 0,
+                                          "buffered": 1})
+        ledger.record("1", "Lisbon", "whatsapp:+200", "cache", UsageMeter(PRICES))
+        self.assertEqual(ledger.stats()["buffered"], 0)
+        ledger.record("1", "Porto", "whatsapp:+100", "live", meter_costing(0.05))
+        with sqlite3.connect(self.path) as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM usage").fetchone()[0], 2)
+
+        ledger.flush()
+        rollups = self.ledger().rollups()
+        self.assertEqual([(row["key"], row["source"], row["requests"], row["cost"]) for row in rollups],
+                         [("1", "live", 2, 0.1), ("1", "cache", 1, 0.0)])
+        self.assertEqual([(row["key"], row["requests"]) for row in self.ledger().rollups(scope=USER_SCOPE)],
+                         [("whatsapp:+100", 2), ("whatsapp:+200", 1)])
+
+    def test_failed_flush_writes_nothing_and_keeps_the_rows(self):
+        ledger = self.ledger(flush_every=10)
+        ledger.record("1", "Lisbon", "whatsapp:+100", "live", meter_costing(0.05))
+        ledger.flush()
+        with sqlite3.connect(self.path) as conn:
+            conn.execute("CREATE TRIGGER fail BEFORE INSERT ON usage_rollups BEGIN SELECT RAISE(ABORT, 'full'); END")
+        ledger.record("1", "Porto", "whatsapp:+100", "live", meter_costing(0.05))
+        with self.assertRaises(sqlite3.Error):
+            ledger.flush()
+        with sqlite3.connect(self.path) as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM usage").fetchone()[0], 1)
+            conn.execute("DROP TRIGGER fail")
+        self.assertEqual((ledger.stats()["buffered"], ledger.stats()["failed_flushes"]), (1, 1))
+        self.assertAlmostEqual(ledger.spent("service", "1"), 0.1)
+        ledger.flush()
+        self.assertEqual([(row["requests"], row["cost"]) for row in ledger.rollups()], [(2, 0.1)])
+
+    def test_spend_caps(self):
+        budgets = Budgets({"1": 1.0}, 0.5, 0.8)
+        ledger = self.ledger(budgets=budgets)
+        self.assertEqual(ledger.budget_state("1", "whatsapp:+100"), BUDGET_OK)
+        ledger.record("1", "Lisbon", "whatsapp:+100", "live", meter_costing(0.85))
+        # Spend not flushed yet counts in this process
+        self.assertEqual(ledger.budget_state("1", "whatsapp:+100"), BUDGET_EXHAUSTED)
+        self.assertEqual(ledger.budget_state("1", "whatsapp:+200"), BUDGET_DEGRADED)
+        self.assertEqual(ledger.budget_state("2", "whatsapp:+200"), BUDGET_OK)
+        ledger.flush()
+        self.assertEqual(ledger.budget_state("1", "whatsapp:+100"), BUDGET_EXHAUSTED)
+        # Other processes see it once flushed
+        other = self.ledger(budgets=budgets)
+        self.assertAlmostEqual(other.spent("service", "1"), 0.85)
+        other.record("1", "Lisbon", "whatsapp:+300", "live", meter_costing(0.2))
+        self.assertEqual(other.budget_state("1"), BUDGET_EXHAUSTED)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,5 @@
 import unittest
-from validate_user_input import validate_restaurant_finder, validate_historical_places, validate_mystery_guide
+from validate_user_input import validate_restaurant_finder, validate_historical_places, validate_mystery_guide, validate_many
 
 class TestValidateUserInput(unittest.TestCase):
 
@@ -46,5 +46,41 @@ class TestValidateUserInput(unittest.TestCase):
         self.assertFalse(result["success"])
         self.assertIn("Budget must be a positive number.", result["errors"])
 
+    def test_trip_planner_keys(self):
+        result = validate_mystery_guide({"city": "Lisbon", "people": "2", "budget": "900", "days": "4"})
+        self.assertTrue(result["success"])
+        self.assertEqual(result["service_data"]["days_spent"], 4)
+        self.assertEqual(result["service_data"]["num_people"], 2)
+        self.assertEqual(result["service_data"]["city"], "Lisbon")
+
+        result = validate_mystery_guide({"days": "31"})
+        self.assertEqual(result["errors"], ["Days spent must be a number from 1 to 30."])
+
+        result = validate_historical_places({"location": "Rome", "preferences": "parks", "budget": "abc"})
+        self.assertFalse(result["success"])
+        self.assertIn("Total budget must be a positive number.", result["errors"])
+
+        result = validate_restaurant_finder({"location": "Lisbon", "cuisine": " sushi ", "budget": "50"})
+        self.assertEqual(result["service_data"]["cuisine"], "sushi")
+
+    def test_missing_location(self):
+        result = validate_restaurant_finder({"budget": "10"})
+        self.assertEqual(result, {"success": False, "errors": ["Location is required."]})
+
+    def test_validate_many(self):
+        records = [
+            {"service": "1", "location": "Paris", "budget": "20"},
+            {"service": "3", "days": "0"},
+            {"service": "9"},
+        ]
+        results = list(validate_many(records))
+        self.assertTrue(results[0]["success"])
+        self.assertEqual(results[1]["errors"], ["Days spent must be a number from 1 to 30."])
+        self.assertEqual(results[2]["errors"], ["Unknown service."])
+
+        results = list(validate_many(({"location": "Rome"} for _ in range(3)), service="2"))
+        self.assertEqual(len(results), 3)
+        self.assertTrue(all(result["success"] for result in results))
+
 if __name__ == "__main__":
     unittest.main()
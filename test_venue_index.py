@@ -0,0 +1,65 @@
+import json
+import os
+import tempfile
+import unittest
+from venue_index import VenueIndex, format_venues, parse_budget, parse_venues
+
+def venue(name, price, category="italian", neighbourhood="Trastevere"):
+    return {"name": name, "category": category, "price_estimate": price,
+            "link": f"https://example.com/{name.lower()}", "neighbourhood": neighbourhood}
+
+class TestVenueIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.index = VenueIndex(os.path.join(self.tmp_dir.name, "venues.sqlite3"))
+
+    def test_parse_venues(self):
+        text = json.dumps({"venues": [venue("Roma", 30), {"name": " ", "category": "x"}, venue("Nerone", None)]})
+        venues = parse_venues(text)
+        self.assertEqual([v["name"] for v in venues], ["Roma", "Nerone"])
+        self.assertEqual(venues[0]["price_estimate"], 30.0)
+        self.assertIsNone(parse_venues("Here are three places"))
+        self.assertIsNone(parse_venues(json.dumps({"venues": "none"})))
+
+    def test_parse_budget(self):
+        self.assertEqual(parse_budget("80"), 80.0)
+        self.assertEqual(parse_budget("80.5 EUR"), 80.5)
+        self.assertIsNone(parse_budget("cheap"))
+
+    def test_format_venues(self):
+        text = format_venues([venue("Roma", 30), venue("Museo", 0, "museum", None)])
+        self.assertEqual(text, "1. Roma - italian, Trastevere\n   About 30 per person\n   https://example.com/roma\n"
+                               "2. Museo - museum\n   Free\n   https://example.com/museo")
+
+    def test_query_filters_by_city_category_and_budget(self):
+        self.index.add("1", "Rome", "Italian", [venue("Roma", 30), venue("Nerone", 75), venue("Unknown", None)])
+        self.index.add("1", "Milan", "Italian", [venue("Milano", 20)])
+        names = [v["name"] for v in self.index.query("1", " rome", "italian", "60", 10)]
+        self.assertEqual(names, ["Roma", "Unknown"])
+        names = [v["name"] for v in self.index.query("1", "Rome", "Italian", "80", 10)]
+        self.assertEqual(names, ["Nerone", "Roma", "Unknown"])
+        self.assertEqual(self.index.query("1", "Rome", "sushi", "80", 10), [])
+        self.assertEqual(self.index.query("2", "Rome", "Italian", "80", 10), [])
+
+    def test_often_recommended_venues_rank_first(self):
+        self.index.add("1", "Rome", "italian", [venue("Roma", 30), venue("Nerone", 40)])
+        self.index.add("1", "Rome", "italian", [venue("Roma", 32)])
+        venues = self.index.query("1", "Rome", "italian", "50", 1)
+        self.assertEqual(venues[0]["name"], "Roma")
+        self.assertEqual(venues[0]["price_estimate"], 32.0)
+
+    def test_expired_venues_are_ignored(self):
+        index = VenueIndex(os.path.join(self.tmp_dir.name, "expired.sqlite3"), ttls={"1": 0})
+        index.add("1", "Rome", "italian", [venue("Roma", 30)])
+        self.assertEqual(index.query("1", "Rome", "italian", "50", 5), [])
+
+    def test_record_lookup(self):
+        self.index.record_lookup(3, 3)
+        self.index.record_lookup(1, 3)
+        self.index.record_lookup(0, 3)
+        self.assertEqual(self.index.stats(), {"hits": 1, "partial_hits": 1, "misses": 1, "added": 0})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,14 +1,262 @@
+import asyncio
+import atexit
+import contextvars
+import logging
 import os
-from validate_user_input import validate_restaurant_finder, validate_historical_places, validate_mystery_guide
-from dotenv import load_dotenv
-from openai import OpenAI
+import queue
+import threading
+import time
+from collections import namedtuple
+from contextlib import asynccontextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from validate_user_input import SERVICE_VALIDATORS
+from response_cache import ResponseCache, make_cache_key, ttls_from_env
+from single_flight import SingleFlight, prompt_key
+from message_chunker import MessageChunker, split_message
+from metrics import (BUDGET_ACTIONS, POLICY_SECONDS, STAGE_SECONDS, STALE_FALLBACKS, time_stage, time_policy,
+                     record_error, record_usage)
+from gazetteer import Gazetteer
+from slot_extractor import extract_slots
+from search_policy import DEFAULT_POLICY, economy_options, policies_from_env, search_options
+from usage_ledger import (BUDGET_DEGRADED, BUDGET_EXHAUSTED, UsageLedger, UsageMeter, budgets_from_env,
+                          meter_usage, metering, note_source, prices_from_env)
+from venue_index import VENUE_FORMAT, VenueIndex, format_venues, parse_venues, structured_instructions
+from clients import load_env, get_openai_client, get_async_openai_client, get_openai_limiter, get_openai_guard
 
-# load the api key from the .env file
-load_dotenv()
-api_key = os.getenv("OPENAI_API_KEY")
+logger = logging.getLogger(__name__)
 
-# Initialize the OpenAI client with the API key from the .env file
-client = OpenAI(api_key=api_key)
+# The OpenAI clients (see clients.py) and the response cache are created on
+# first use, so importing this module stays cheap and free of side effects.
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """Returns the cache of completed answers, shared by every process using the same file."""
+    global _response_cache
+    if _response_cache is None:
+        load_env()
+        with _response_cache_lock:
+            if _response_cache is None:
+                _response_cache = ResponseCache(
+                    os.getenv("RESPONSE_CACHE_PATH", "response_cache.sqlite3"),
+                    max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "10000")),
+                    ttls=ttls_from_env()
+                )
+    return _response_cache
+
+_search_policies = None
+
+
+def get_search_policy(service):
+    """Returns the web search policy of a service, see search_policy.py."""
+    global _search_policies
+    if _search_policies is None:
+        load_env()
+        _search_policies = policies_from_env()
+    return _search_policies.get(service, DEFAULT_POLICY)
+
+_gazetteer = None
+_gazetteer_lock = threading.Lock()
+
+# Fields holding a destination, canonicalized through the gazetteer
+DESTINATION_FIELDS = ("location", "city")
+
+
+def get_gazetteer():
+    """
+    Returns the destination gazetteer loaded from GAZETTEER_PATH, with the
+    countries and regions of GAZETTEER_REGIONS_PATH, see gazetteer.py.
+    """
+    global _gazetteer
+    if _gazetteer is None:
+        load_env()
+        with _gazetteer_lock:
+            if _gazetteer is None:
+                here = os.path.dirname(os.path.abspath(__file__))
+                path = os.getenv("GAZETTEER_PATH", os.path.join(here, "destinations.csv"))
+                regions_path = os.getenv("GAZETTEER_REGIONS_PATH", os.path.join(here, "regions.csv"))
+                _gazetteer = (Gazetteer.from_csv(path, regions_path if os.path.exists(regions_path) else None)
+                              if os.path.exists(path) else Gazetteer())
+    return _gazetteer
+
+
+def canonical_field(field, value):
+    """
+    Replaces a destination that the gazetteer knows, e.g. "nyc" or
+    "Barcelonna", with its canonical name; other values, including short
+    names one letter away from a destination such as "Bari", are kept as given.
+    """
+    if field in DESTINATION_FIELDS:
+        destination = get_gazetteer().lookup(value)
+        if destination is not None:
+            return destination.name
+    return value
+
+_venue_index = None
+_venue_index_lock = threading.Lock()
+
+
+def venue_index_settings():
+    """
+    Returns (enabled, min_results, max_results): with STRUCTURED_RESULTS set,
+    venue answers are requested as JSON and indexed; an index lookup with at
+    least VENUE_INDEX_MIN_RESULTS venues answers without OpenAI, and answers
+    list at most VENUE_INDEX_MAX_RESULTS venues.
+    """
+    load_env()
+    max_results = max(int(os.getenv("VENUE_INDEX_MAX_RESULTS", "5")), 1)
+    return (os.getenv("STRUCTURED_RESULTS", "").lower() in ("1", "true", "yes"),
+            min(max(int(os.getenv("VENUE_INDEX_MIN_RESULTS", "3")), 1), max_results),
+            max_results)
+
+
+def get_venue_index():
+    """Returns the index of venues from structured answers, see venue_index.py."""
+    global _venue_index
+    if _venue_index is None:
+        load_env()
+        with _venue_index_lock:
+            if _venue_index is None:
+                _venue_index = VenueIndex(os.getenv("VENUE_INDEX_PATH", "venues.sqlite3"), ttls=ttls_from_env())
+    return _venue_index
+
+_fan_out_executor = None
+_fan_out_lock = threading.Lock()
+
+
+def fan_out_settings():
+    """
+    Returns (min_days, days_per_chunk, max_parallel, max_chunks): itineraries
+    of at least ITINERARY_FAN_OUT_MIN_DAYS days are generated
+    ITINERARY_DAYS_PER_CHUNK days per request, at most ITINERARY_MAX_PARALLEL
+    requests at a time; longer trips get more days per request so that no
+    itinerary takes more than ITINERARY_MAX_CHUNKS requests.
+    """
+    load_env()
+    return (int(os.getenv("ITINERARY_FAN_OUT_MIN_DAYS", "3")),
+            max(int(os.getenv("ITINERARY_DAYS_PER_CHUNK", "1")), 1),
+            max(int(os.getenv("ITINERARY_MAX_PARALLEL", "7")), 1),
+            max(int(os.getenv("ITINERARY_MAX_CHUNKS", "7")), 1))
+
+
+def get_fan_out_executor():
+    """Returns the thread pool that runs the per-day itinerary requests."""
+    global _fan_out_executor
+    if _fan_out_executor is None:
+        with _fan_out_lock:
+            if _fan_out_executor is None:
+                _fan_out_executor = ThreadPoolExecutor(max_workers=fan_out_settings()[2],
+                                                       thread_name_prefix="itinerary")
+    return _fan_out_executor
+
+_usage_ledger = None
+_usage_ledger_lock = threading.Lock()
+
+
+def get_usage_ledger():
+    """
+    Returns the ledger of answer costs and spend caps, see usage_ledger.py.
+    Rows still buffered are written when the process exits.
+    """
+    global _usage_ledger
+    if _usage_ledger is None:
+        load_env()
+        with _usage_ledger_lock:
+            if _usage_ledger is None:
+                _usage_ledger = UsageLedger(
+                    os.getenv("USAGE_LEDGER_PATH", "usage.sqlite3"),
+                    prices=prices_from_env(),
+                    budgets=budgets_from_env(SERVICE_FLOWS),
+                    flush_every=int(os.getenv("USAGE_FLUSH_EVERY", "50")),
+                    flush_interval=float(os.getenv("USAGE_FLUSH_INTERVAL", "5")),
+                    retention_days=int(os.getenv("USAGE_RETENTION_DAYS", "30"))
+                )
+                atexit.register(_flush_usage_ledger)
+    return _usage_ledger
+
+
+def _flush_usage_ledger():
+    # The ledger of this process; a forked child has its own, see _reset_after_fork()
+    if _usage_ledger is not None:
+        _usage_ledger.flush()
+
+
+def _reset_after_fork():
+    # SQLite connections, worker threads and buffered usage rows do not
+    # survive a fork, so a child opens its own; the gazetteer and policies
+    # are plain data and stay shared
+    global _response_cache, _venue_index, _fan_out_executor, _usage_ledger
+    global _response_cache_lock, _venue_index_lock, _fan_out_lock, _usage_ledger_lock
+    _response_cache = _venue_index = _fan_out_executor = _usage_ledger = None
+    _response_cache_lock, _venue_index_lock, _fan_out_lock = threading.Lock(), threading.Lock(), threading.Lock()
+    _usage_ledger_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def fan_out_with_websearch(requests, user_input, on_done=None):
+    """
+    Sends one web-search request per (system_prompt, search options) pair
+    concurrently and yields the answers in request order, each as soon as
+    it and the ones before it are done. on_done is called as each request
+    finishes, e.g. to hand back its generation slot.
+    """
+    executor = get_fan_out_executor()
+    # Each request runs in a copy of the caller's context, so its usage is metered with the answer
+    futures = [executor.submit(contextvars.copy_context().run, get_response_with_websearch,
+                               system_prompt, user_input, **options)
+               for system_prompt, options in requests]
+    if on_done is not None:
+        for future in futures:
+            future.add_done_callback(lambda _: on_done())
+    for future in futures:
+        yield future.result()
+
+
+def read_ahead(iterable, on_done=None):
+    """
+    Consumes iterable on a thread of its own and yields its items, so that
+    a slow consumer (e.g. sending each part to Twilio) does not hold up the
+    producer. on_done is called once the producer is done.
+    """
+    items = queue.Queue()
+    end = object()
+
+    def produce():
+        try:
+            for item in iterable:
+                items.put(item)
+        finally:
+            items.put(end)
+            if on_done is not None:
+                on_done()
+
+    threading.Thread(target=contextvars.copy_context().run, args=(produce,), daemon=True).start()
+    while True:
+        item = items.get()
+        if item is end:
+            return
+        yield item
+
+
+def merge_answers(answers):
+    """Joins the answers of a fan-out in order, or returns the first error among them."""
+    for answer in answers:
+        if answer.startswith(OPENAI_ERROR_PREFIX):
+            return answer
+    return "\n\n".join(answer.strip() for answer in answers)
+
+# Coalesces identical OpenAI requests that are in flight at the same time
+openai_flight = SingleFlight()
+
+# Prefix of the message returned when the OpenAI call fails
+OPENAI_ERROR_PREFIX = "Error fetching data from OpenAI: "
+# Returned instead of a new answer once a spend cap is reached and no cached answer can stand in
+BUDGET_EXCEEDED_ERROR = (OPENAI_ERROR_PREFIX +
+                         "today's budget for this request has been reached. Please try again tomorrow.")
 
 # Direct system prompts with placeholders; these will be formatted with the collected details.
 restaurant_prompt_template = (
@@ -48,7 +296,116 @@ mystery_prompt_template = (
     "Present your itinerary in a clear, engaging, and organized format."
 )
 
-def get_response_with_websearch(system_prompt, user_input, user_location=None, context_size="medium"):
+# Conversation flow of one service, precomputed once:
+#   fields:          details collected, in the order they are asked for
+#   prompts:         question asked for each field
+#   system_template: system prompt, formatted with the collected details
+#   user_template:   sentence summarizing the collected details
+#   validator:       compiled validator from validate_user_input
+# day_field names the field holding the trip length of services whose answer
+# is a day-by-day itinerary, which can be generated in parallel chunks of days.
+# category_field names the field holding the kind of venue asked for by
+# services whose answer is a list of venues, which can be indexed
+ServiceFlow = namedtuple(
+    "ServiceFlow",
+    ["name", "fields", "prompts", "system_template", "user_template", "validator", "day_field", "category_field"]
+)
+
+SERVICE_FLOWS = {
+    "1": ServiceFlow(
+        "Restaurant Finder",
+        ("location", "cuisine", "budget"),
+        ("Enter your location:", "Preferred cuisine?", "Enter your budget:"),
+        restaurant_prompt_template,
+        "The user is in {location} and needs a {cuisine} restaurant with a budget of {budget}.",
+        SERVICE_VALIDATORS["1"],
+        None,
+        "cuisine"
+    ),
+    "2": ServiceFlow(
+        "Tourist Attractions",
+        ("location", "preferences", "budget"),
+        ("Enter the location for tourist attractions:", "Do you prefer monuments, parks, or viewpoints?",
+         "Enter your budget:"),
+        tourist_prompt_template,
+        "The user is in {location} and prefers {preferences} with a budget of {budget}.",
+        SERVICE_VALIDATORS["2"],
+        None,
+        "preferences"
+    ),
+    "3": ServiceFlow(
+        "Mystery Planning Guide",
+        ("city", "people", "budget", "days"),
+        ("Enter the city you want to travel to:", "How many people are traveling?", "Enter your budget:",
+         "How many days will you travel?"),
+        mystery_prompt_template,
+        "The user wants to travel to {city} for {days} days with {people} people and a budget of {budget}.",
+        SERVICE_VALIDATORS["3"],
+        "days",
+        None
+    ),
+}
+
+# Conversation steps. From STEP_FIRST_FIELD on, the step is
+# STEP_FIRST_FIELD + the index of the field being asked for.
+STEP_START = 0
+STEP_SERVICE = 1
+STEP_FIRST_FIELD = 2
+
+SERVICE_MENU = ("Hey! I can help with your trip. Choose a service:\n"
+                "1. Restaurant Finder\n"
+                "2. Tourist Attractions\n"
+                "3. Mystery Planning Guide\n"
+                "Enter your choice (1/2/3):")
+INVALID_CHOICE = "Invalid choice. Please enter 1, 2, or 3."
+
+# Themes handed out to the days of a parallel itinerary, so that chunks
+# written at the same time do not all suggest the same sights
+DAY_THEMES = (
+    "arrival and the historic center",
+    "landmark museums and architecture",
+    "local food, markets and neighborhoods",
+    "parks, nature and viewpoints",
+    "a day trip to a nearby town or natural site",
+    "art, culture and nightlife",
+    "hidden gems off the beaten path",
+)
+
+DAY_CHUNK_INSTRUCTIONS = (
+    "\n\nThe itinerary is written in parts at the same time. Themes of the whole {days}-day trip:\n"
+    "{outline}\n"
+    "Write only {chunk}, following the theme, and start with the 'Day {first}' heading. "
+    "Do not add an introduction, an overview of the whole trip or closing remarks."
+)
+
+
+def _as_field_text(value):
+    """Field values arrive as text from WhatsApp; batch inputs may hold numbers."""
+    return "" if value is None else str(value).strip()
+
+
+def day_chunks(days, days_per_chunk):
+    """Splits days 1..days into consecutive (first, last) ranges of at most days_per_chunk days."""
+    return [(first, min(first + days_per_chunk - 1, days)) for first in range(1, days + 1, days_per_chunk)]
+
+
+def day_chunk_prompt(system_prompt, days, first, last):
+    """Narrows an itinerary system prompt down to days first..last of the trip."""
+    if days <= len(DAY_THEMES):
+        outline = "\n".join(f"- Day {day}: {DAY_THEMES[day - 1]}" for day in range(1, days + 1))
+    else:
+        # The themes repeat, so a long trip is outlined by one cycle instead of every day
+        outline = "\n".join(f"- Days {day}, {day + len(DAY_THEMES)}, ...: {theme}"
+                            for day, theme in enumerate(DAY_THEMES, 1))
+    chunk = f"day {first}" if first == last else f"days {first} to {last}"
+    return system_prompt + DAY_CHUNK_INSTRUCTIONS.format(days=days, outline=outline, chunk=chunk, first=first)
+
+def build_websearch_request(system_prompt, user_input, user_location=None, context_size="medium",
+                            max_output_tokens=DEFAULT_POLICY.max_output_tokens, text_format=None):
+    """
+    Builds the arguments of a web-search Responses API call. text_format,
+    e.g. VENUE_FORMAT, requests structured output instead of free text.
+    """
     messages = [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": user_input}
@@ -60,155 +417,679 @@ def get_response_with_websearch(system_prompt, user_input, user_location=None, c
     if user_location:
         web_search_tool["user_location"] = user_location
 
+    request_args = {
+        "model": "gpt-4o",          # Use a model that supports web search
+        "tools": [web_search_tool],
+        "input": messages,
+        "max_output_tokens": max_output_tokens,
+        "temperature": 0.7,
+        "store": False,
+        "tool_choice": "required"
+    }
+    if text_format:
+        request_args["text"] = {"format": text_format}
+    return request_args
+
+
+def get_response_with_websearch(system_prompt, user_input, user_location=None, context_size="medium",
+                                max_output_tokens=DEFAULT_POLICY.max_output_tokens,
+                                policy=DEFAULT_POLICY.name, text_format=None):
+    request_args = build_websearch_request(system_prompt, user_input, user_location, context_size,
+                                           max_output_tokens, text_format)
+    try:
+        with time_stage("llm"), time_policy(policy):
+            response = get_openai_guard().call(
+                lambda timeout: get_openai_client().responses.create(timeout=timeout, **request_args)
+            )
+        record_usage(response, policy)
+        meter_usage(response, context_size)
+        return response.output_text
+    except Exception as e:
+        record_error("llm", e)
+        return f"{OPENAI_ERROR_PREFIX}{str(e)}"
+
+
+def stream_response_with_websearch(system_prompt, user_input, user_location=None, context_size="medium",
+                                   max_output_tokens=DEFAULT_POLICY.max_output_tokens,
+                                   policy=DEFAULT_POLICY.name):
+    """
+    Streaming variant of get_response_with_websearch. Yields the answer
+    text piece by piece as the model generates it.
+    """
+    request_args = build_websearch_request(system_prompt, user_input, user_location, context_size,
+                                           max_output_tokens)
+    started_at = time.perf_counter()
+    # Time the consumer keeps the stream waiting at a yield is not spent on OpenAI's side
+    paused = 0.0
+    error = None
     try:
-        response = client.responses.create(
-            model="gpt-4o",          # Use a model that supports web search
-            tools=[{"type": "web_search_preview"}],
-            input=messages,
-            max_output_tokens=500,
-            temperature=0.7,
-            store=False,
-            tool_choice="required"
+        # Retries and the breaker cover opening the stream; hedging would double the output
+        stream = get_openai_guard().call(
+            lambda timeout: get_openai_client().responses.create(stream=True, timeout=timeout, **request_args),
+            hedge=False
         )
+        for event in stream:
+            if event.type == "response.output_text.delta":
+                paused_at = time.perf_counter()
+                try:
+                    yield event.delta
+                finally:
+                    paused += time.perf_counter() - paused_at
+            elif event.type == "response.completed":
+                record_usage(event.response, policy)
+                meter_usage(event.response, context_size)
+    except Exception as e:
+        error = e
+    finally:
+        elapsed = time.perf_counter() - started_at - paused
+        STAGE_SECONDS.labels("llm_stream").observe(elapsed)
+        POLICY_SECONDS.labels(policy).observe(elapsed)
+    if error is not None:
+        record_error("llm_stream", error)
+        yield f"{OPENAI_ERROR_PREFIX}{str(error)}"
+
+
+async def get_response_with_websearch_async(system_prompt, user_input, user_location=None,
+                                            context_size="medium",
+                                            max_output_tokens=DEFAULT_POLICY.max_output_tokens,
+                                            policy=DEFAULT_POLICY.name, timeout=None, text_format=None):
+    """
+    Async variant of get_response_with_websearch. Waits for a free slot in
+    the limiter of the event loop before calling the API, and gives up each
+    attempt after timeout seconds (OPENAI_TIMEOUT by default).
+    """
+    request_args = build_websearch_request(system_prompt, user_input, user_location, context_size,
+                                           max_output_tokens, text_format)
+    try:
+        async def attempt(attempt_timeout):
+            return await get_async_openai_client().responses.create(
+                timeout=min(timeout or attempt_timeout, attempt_timeout),
+                **request_args
+            )
+
+        # Waiting for the limiter is local queueing: it must not time out an attempt or trip the breaker
+        async with get_openai_limiter():
+            with time_stage("llm"), time_policy(policy):
+                response = await get_openai_guard().call_async(attempt)
+        record_usage(response, policy)
+        meter_usage(response, context_size)
         return response.output_text
     except Exception as e:
-        return f"Error fetching data from OpenAI: {str(e)}"
+        record_error("llm", e)
+        return f"{OPENAI_ERROR_PREFIX}{str(e)}"
 
 
 class TripPlanner:
+    # Keeps per-session memory small when many conversations are live
+    __slots__ = ("step", "selected_service", "user_details", "stream_to", "generation_slot", "before_answer", "user",
+                 "degraded")
+
     def __init__(self):
         self.user_details = {}
-        self.step = 0  # Tracks conversation step
+        self.step = STEP_START  # Tracks conversation step
         self.selected_service = ""
+        # Optional callable; when set, the final answer is streamed to it in
+        # WhatsApp-sized chunks instead of only being returned at the end
+        self.stream_to = None
+        # Optional callable returning a context manager that every answer
+        # generation (but not a cache hit) runs in, e.g. a scheduler slot
+        self.generation_slot = None
+        # Optional callable run once the details are valid and before the
+        # answer is fetched, e.g. to save the session first
+        self.before_answer = None
+        # Who the answer is for, e.g. the phone number, for per-user spend caps
+        self.user = None
+        # Set when a spend cap is close and answers are generated with cheaper settings
+        self.degraded = False
+
+    def to_state(self):
+        """
+        Returns a compact, JSON-serializable form of the conversation state:
+        the step, the service and the collected values in field order,
+        e.g. [4, "1", "Lisbon", "sushi"].
+        """
+        state = [self.step, self.selected_service]
+        if self.selected_service:
+            state.extend(self.user_details.get(field) for field in SERVICE_FLOWS[self.selected_service].fields)
+            while state[-1] is None:
+                state.pop()
+        return state
+
+    @classmethod
+    def from_state(cls, state):
+        """Rebuilds a planner from the output of to_state()."""
+        planner = cls()
+        planner.step = state[0]
+        planner.selected_service = state[1]
+        if planner.selected_service:
+            fields = SERVICE_FLOWS[planner.selected_service].fields
+            planner.user_details = {
+                field: value for field, value in zip(fields, state[2:]) if value is not None
+            }
+        return planner
+
+    @classmethod
+    def from_details(cls, service, details):
+        """
+        Builds a planner that has collected every field of the service from
+        details, a dict keyed by field name, e.g. for batch jobs.
+        """
+        planner = cls()
+        fields = SERVICE_FLOWS[service].fields
+        planner.selected_service = service
+        planner.user_details = {field: canonical_field(field, _as_field_text(details.get(field))) for field in fields}
+        planner.step = STEP_FIRST_FIELD + len(fields)
+        return planner
+
+    def is_complete(self):
+        """True once every detail for the selected service has been collected."""
+        return (self.step >= STEP_FIRST_FIELD and
+                self.step - STEP_FIRST_FIELD >= len(SERVICE_FLOWS[self.selected_service].fields))
 
     def process_message(self, user_input):
         """Handles conversation flow based on user input."""
-        if self.step == 0:  # First message
+        step = self.step
+        if step == STEP_START:  # First message
+            reply = self.start_from_message(user_input, menu_on_help=True)
+            if reply is not None:
+                return reply
             if "help" in user_input.lower():
-                self.step = 1
-                return ("Hey! I can help with your trip. Choose a service:\n"
-                        "1. Restaurant Finder\n"
-                        "2. Tourist Attractions\n"
-                        "3. Mystery Planning Guide\n"
-                        "Enter your choice (1/2/3):")
-
-        elif self.step == 1:  # User selects a service
-            if user_input in ["1", "2", "3"]:
+                self.step = STEP_SERVICE
+                return SERVICE_MENU
+
+        elif step == STEP_SERVICE:  # User selects a service
+            if user_input in SERVICE_FLOWS:
                 self.selected_service = user_input
-                self.step = 2
+                self.step = STEP_FIRST_FIELD
                 return self.get_initial_prompt()
-            else:
-                return "Invalid choice. Please enter 1, 2, or 3."
+            return self.start_from_message(user_input) or INVALID_CHOICE
 
-        elif self.step >= 2:  # Collect user input step by step
+        else:  # Collect user input step by step
             return self.collect_user_input(user_input)
 
+    def start_from_message(self, user_input, menu_on_help=False):
+        """
+        Picks the service and fills as many details as a free-text message
+        such as "sushi in Lisbon under 40 euros" gives, then asks for the
+        first missing one, or answers right away if none is missing.
+        Returns None if the message does not ask for a service, or, with
+        menu_on_help, if it asks for help without giving any detail
+        ("help me plan a trip"), so that the menu is shown.
+        """
+        extraction = extract_slots(user_input, get_gazetteer())
+        if extraction.service is None:
+            return None
+        if menu_on_help and not extraction.details and "help" in user_input.lower():
+            return None
+        self.selected_service = extraction.service
+        self.user_details = {field: canonical_field(field, value) for field, value in extraction.details.items()}
+        self.step = self.next_missing_step()
+        if self.is_complete():
+            return self.validate_and_generate_response()
+        return self.get_next_prompt()
+
+    def next_missing_step(self):
+        """Returns the step of the first detail not collected yet, or the step after the last field."""
+        fields = SERVICE_FLOWS[self.selected_service].fields
+        for index, field in enumerate(fields):
+            if field not in self.user_details:
+                return STEP_FIRST_FIELD + index
+        return STEP_FIRST_FIELD + len(fields)
+
     def get_initial_prompt(self):
         """Returns the initial prompt based on the selected service."""
-        prompts = {
-            "1": "Enter your location:",
-            "2": "Enter the location for tourist attractions:",
-            "3": "Enter the city you want to travel to:"
-        }
-        return prompts[self.selected_service]
+        return SERVICE_FLOWS[self.selected_service].prompts[0]
 
     def collect_user_input(self, user_input):
         """Collects and validates user input step by step."""
-        steps = {
-            "1": ["location", "cuisine", "budget"],
-            "2": ["location", "preferences", "budget"],
-            "3": ["city", "people", "budget", "days"]
-        }
-
-        current_step = len(self.user_details)
-        expected_key = steps[self.selected_service][current_step]
-        self.user_details[expected_key] = user_input
+        flow = SERVICE_FLOWS[self.selected_service]
+        index = self.step - STEP_FIRST_FIELD
+        self.user_details[flow.fields[index]] = canonical_field(flow.fields[index], user_input)
+        # Details given up front are skipped
+        self.step = self.next_missing_step()
 
-        if current_step + 1 < len(steps[self.selected_service]):
-            return self.get_next_prompt(steps[self.selected_service], current_step + 1)
+        if not self.is_complete():
+            return self.get_next_prompt()
 
         return self.validate_and_generate_response()
 
-    def get_next_prompt(self, step_list, step_index):
-        """Returns the next question based on the step."""
-        prompts = {
-            "cuisine": "Preferred cuisine?",
-            "budget": "Enter your budget:",
-            "preferences": "Do you prefer monuments, parks, or viewpoints?",
-            "people": "How many people are traveling?",
-            "days": "How many days will you travel?"
-        }
-        return prompts[step_list[step_index]]
+    def get_next_prompt(self):
+        """Returns the question for the current step."""
+        return SERVICE_FLOWS[self.selected_service].prompts[self.step - STEP_FIRST_FIELD]
 
     def validate_and_generate_response(self):
         """Validates user inputs and fetches data from OpenAI API."""
-        validation_functions = {
-            "1": validate_restaurant_finder,
-            "2": validate_historical_places,
-            "3": validate_mystery_guide
-        }
-
-        validation_result = validation_functions[self.selected_service](self.user_details)
+        with time_stage("validation"):
+            validation_result = SERVICE_FLOWS[self.selected_service].validator(self.user_details)
 
         if not validation_result["success"]:
             return "Error: " + ", ".join(validation_result["errors"])
 
+        if self.before_answer is not None:
+            self.before_answer()
         formatted_text = self.format_user_input()
         response = self.fetch_data_from_openai(formatted_text)
         return response
 
     def format_user_input(self):
         """Formats the user input into a structured sentence."""
-        if self.selected_service == "1":
-            return f"The user is in {self.user_details['location']} and needs a {self.user_details['cuisine']} restaurant with a budget of {self.user_details['budget']}."
-        elif self.selected_service == "2":
-            return f"The user is in {self.user_details['location']} and prefers {self.user_details['preferences']} with a budget of {self.user_details['budget']}."
-        elif self.selected_service == "3":
-            return f"The user wants to travel to {self.user_details['city']} for {self.user_details['days']} days with {self.user_details['people']} people and a budget of {self.user_details['budget']}."
+        return SERVICE_FLOWS[self.selected_service].user_template.format(**self.user_details)
 
     def format_system_prompt(self):
-        if self.selected_service == "1":
-            # Restaurant Finder
-            return restaurant_prompt_template.format(
-                location=self.user_details['location'],
-                cuisine=self.user_details['cuisine'],
-                budget=self.user_details['budget']
-            )
-        elif self.selected_service == "2":
-            # Tourist Attractions
-            return tourist_prompt_template.format(
-                location=self.user_details['location'],
-                preferences=self.user_details['preferences'],
-                budget=self.user_details['budget']
-            )
-        elif self.selected_service == "3":
-            # Mystery Planning Guide
-            return mystery_prompt_template.format(
-                city=self.user_details['city'],
-                days=self.user_details['days'],
-                people=self.user_details['people'],
-                budget=self.user_details['budget']
-            )
+        with time_stage("prompt_format"):
+            return SERVICE_FLOWS[self.selected_service].system_template.format(**self.user_details)
+
+    def search_options(self):
+        """
+        Returns the web search settings of the selected service: context size,
+        location hint, output-token budget and the policy name they are recorded under.
+        """
+        options = search_options(get_search_policy(self.selected_service), self.user_details, self.destination())
+        return economy_options(options) if self.degraded else options
+
+    def destination(self):
+        """Returns the gazetteer entry of the city asked about, or None."""
+        for field in DESTINATION_FIELDS:
+            if self.user_details.get(field):
+                return get_gazetteer().lookup(self.user_details[field], partial=True)
+        return None
+
+    def day_chunk_requests(self, system_prompt):
+        """
+        For a long itinerary, returns one (system_prompt, search options) pair
+        per chunk of days, to be generated in parallel. Returns None when the
+        answer is generated in a single request.
+        """
+        day_field = SERVICE_FLOWS[self.selected_service].day_field
+        # Close to a spend cap, one request is cheaper than one per chunk of days
+        if day_field is None or self.degraded:
+            return None
+        days = str(self.user_details.get(day_field, "")).strip()
+        min_days, days_per_chunk, _, max_chunks = fan_out_settings()
+        if not days.isdecimal() or int(days) < max(min_days, 2):
+            return None
+
+        days = int(days)
+        days_per_chunk = max(days_per_chunk, -(-days // max_chunks))
+        policy = get_search_policy(self.selected_service)
+        requests = []
+        for first, last in day_chunks(days, days_per_chunk):
+            options = search_options(policy, dict(self.user_details, **{day_field: str(last - first + 1)}),
+                                     self.destination())
+            options["policy"] = policy.name + "_chunk"
+            requests.append((day_chunk_prompt(system_prompt, days, first, last), options))
+        return requests
+
+    def uses_venue_index(self):
+        """True if the answer is a venue list requested as structured output and indexed."""
+        return (SERVICE_FLOWS[self.selected_service].category_field is not None and
+                venue_index_settings()[0])
+
+    def indexed_venues(self, limit):
+        """Returns up to limit indexed venues matching the city, category and budget asked for."""
+        category_field = SERVICE_FLOWS[self.selected_service].category_field
+        return get_venue_index().query(self.selected_service, self.user_details.get("location", ""),
+                                       self.user_details.get(category_field, ""),
+                                       self.user_details.get("budget", ""), limit)
 
+    def answer_from_index(self):
+        """Returns the answer listing indexed venues if there are enough of them, else None."""
+        _, min_results, max_results = venue_index_settings()
+        venues = self.indexed_venues(max_results)
+        get_venue_index().record_lookup(len(venues), min_results)
+        if len(venues) < min_results:
+            return None
+        note_source("index")
+        return format_venues(venues)
+
+    def venue_request(self, system_prompt):
+        """
+        Returns (known venues, system prompt, search options) of a structured
+        request for the venues missing from the index.
+        """
+        max_results = venue_index_settings()[2]
+        known = self.indexed_venues(max_results)
+        options = dict(self.search_options(), text_format=VENUE_FORMAT)
+        prompt = system_prompt + structured_instructions(max_results - len(known),
+                                                         [venue["name"] for venue in known])
+        return known, prompt, options
+
+    def merge_venue_answer(self, known, response):
+        """
+        Indexes the venues of a structured answer and returns them, after
+        the known ones, as the answer text. Errors and answers that are not
+        structured are returned as they are, unless known venues can stand in.
+        """
+        if response.startswith(OPENAI_ERROR_PREFIX):
+            if not known:
+                return response
+            note_source("index")
+            return format_venues(known)
+        venues = parse_venues(response)
+        if venues is None:
+            return response
+        category_field = SERVICE_FLOWS[self.selected_service].category_field
+        get_venue_index().add(self.selected_service, self.user_details.get("location", ""),
+                              self.user_details.get(category_field, ""), venues)
+        names = {venue["name"].lower() for venue in known}
+        merged = known + [venue for venue in venues if venue["name"].lower() not in names]
+        return format_venues(merged[:venue_index_settings()[2]])
 
     def fetch_data_from_openai(self, formatted_text):
+        """Returns the answer, and records what it cost in the usage ledger."""
+        meter = UsageMeter(get_usage_ledger().prices)
+        with metering(meter):
+            response = self._fetch_data(formatted_text)
+        self.log_usage(meter, response)
+        return response
+
+    def log_usage(self, meter, response, paid_source="live"):
+        """
+        Adds the row of an answer to the usage ledger, under the source
+        noted while answering (e.g. "cache"), else under paid_source if
+        OpenAI was called, "coalesced" if another request's call was shared,
+        "degraded" if cheaper settings were used, or "error". Accounting
+        never fails an answer: a ledger error is counted and logged.
+        """
+        source = meter.source
+        if source is None:
+            if response.startswith(OPENAI_ERROR_PREFIX):
+                source = "error"
+            elif not meter.calls:
+                source = "coalesced"
+            else:
+                source = "degraded" if self.degraded else paid_source
+        city = self.user_details.get("location") or self.user_details.get("city")
+        try:
+            get_usage_ledger().record(self.selected_service, city, self.user, source, meter)
+        except Exception as e:
+            record_error("usage_ledger", e)
+            logger.warning("Could not write the usage ledger: %s", e)
+
+    def apply_budget(self):
+        """
+        Checks today's spend of the service and the user against their caps
+        before a new answer is generated. Close to a cap, the answer is
+        generated with cheaper settings; at a cap, returns the error to give
+        instead (callers fall back to the last cached answer), else None.
+        If the ledger cannot be read, the answer is generated as usual.
+        """
+        try:
+            state = get_usage_ledger().budget_state(self.selected_service, self.user)
+        except Exception as e:
+            record_error("usage_ledger", e)
+            state = None
+        self.degraded = state == BUDGET_DEGRADED
+        if state == BUDGET_EXHAUSTED:
+            BUDGET_ACTIONS.labels(self.selected_service, "refused").inc()
+            note_source("budget")
+            return BUDGET_EXCEEDED_ERROR
+        if self.degraded:
+            BUDGET_ACTIONS.labels(self.selected_service, "degraded").inc()
+        return None
+
+    def _fetch_data(self, formatted_text):
+        if self.stream_to is None:
+            return self._fetch_answer(formatted_text)
+        if not self.uses_venue_index():
+            return self.stream_data_from_openai(formatted_text)
+        # Venue lists are requested as JSON, so they are sent once complete
+        response = self._fetch_answer(formatted_text)
+        for chunk in split_message(response):
+            self.stream_to(chunk)
+        return response
+
+    def _fetch_answer(self, formatted_text):
+        # Serve repeated city/cuisine/budget combinations from the cache
+        cache_key = make_cache_key(self.selected_service, self.user_details)
+        cached_response = get_response_cache().get(cache_key)
+        if cached_response is not None:
+            note_source("cache")
+            return cached_response
+
+        # Then from venues indexed for similar queries
+        if self.uses_venue_index():
+            indexed_response = self.answer_from_index()
+            if indexed_response is not None:
+                return indexed_response
+
         # First, generate the formatted system prompt based on the selected service.
         system_prompt = self.format_system_prompt()
         user_input = formatted_text  # Your existing method that aggregates user input
 
-        # Optionally, if you have user location details for refining web search:
-        user_location = {
-            "type": "approximate",
-            "city": self.user_details.get('location') or self.user_details.get('city'),
+        # Admission is per user, so it happens before joining a call that another user may lead
+        refusal = self.apply_budget()
+        if refusal is not None:
+            return self.stale_answer(cache_key) or refusal
+        # Known only once the budget is checked: close to a cap, one request replaces the day chunks
+        requests = self.day_chunk_requests(system_prompt)
+        with self._generation_slot(len(requests) if requests else 1) as release:
+            # Identical requests already in flight share one OpenAI call
+            return openai_flight.do(
+                self.flight_key(system_prompt, user_input),
+                self._generate_and_cache, cache_key, system_prompt, user_input, requests, release
+            )
 
-        }
+    def generate_answer(self, system_prompt, user_input):
+        """
+        Asks OpenAI for a fresh answer, in parallel day chunks for long
+        itineraries, or for the venues missing from the index. Returns
+        BUDGET_EXCEEDED_ERROR instead once a spend cap is reached.
+        """
+        refusal = self.apply_budget()
+        if refusal is not None:
+            return refusal
+        return self._generate_answer(system_prompt, user_input, self.day_chunk_requests(system_prompt))
 
-        response = get_response_with_websearch(
+    def _generate_answer(self, system_prompt, user_input, requests, on_request_done=None):
+        # requests are the day chunks, if any; on_request_done is called as each is done
+        if self.uses_venue_index():
+            known, venue_prompt, options = self.venue_request(system_prompt)
+            return self.merge_venue_answer(known, get_response_with_websearch(venue_prompt, user_input, **options))
+        if requests:
+            return merge_answers(list(fan_out_with_websearch(requests, user_input, on_request_done)))
+        return get_response_with_websearch(
             system_prompt,
             user_input,
-            user_location=user_location,
-            context_size="medium"  # Choose "low", "medium", or "high" based on your needs
+            **self.search_options()
         )
+
+    def cache_answer(self, cache_key, response, source="live"):
+        """
+        Stores a good answer in the shared response cache. Answers generated
+        with cheaper settings near this user's spend cap are not stored, so
+        that other users are not served them.
+        """
+        if not self.degraded and not response.startswith(OPENAI_ERROR_PREFIX):
+            get_response_cache().set(cache_key, self.selected_service, response, source)
+
+    def refresh_cached_answer(self, source="live", meter=None):
+        """
+        Generates a fresh answer and stores it in the cache even if the cached
+        one is still valid. Returns the answer, or the error message without
+        touching the cache. The usage is added to meter if one is given.
+        """
+        if meter is None:
+            meter = UsageMeter(get_usage_ledger().prices)
+        with metering(meter):
+            response = self.generate_answer(self.format_system_prompt(), self.format_user_input())
+        self.log_usage(meter, response, source)
+        self.cache_answer(make_cache_key(self.selected_service, self.user_details), response, source)
+        return response
+
+    def _generation_slot(self, weight=1):
+        """
+        Holds one generation slot per OpenAI request of the answer; the
+        with-block gets a function that hands one back early.
+        """
+        if self.generation_slot is None:
+            return nullcontext(lambda: None)
+        return self.generation_slot(weight)
+
+    def flight_key(self, system_prompt, user_input):
+        """Single-flight key of the answer; answers made with cheaper settings are not shared."""
+        key = prompt_key(system_prompt, user_input)
+        return key + "\ndegraded" if self.degraded else key
+
+    def _generate_and_cache(self, cache_key, system_prompt, user_input, requests, on_request_done):
+        response = self._generate_answer(system_prompt, user_input, requests, on_request_done)
+        if response.startswith(OPENAI_ERROR_PREFIX):
+            return self.stale_answer(cache_key) or response
+        self.cache_answer(cache_key, response)
+        return response
+
+    def stale_answer(self, cache_key):
+        """Returns the last good answer to the same query, even if expired, or None."""
+        stale = get_response_cache().get_stale(cache_key)
+        if stale is not None:
+            STALE_FALLBACKS.labels(self.selected_service).inc()
+            note_source("stale")
+        return stale
+
+    def stream_data_from_openai(self, formatted_text):
+        """
+        Sends the answer to self.stream_to chunk by chunk, split at paragraph
+        and list-item boundaries, and returns the full text.
+        """
+        cache_key = make_cache_key(self.selected_service, self.user_details)
+        cached_response = get_response_cache().get(cache_key)
+        if cached_response is not None:
+            note_source("cache")
+            for chunk in split_message(cached_response):
+                self.stream_to(chunk)
+            return cached_response
+
+        return self._stream_answer(cache_key, formatted_text)
+
+    def _stream_answer(self, cache_key, formatted_text):
+        # The slots are handed back as the OpenAI requests finish, not after the parts are sent
+        refusal = self.apply_budget()
+        if refusal is not None:
+            answer = self.stale_answer(cache_key) or refusal
+            for chunk in split_message(answer):
+                self.stream_to(chunk)
+            return answer
+
+        system_prompt = self.format_system_prompt()
+        requests = self.day_chunk_requests(system_prompt)
+        if requests:
+            # Send each chunk of days as soon as it and the days before it are ready
+            answers = []
+            with self._generation_slot(len(requests)) as release:
+                for answer in fan_out_with_websearch(requests, formatted_text, release):
+                    answers.append(answer)
+                    if answer.startswith(OPENAI_ERROR_PREFIX):
+                        break
+                    for chunk in split_message(answer.strip()):
+                        self.stream_to(chunk)
+            response = merge_answers(answers)
+            if not response.startswith(OPENAI_ERROR_PREFIX):
+                self.cache_answer(cache_key, response)
+                return response
+            # The last good answer can only stand in while no day has been sent yet
+            stale = self.stale_answer(cache_key) if len(answers) == 1 else None
+            for chunk in split_message(stale) if stale else [response]:
+                self.stream_to(chunk)
+            return stale or response
+
+        chunker = MessageChunker()
+        parts = []
+        with self._generation_slot() as release:
+            deltas = read_ahead(stream_response_with_websearch(
+                system_prompt,
+                formatted_text,
+                **self.search_options()
+            ), release)
+            for delta in deltas:
+                if not parts and delta.startswith(OPENAI_ERROR_PREFIX):
+                    # Nothing has been sent yet, so the last good answer can still stand in
+                    stale = self.stale_answer(cache_key)
+                    if stale is not None:
+                        for chunk in split_message(stale):
+                            self.stream_to(chunk)
+                        return stale
+                parts.append(delta)
+                for chunk in chunker.feed(delta):
+                    self.stream_to(chunk)
+        for chunk in chunker.flush():
+            self.stream_to(chunk)
+
+        response = "".join(parts)
+        if parts and not parts[-1].startswith(OPENAI_ERROR_PREFIX):
+            self.cache_answer(cache_key, response)
+        return response
+
+    async def fetch_data_from_openai_async(self, formatted_text, timeout=None):
+        """
+        Async variant of fetch_data_from_openai. The SQLite stores (response
+        cache, venue index, usage ledger) and the wait for a generation slot
+        are blocking, so they run in worker threads, off the event loop.
+        """
+        meter = UsageMeter((await asyncio.to_thread(get_usage_ledger)).prices)
+        with metering(meter):
+            response = await self._fetch_data_async(formatted_text, timeout)
+        await asyncio.to_thread(self.log_usage, meter, response)
+        return response
+
+    async def _fetch_data_async(self, formatted_text, timeout):
+        cache_key = make_cache_key(self.selected_service, self.user_details)
+        cached_response = await asyncio.to_thread(lambda: get_response_cache().get(cache_key))
+        if cached_response is not None:
+            note_source("cache")
+            return cached_response
+        if self.uses_venue_index():
+            indexed_response = await asyncio.to_thread(self.answer_from_index)
+            if indexed_response is not None:
+                return indexed_response
+
+        system_prompt = self.format_system_prompt()
+        refusal = await asyncio.to_thread(self.apply_budget)
+        if refusal is not None:
+            return await asyncio.to_thread(self.stale_answer, cache_key) or refusal
+        requests = self.day_chunk_requests(system_prompt)
+        async with self._generation_slot_async(len(requests) if requests else 1) as release:
+            return await openai_flight.do_async(
+                self.flight_key(system_prompt, formatted_text),
+                self._generate_and_cache_async, cache_key, system_prompt, formatted_text, requests, release, timeout
+            )
+
+    @asynccontextmanager
+    async def _generation_slot_async(self, weight=1):
+        # The slot is a blocking context manager: wait for it in a thread, release it (which does not block) here
+        slot = self._generation_slot(weight)
+        release = await asyncio.to_thread(slot.__enter__)
+        try:
+            yield release
+        finally:
+            slot.__exit__(None, None, None)
+
+    async def _generate_and_cache_async(self, cache_key, system_prompt, user_input, requests, on_request_done,
+                                        timeout):
+        if self.uses_venue_index():
+            known, venue_prompt, options = await asyncio.to_thread(self.venue_request, system_prompt)
+            answer = await get_response_with_websearch_async(venue_prompt, user_input, timeout=timeout, **options)
+            response = await asyncio.to_thread(self.merge_venue_answer, known, answer)
+        elif requests:
+            async def day_chunk(chunk_prompt, options):
+                try:
+                    return await get_response_with_websearch_async(chunk_prompt, user_input, timeout=timeout,
+                                                                   **options)
+                finally:
+                    on_request_done()
+
+            response = merge_answers(await asyncio.gather(*(
+                day_chunk(chunk_prompt, options) for chunk_prompt, options in requests
+            )))
+        else:
+            response = await get_response_with_websearch_async(
+                system_prompt,
+                user_input,
+                timeout=timeout,
+                **self.search_options()
+            )
+        if response.startswith(OPENAI_ERROR_PREFIX):
+            return await asyncio.to_thread(self.stale_answer, cache_key) or response
+        await asyncio.to_thread(self.cache_answer, cache_key, response)
         return response
 
 
@@ -220,9 +1101,15 @@ def simulate_conversation():
         response = trip_planner.process_message(user_input)
         print(f"Bot: {response}")
 
-        if trip_planner.step == 6:
+        if trip_planner.is_complete():
             print(f"\nBot: Here's your trip planning: {response}")
             break
 
-# Uncomment the next line to run the conversation simulation
-simulate_conversation()
+
+def main():
+    """Command-line entry point: plan one trip interactively."""
+    simulate_conversation()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,351 @@
+"""
+Usage ledger: what every answer cost and where it came from.
+
+Each answer is one row with its service, city, user, source (cache,
+venue index, OpenAI, ...), latency, OpenAI calls, tokens, web searches
+and estimated cost. Rows are buffered in memory and appended to a SQLite
+database in batches; each batch is also added to daily rollups per
+service and per user, split by source, which the spend caps are checked
+against and which show what each optimisation saves.
+
+Costs are estimated in USD from OPENAI_PRICE_INPUT and OPENAI_PRICE_OUTPUT
+per million tokens and OPENAI_PRICE_WEB_SEARCH_LOW/_MEDIUM/_HIGH per
+thousand web searches of each search context size.
+
+Spend caps are in USD per UTC day: BUDGET_DAILY_<service> for a service
+(e.g. BUDGET_DAILY_3=20) and BUDGET_DAILY_USER for each user, unset for
+no cap. From BUDGET_DEGRADE_AT of a cap (0.8 by default), answers are
+generated with cheaper settings; at the cap, no new answer is generated.
+Caps are soft: every process sees the spend of the others once they have
+flushed it, after a few seconds.
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# USD per million input and output tokens, and per thousand web searches by search context size
+Prices = namedtuple("Prices", ["input", "output", "web_search"])
+
+DEFAULT_PRICES = Prices(2.5, 10.0, {"low": 25.0, "medium": 27.5, "high": 30.0})
+
+# services:   daily cap in USD per service number
+# user:       daily cap in USD per user, or None
+# degrade_at: fraction of a cap from which answers are generated with cheaper settings
+Budgets = namedtuple("Budgets", ["services", "user", "degrade_at"])
+
+# Results of UsageLedger.budget_state()
+BUDGET_OK = "ok"
+BUDGET_DEGRADED = "degraded"
+BUDGET_EXHAUSTED = "exhausted"
+
+# Scopes of the daily rollups
+SERVICE_SCOPE = "service"
+USER_SCOPE = "user"
+
+# Spend remembered per scope and key between two reads of the rollups
+SPEND_CACHE_SIZE = 4096
+
+
+def _float_env(name):
+    value = os.getenv(name, "").strip()
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+def prices_from_env():
+    """Returns DEFAULT_PRICES with the OPENAI_PRICE_* overrides applied."""
+    web_search = {size: _float_env(f"OPENAI_PRICE_WEB_SEARCH_{size.upper()}") for size in DEFAULT_PRICES.web_search}
+    return Prices(
+        _float_env("OPENAI_PRICE_INPUT") or DEFAULT_PRICES.input,
+        _float_env("OPENAI_PRICE_OUTPUT") or DEFAULT_PRICES.output,
+        {size: price if price is not None else DEFAULT_PRICES.web_search[size] for size, price in web_search.items()},
+    )
+
+
+def budgets_from_env(services=("1", "2", "3")):
+    """Returns the daily spend caps set by BUDGET_DAILY_<service>, BUDGET_DAILY_USER and BUDGET_DEGRADE_AT."""
+    caps = {service: _float_env(f"BUDGET_DAILY_{service}") for service in services}
+    degrade_at = _float_env("BUDGET_DEGRADE_AT")
+    return Budgets({service: cap for service, cap in caps.items() if cap is not None},
+                   _float_env("BUDGET_DAILY_USER"),
+                   min(max(degrade_at if degrade_at is not None else 0.8, 0.0), 1.0))
+
+
+def count_web_searches(response):
+    """Returns the number of web searches an OpenAI Responses API response made."""
+    return sum(1 for item in getattr(response, "output", None) or () if getattr(item, "type", "") == "web_search_call")
+
+
+class UsageMeter:
+    """Adds up the OpenAI calls made for one answer, from any thread or task."""
+
+    def __init__(self, prices=DEFAULT_PRICES):
+        self.prices = prices
+        self.started_at = time.perf_counter()
+        # Set where the answer is not generated by OpenAI, e.g. "cache"
+        self.source = None
+        self.calls = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.web_searches = 0
+        self.cost = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, response, context_size="medium"):
+        """Adds the usage of an OpenAI response."""
+        usage = getattr(response, "usage", None)
+        input_tokens = (getattr(usage, "input_tokens", 0) or 0) if usage is not None else 0
+        output_tokens = (getattr(usage, "output_tokens", 0) or 0) if usage is not None else 0
+        web_searches = count_web_searches(response)
+        cost = (input_tokens * self.prices.input + output_tokens * self.prices.output) / 1e6 + \
+            web_searches * self.prices.web_search.get(context_size, self.prices.web_search["medium"]) / 1e3
+        with self._lock:
+            self.calls += 1
+            self.input_tokens += input_tokens
+            self.output_tokens += output_tokens
+            self.web_searches += web_searches
+            self.cost += cost
+
+    def elapsed(self):
+        return time.perf_counter() - self.started_at
+
+
+_current_meter = ContextVar("usage_meter", default=None)
+
+
+@contextmanager
+def metering(meter):
+    """Makes meter the one that meter_usage() and note_source() add to within the with-block."""
+    token = _current_meter.set(meter)
+    try:
+        yield meter
+    finally:
+        _current_meter.reset(token)
+
+
+def meter_usage(response, context_size="medium"):
+    """Adds the usage of an OpenAI response to the current meter, if any."""
+    meter = _current_meter.get()
+    if meter is not None:
+        meter.add(response, context_size)
+
+
+def note_source(source):
+    """Records where the current answer came from, e.g. "cache" or "stale"."""
+    meter = _current_meter.get()
+    if meter is not None:
+        meter.source = source
+
+
+def _day(timestamp):
+    return time.strftime("%Y-%m-%d", time.gmtime(timestamp))
+
+
+class UsageLedger:
+    """
+    Append-only store of usage rows with daily rollups, see the module
+    docstring. Rows are written every flush_every rows or flush_interval
+    seconds, whichever comes first, and kept for retention_days.
+    """
+
+    # How many flushes happen between two passes deleting old rows
+    CLEANUP_INTERVAL = 64
+
+    def __init__(self, path, prices=DEFAULT_PRICES, budgets=Budgets({}, None, 0.8), flush_every=50,
+                 flush_interval=5.0, retention_days=30, refresh_interval=10.0, max_buffered=10000):
+        self.path = path
+        self.prices = prices
+        self.budgets = budgets
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        # Rows kept while the database cannot be written; the oldest are dropped beyond it
+        self.max_buffered = max_buffered
+        self.retention_days = retention_days
+        self.refresh_interval = refresh_interval
+        self._conn = None
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._last_flush = time.monotonic()
+        # After a failed flush, the next one is not tried from record() before this monotonic time
+        self._retry_at = 0.0
+        self._flushes_since_cleanup = 0
+        # (scope, key) -> (day, spend read from the rollups, monotonic time of the read)
+        self._spent = {}
+        # (scope, key) -> (day, spend of the buffered rows)
+        self._unflushed = {}
+        self.recorded = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.dropped = 0
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS usage ("
+                "id INTEGER PRIMARY KEY, ts REAL, service TEXT, city TEXT, user TEXT, source TEXT, "
+                "latency REAL, calls INTEGER, input_tokens INTEGER, output_tokens INTEGER, "
+                "web_searches INTEGER, cost REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS usage_ts ON usage (ts)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS usage_rollups ("
+                "day TEXT, scope TEXT, key TEXT, source TEXT, requests INTEGER, calls INTEGER, "
+                "input_tokens INTEGER, output_tokens INTEGER, web_searches INTEGER, cost REAL, "
+                "latency_total REAL, PRIMARY KEY (day, scope, key, source)) WITHOUT ROWID"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def record(self, service, city, user, source, meter):
+        """Buffers the usage row of one answer, writing the buffer out when it is due."""
+        now = time.time()
+        row = (now, service, city or "", user or "", source, meter.elapsed(), meter.calls,
+               meter.input_tokens, meter.output_tokens, meter.web_searches, meter.cost)
+        day = _day(now)
+        with self._lock:
+            self._buffer.append(row)
+            self.recorded += 1
+            if meter.cost:
+                for scope_key in self._scope_keys(service, user):
+                    spent_day, spent = self._unflushed.get(scope_key, (day, 0.0))
+                    self._unflushed[scope_key] = (day, (spent if spent_day == day else 0.0) + meter.cost)
+            now = time.monotonic()
+            due = now >= self._retry_at and (len(self._buffer) >= self.flush_every or
+                                             now - self._last_flush >= self.flush_interval)
+        if due:
+            self.flush()
+
+    @staticmethod
+    def _scope_keys(service, user):
+        keys = [(SERVICE_SCOPE, service)]
+        if user:
+            keys.append((USER_SCOPE, user))
+        return keys
+
+    def flush(self):
+        """
+        Appends the buffered rows and adds them to the daily rollups, in one
+        transaction. If the write fails, nothing is written, the rows stay
+        buffered for the next flush and the error is raised.
+        """
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+            unflushed, self._unflushed = self._unflushed, {}
+            self._last_flush = time.monotonic()
+            if not rows:
+                return
+            try:
+                self._write(rows)
+            except Exception:
+                self.failed_flushes += 1
+                self._retry_at = time.monotonic() + self.flush_interval
+                self.dropped += max(len(rows) - self.max_buffered, 0)
+                self._buffer = rows[-self.max_buffered:]
+                self._unflushed = unflushed
+                raise
+            self._retry_at = 0.0
+            self.flushes += 1
+            # The rollups now hold the flushed spend; keep the remembered totals in step
+            for scope_key, (day, spent) in unflushed.items():
+                remembered = self._spent.get(scope_key)
+                if remembered is not None and remembered[0] == day:
+                    self._spent[scope_key] = (day, remembered[1] + spent, remembered[2])
+
+    def _write(self, rows):
+        conn = self._connect()
+        # Commits the rows and their rollups together, or rolls both back
+        with conn:
+            conn.executemany(
+                "INSERT INTO usage (ts, service, city, user, source, latency, calls, input_tokens, "
+                "output_tokens, web_searches, cost) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            conn.executemany(
+                "INSERT INTO usage_rollups VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (day, scope, key, source) DO UPDATE SET requests = requests + 1, "
+                "calls = calls + excluded.calls, input_tokens = input_tokens + excluded.input_tokens, "
+                "output_tokens = output_tokens + excluded.output_tokens, "
+                "web_searches = web_searches + excluded.web_searches, cost = cost + excluded.cost, "
+                "latency_total = latency_total + excluded.latency_total",
+                [(_day(ts), scope, key, source, calls, input_tokens, output_tokens, web_searches, cost, latency)
+                 for ts, service, _, user, source, latency, calls, input_tokens, output_tokens, web_searches, cost
+                 in rows for scope, key in self._scope_keys(service, user)]
+            )
+            if self._flushes_since_cleanup + 1 >= self.CLEANUP_INTERVAL:
+                cutoff = time.time() - self.retention_days * 86400
+                conn.execute("DELETE FROM usage WHERE ts < ?", (cutoff,))
+                conn.execute("DELETE FROM usage_rollups WHERE day < ?", (_day(cutoff),))
+        self._flushes_since_cleanup = (self._flushes_since_cleanup + 1) % self.CLEANUP_INTERVAL
+
+    def spent(self, scope, key):
+        """Returns today's spend in USD of a service or user, as of at most refresh_interval seconds ago."""
+        day = _day(time.time())
+        with self._lock:
+            remembered = self._spent.get((scope, key))
+            if remembered is None or remembered[0] != day or \
+                    time.monotonic() - remembered[2] >= self.refresh_interval:
+                row = self._connect().execute(
+                    "SELECT COALESCE(SUM(cost), 0) FROM usage_rollups WHERE day = ? AND scope = ? AND key = ?",
+                    (day, scope, key)
+                ).fetchone()
+                if len(self._spent) >= SPEND_CACHE_SIZE:
+                    self._spent.clear()
+                remembered = self._spent[(scope, key)] = (day, row[0], time.monotonic())
+            unflushed_day, unflushed = self._unflushed.get((scope, key), (day, 0.0))
+            return remembered[1] + (unflushed if unflushed_day == day else 0.0)
+
+    def budget_state(self, service, user=None):
+        """
+        Returns BUDGET_EXHAUSTED once today's spend of the service or the
+        user has reached its cap, BUDGET_DEGRADED from budgets.degrade_at of
+        a cap, else BUDGET_OK.
+        """
+        state = BUDGET_OK
+        caps = [(SERVICE_SCOPE, service, self.budgets.services.get(service))]
+        if user:
+            caps.append((USER_SCOPE, user, self.budgets.user))
+        for scope, key, cap in caps:
+            if cap is None:
+                continue
+            spent = self.spent(scope, key)
+            if spent >= cap:
+                return BUDGET_EXHAUSTED
+            if spent >= cap * self.budgets.degrade_at:
+                state = BUDGET_DEGRADED
+        return state
+
+    def rollups(self, day=None, scope=SERVICE_SCOPE):
+        """
+        Returns the rollups of a day (today by default) and scope as dicts
+        with the key, source, requests, calls, tokens, web searches, cost
+        and average latency, costliest first.
+        """
+        self.flush()
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT key, source, requests, calls, input_tokens, output_tokens, web_searches, cost, "
+                "latency_total FROM usage_rollups WHERE day = ? AND scope = ? ORDER BY cost DESC, requests DESC",
+                (day or _day(time.time()), scope)
+            ).fetchall()
+        return [{"key": key, "source": source, "requests": requests, "calls": calls, "input_tokens": input_tokens,
+                 "output_tokens": output_tokens, "web_searches": web_searches, "cost": round(cost, 6),
+                 "avg_latency": latency_total / requests if requests else 0.0}
+                for key, source, requests, calls, input_tokens, output_tokens, web_searches, cost, latency_total
+                in rows]
+
+    def stats(self):
+        """
+        Returns the rows recorded, flushes made and failed, and rows dropped
+        by this process, and the rows still buffered.
+        """
+        with self._lock:
+            return {"recorded": self.recorded, "flushes": self.flushes, "failed_flushes": self.failed_flushes,
+                    "dropped": self.dropped, "buffered": len(self._buffer)}
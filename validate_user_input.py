@@ -1,97 +1,157 @@
-def validate_restaurant_finder(user_data):
-    """
-    Validates the input for the restaurant finder service.
+from collections import namedtuple
 
-    Parameters:
-    user_data (dict): A dictionary containing user inputs for the restaurant finder service.
+# A field of a service schema.
+#   name:     key in the validated service_data
+#   sources:  keys accepted in the user data, the first one present wins
+#   kind:     "text", "positive_int", "trip_days" (1 to MAX_TRIP_DAYS), "yes_no"
+#             or "address" (text of 5+ characters)
+#   required: whether an empty value is an error
+#   empty:    value stored when the field is missing or empty
+#   error:    message used when the field is required but empty, or invalid
+Field = namedtuple("Field", ["name", "sources", "kind", "required", "empty", "error"])
 
-    Returns:
-    dict: Contains either validated data or an error message.
-    """
-    location = user_data.get("location", "").strip()
-    budget = user_data.get("budget", "").strip()
-    theme = user_data.get("theme", "").strip()
-    hotel_address = user_data.get("hotel_address", "").strip()
+# Longest trip an itinerary is planned for
+MAX_TRIP_DAYS = 30
 
-    errors = []
 
-    # Validate location
-    if not location:
-        errors.append("Location is required.")
+RESTAURANT_FINDER_SCHEMA = (
+    Field("location", ("location",), "text", True, "", "Location is required."),
+    Field("budget", ("budget",), "positive_int", False, None, "Budget must be a positive number."),
+    Field("hotel_address", ("hotel_address",), "address", False, "", "Hotel address must be at least 5 characters long."),
+    Field("theme", ("theme",), "text", False, None, None),
+    Field("cuisine", ("cuisine",), "text", False, None, None),
+)
 
-    # Validate budget (must be a positive number)
-    if budget and (not budget.isdigit() or int(budget) <= 0):
-        errors.append("Budget must be a positive number.")
+HISTORICAL_PLACES_SCHEMA = (
+    Field("location", ("location",), "text", True, "", "Location is required."),
+    Field("hotel_address", ("hotel_address",), "address", False, "", "Hotel address must be at least 5 characters long."),
+    Field("num_people", ("number_of_people", "people"), "positive_int", False, None, "Number of people must be a positive number."),
+    Field("total_budget", ("total_budget", "budget"), "positive_int", False, None, "Total budget must be a positive number."),
+    Field("max_ticket_price", ("max_ticket_price",), "positive_int", False, None, "Max ticket price must be a positive number."),
+    Field("preferences", ("preferences",), "text", False, None, None),
+)
 
-    # Validate hotel address (should not be empty if provided)
-    if hotel_address and len(hotel_address) < 5:
-        errors.append("Hotel address must be at least 5 characters long.")
+MYSTERY_GUIDE_SCHEMA = (
+    Field("public_transport", ("public_transport",), "yes_no", False, None, "Public transport should be 'yes' or 'no'."),
+    Field("budget", ("budget",), "positive_int", False, None, "Budget must be a positive number."),
+    Field("days_spent", ("days_spent", "days"), "trip_days", False, None,
+          f"Days spent must be a number from 1 to {MAX_TRIP_DAYS}."),
+    Field("num_people", ("number_of_people", "people"), "positive_int", False, None, "Number of people must be a positive number."),
+    Field("preferences", ("preferences",), "text", False, None, None),
+    Field("city", ("city",), "text", False, None, None),
+)
 
-    # Return results
-    if errors:
-        return {"success": False, "errors": errors}
+def _parse_text(text):
+    return text, True
 
-    service_data = {
-        "location": location,
-        "budget": int(budget) if budget.isdigit() else None,
-        "theme": theme if theme else None,
-        "hotel_address": hotel_address
-    }
 
-    return {"success": True, "service_data": service_data}
+def _parse_positive_int(text):
+    number = int(text) if text.isdecimal() else 0
+    return number, number > 0
 
 
-def validate_historical_places(user_data):
+def _parse_trip_days(text):
+    number = int(text) if text.isdecimal() else 0
+    return number, 0 < number <= MAX_TRIP_DAYS
+
+
+def _parse_yes_no(text):
+    answer = text.lower()
+    return answer, answer in ("yes", "no")
+
+
+def _parse_address(text):
+    return text, len(text) >= 5
+
+
+# Parsers by field kind: each takes the stripped, non-empty text and
+# returns (value, whether the value is valid)
+_PARSERS = {
+    "text": _parse_text,
+    "positive_int": _parse_positive_int,
+    "trip_days": _parse_trip_days,
+    "yes_no": _parse_yes_no,
+    "address": _parse_address,
+}
+
+
+def _as_text(value):
+    """Converts non-string values, e.g. numbers from JSON imports, to stripped text."""
+    return "" if value is None else str(value).strip()
+
+
+def compile_validator(schema, name="validate"):
     """
-    Validates the input for the historical places service.
+    Builds the validator function of a service schema. The parser of each
+    field is looked up once here, so validating a record costs a few dict
+    lookups and string checks per field.
 
     Parameters:
-    user_data (dict): A dictionary containing user inputs for the historical places service.
+    schema (tuple): The Field definitions of the service.
+    name (str): Name of the returned function.
 
     Returns:
-    dict: Contains either validated data or an error message.
+    function: Takes the user data dict and returns {"success": True, "service_data": ...}
+    or {"success": False, "errors": [...]}.
     """
-    location = user_data.get("location", "").strip()
-    hotel_address = user_data.get("hotel_address", "").strip()
-    num_people = user_data.get("number_of_people", "").strip()
-    total_budget = user_data.get("total_budget", "").strip()
-    max_ticket_price = user_data.get("max_ticket_price", "").strip()
+    fields = tuple((field, _PARSERS[field.kind]) for field in schema)
+
+    def validator(user_data):
+        get = user_data.get
+        errors = []
+        service_data = {}
+        for field, parse in fields:
+            for source in field.sources:
+                value = get(source)
+                if value is not None:
+                    break
+            text = _as_text(value)
+            if text:
+                value, valid = parse(text)
+                if not valid:
+                    errors.append(field.error)
+            else:
+                value = field.empty
+                if field.required:
+                    errors.append(field.error)
+            service_data[field.name] = value
+        if errors:
+            return {"success": False, "errors": errors}
+        return {"success": True, "service_data": service_data}
+
+    validator.__name__ = validator.__qualname__ = name
+    return validator
+
+
+_restaurant_finder_validator = compile_validator(RESTAURANT_FINDER_SCHEMA, "restaurant_finder_validator")
+_historical_places_validator = compile_validator(HISTORICAL_PLACES_SCHEMA, "historical_places_validator")
+_mystery_guide_validator = compile_validator(MYSTERY_GUIDE_SCHEMA, "mystery_guide_validator")
 
-    errors = []
 
-    # Validate location
-    if not location:
-        errors.append("Location is required.")
-
-    # Validate hotel address (should not be empty if provided)
-    if hotel_address and len(hotel_address) < 5:
-        errors.append("Hotel address must be at least 5 characters long.")
+def validate_restaurant_finder(user_data):
+    """
+    Validates the input for the restaurant finder service.
 
-    # Validate number of people (must be a positive integer)
-    if num_people and (not num_people.isdigit() or int(num_people) <= 0):
-        errors.append("Number of people must be a positive number.")
+    Parameters:
+    user_data (dict): A dictionary containing user inputs for the restaurant finder service.
 
-    # Validate total budget (must be a positive number)
-    if total_budget and (not total_budget.isdigit() or int(total_budget) <= 0):
-        errors.append("Total budget must be a positive number.")
+    Returns:
+    dict: Contains either validated data or an error message.
+    """
+    return _restaurant_finder_validator(user_data)
 
-    # Validate max ticket price (must be a positive number)
-    if max_ticket_price and (not max_ticket_price.isdigit() or int(max_ticket_price) <= 0):
-        errors.append("Max ticket price must be a positive number.")
 
-    # Return results
-    if errors:
-        return {"success": False, "errors": errors}
+def validate_historical_places(user_data):
+    """
+    Validates the input for the historical places service.
 
-    service_data = {
-        "location": location,
-        "hotel_address": hotel_address,
-        "num_people": int(num_people) if num_people.isdigit() else None,
-        "total_budget": int(total_budget) if total_budget.isdigit() else None,
-        "max_ticket_price": int(max_ticket_price) if max_ticket_price.isdigit() else None
-    }
+    Parameters:
+    user_data (dict): A dictionary containing user inputs for the historical places service.
 
-    return {"success": True, "service_data": service_data}
+    Returns:
+    dict: Contains either validated data or an error message.
+    """
+    return _historical_places_validator(user_data)
 
 
 def validate_mystery_guide(user_data):
@@ -104,38 +164,46 @@ def validate_mystery_guide(user_data):
     Returns:
     dict: Contains either validated data or an error message.
     """
-    public_transport = user_data.get("public_transport", "").strip()
-    budget = user_data.get("budget", "").strip()
-    days_spent = user_data.get("days_spent", "").strip()
-    preferences = user_data.get("preferences", "").strip()
+    return _mystery_guide_validator(user_data)
 
-    errors = []
 
-    # Validate public transport (optional, should be 'yes' or 'no')
-    if public_transport and public_transport.lower() not in ["yes", "no"]:
-        errors.append("Public transport should be 'yes' or 'no'.")
+# Schemas by service number, as chosen in TripPlanner
+SERVICE_SCHEMAS = {
+    "1": RESTAURANT_FINDER_SCHEMA,
+    "2": HISTORICAL_PLACES_SCHEMA,
+    "3": MYSTERY_GUIDE_SCHEMA,
+}
 
-    # Validate budget (must be a positive number)
-    if budget and (not budget.isdigit() or int(budget) <= 0):
-        errors.append("Budget must be a positive number.")
+# Validators by service number, as chosen in TripPlanner
+SERVICE_VALIDATORS = {
+    "1": _restaurant_finder_validator,
+    "2": _historical_places_validator,
+    "3": _mystery_guide_validator,
+}
 
-    # Validate days spent (must be a positive integer)
-    if days_spent and (not days_spent.isdigit() or int(days_spent) <= 0):
-        errors.append("Days spent must be a positive number.")
 
-    # Return results
-    if errors:
-        return {"success": False, "errors": errors}
-
-    service_data = {
-        "public_transport": public_transport.lower() if public_transport else None,
-        "budget": int(budget) if budget.isdigit() else None,
-        "days_spent": int(days_spent) if days_spent.isdigit() else None,
-        "preferences": preferences if preferences else None
-    }
+def validate_many(records, service=None):
+    """
+    Validates a list or stream of records in one pass.
 
- service_handler
-    return {"success": True, "service_data": service_data}
+    Parameters:
+    records (iterable): User data dicts. Without a service argument, each
+    record names its own service under the "service" key.
+    service (str): Optional service number ("1", "2" or "3") for all records.
 
-    return {"success": True, "service_data": service_data}
- main
+    Returns:
+    generator: One validation result per record, in order. Records with an
+    unknown service get {"success": False, "errors": ["Unknown service."]}.
+    """
+    if service is not None:
+        validator = SERVICE_VALIDATORS[service]
+        for record in records:
+            yield validator(record)
+        return
+
+    for record in records:
+        validator = SERVICE_VALIDATORS.get(str(record.get("service", "")))
+        if validator is None:
+            yield {"success": False, "errors": ["Unknown service."]}
+        else:
+            yield validator(record)
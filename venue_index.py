@@ -0,0 +1,208 @@
+"""
+Structured recommendation results and a local index of the venues in them.
+
+With structured results enabled, the restaurant and attraction services ask
+the model for a JSON list of venues (name, category, price estimate, link,
+neighbourhood) instead of free-form text. The venues are stored by city,
+requested category and price, so that a later query such as "Italian in
+Rome, budget 60" can be answered by filtering the venues found for
+"Italian in Rome, budget 80", and the model is only asked for the venues
+that are missing.
+"""
+import json
+import re
+import sqlite3
+import threading
+import time
+from response_cache import DEFAULT_TTLS, normalize_text
+
+# Structured output format of the Responses API, see build_websearch_request()
+VENUE_FORMAT = {
+    "type": "json_schema",
+    "name": "venues",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "venues": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "name": {"type": "string"},
+                        "category": {"type": "string"},
+                        "price_estimate": {"type": ["number", "null"]},
+                        "link": {"type": ["string", "null"]},
+                        "neighbourhood": {"type": ["string", "null"]},
+                    },
+                    "required": ["name", "category", "price_estimate", "link", "neighbourhood"],
+                    "additionalProperties": False,
+                },
+            },
+        },
+        "required": ["venues"],
+        "additionalProperties": False,
+    },
+}
+
+VENUE_FIELDS = ("name", "category", "price_estimate", "link", "neighbourhood")
+
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+
+
+def structured_instructions(count, known_names=()):
+    """Appended to the system prompt when venues are requested as structured output."""
+    instructions = (
+        f"\n\nReturn {count} venues as JSON. For each venue give its name, its category "
+        "(e.g. the cuisine or type of attraction), price_estimate as the typical price per person "
+        "in the budget's currency (0 if free, null if unknown), a link to its official website "
+        "(null if none) and its neighbourhood (null if unknown)."
+    )
+    if known_names:
+        instructions += " Do not include these venues: " + "; ".join(known_names) + "."
+    return instructions
+
+
+def parse_budget(budget):
+    """Returns the first number in a budget such as "80" or "80 EUR", or None."""
+    match = _NUMBER.search(str(budget))
+    return float(match.group()) if match else None
+
+
+def parse_venues(text):
+    """
+    Reads the venues of a structured answer.
+
+    Returns:
+    list: Venue dicts with the keys of VENUE_FIELDS, or None if the text is
+    not a structured answer.
+    """
+    try:
+        venues = json.loads(text)["venues"]
+    except (ValueError, TypeError, KeyError):
+        return None
+    if not isinstance(venues, list):
+        return None
+    parsed = []
+    for venue in venues:
+        if not isinstance(venue, dict) or not str(venue.get("name") or "").strip():
+            continue
+        price = venue.get("price_estimate")
+        parsed.append({
+            "name": str(venue["name"]).strip(),
+            "category": str(venue.get("category") or "").strip(),
+            "price_estimate": float(price) if isinstance(price, (int, float)) else None,
+            "link": venue.get("link") or None,
+            "neighbourhood": venue.get("neighbourhood") or None,
+        })
+    return parsed
+
+
+def format_venues(venues):
+    """Formats venues as a WhatsApp answer."""
+    lines = []
+    for number, venue in enumerate(venues, 1):
+        heading = f"{number}. {venue['name']}"
+        details = [part for part in (venue["category"], venue["neighbourhood"]) if part]
+        if details:
+            heading += " - " + ", ".join(details)
+        lines.append(heading)
+        price = venue["price_estimate"]
+        if price is not None:
+            lines.append("   Free" if price == 0 else f"   About {price:g} per person")
+        if venue["link"]:
+            lines.append(f"   {venue['link']}")
+    return "\n".join(lines)
+
+
+class VenueIndex:
+    """
+    Venues from structured answers in a SQLite database in WAL mode shared
+    by every worker process, keyed by service, city, requested category
+    and venue name. Venues are forgotten after the TTL of their service.
+
+    query() returns the venues of a city and category within a budget,
+    most often recommended first, then the ones closest to the budget.
+    """
+
+    def __init__(self, path, ttls=None):
+        self.path = path
+        self.ttls = dict(DEFAULT_TTLS)
+        if ttls:
+            self.ttls.update(ttls)
+        self._conn = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.partial_hits = 0
+        self.misses = 0
+        self.added = 0
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS venues ("
+                "service TEXT, city TEXT, category TEXT, key TEXT, name TEXT, venue_category TEXT, "
+                "price REAL, link TEXT, neighbourhood TEXT, seen INTEGER, expires_at REAL, "
+                "PRIMARY KEY (service, city, category, key)) WITHOUT ROWID"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def add(self, service, city, category, venues):
+        """Stores the venues found for a city and category, refreshing ones already known."""
+        now = time.time()
+        expires_at = now + self.ttls.get(service, max(self.ttls.values()))
+        city, category = normalize_text(city), normalize_text(category)
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM venues WHERE service = ? AND city = ? AND category = ? AND expires_at <= ?",
+                         (service, city, category, now))
+            for venue in venues:
+                conn.execute(
+                    "INSERT INTO venues (service, city, category, key, name, venue_category, price, link, "
+                    "neighbourhood, seen, expires_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1, ?) "
+                    "ON CONFLICT (service, city, category, key) DO UPDATE SET "
+                    "name = excluded.name, venue_category = excluded.venue_category, price = excluded.price, "
+                    "link = excluded.link, neighbourhood = excluded.neighbourhood, seen = seen + 1, "
+                    "expires_at = excluded.expires_at",
+                    (service, city, category, normalize_text(venue["name"]), venue["name"], venue["category"],
+                     venue["price_estimate"], venue["link"], venue["neighbourhood"], expires_at),
+                )
+            conn.commit()
+            self.added += len(venues)
+
+    def query(self, service, city, category, budget, limit):
+        """
+        Returns up to limit venues of the city and category whose price
+        estimate fits the budget; venues without a price come last.
+        """
+        max_price = parse_budget(budget)
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT name, venue_category, price, link, neighbourhood FROM venues "
+                "WHERE service = ? AND city = ? AND category = ? AND expires_at > ? "
+                "AND (price IS NULL OR ? IS NULL OR price <= ?) "
+                "ORDER BY seen DESC, price IS NULL, price DESC LIMIT ?",
+                (service, normalize_text(city), normalize_text(category), time.time(),
+                 max_price, max_price, limit),
+            ).fetchall()
+        return [dict(zip(VENUE_FIELDS, row)) for row in rows]
+
+    def record_lookup(self, found, wanted):
+        """Counts a lookup as a hit, a partial hit or a miss."""
+        with self._lock:
+            if found >= wanted:
+                self.hits += 1
+            elif found:
+                self.partial_hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self):
+        """Returns the lookup counters of this process and the venues it added."""
+        with self._lock:
+            return {"hits": self.hits, "partial_hits": self.partial_hits, "misses": self.misses,
+                    "added": self.added}